@@ -0,0 +1,745 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the IRC client
+
+Each benchmark prints its results and returns them as a dict; with --json
+they are also written out together with the Python version and git
+revision, so runs of different versions can be compared for regressions.
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import queue
+import re
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+from irc_async import AsyncIRCClient, IRCEventLoop
+from irc_client import IRCClient
+from irc_fake_server import FakeIRCServer
+from irc_parser import parse_message
+from irc_web_session import SessionRegistry, message_event, message_targets
+
+# Lines roughly in the proportions seen on a busy channel
+SAMPLE_LINES = [
+    ":alice!alice@host.example.com PRIVMSG #python :has anyone tried the new release?",
+    ":bob!~bob@203.0.113.7 PRIVMSG #python :yes, the parser is a lot faster",
+    ":carol!carol@user/carol PRIVMSG #python :\x01ACTION waves\x01",
+    ":dave!dave@gateway/web/dave JOIN #python",
+    ":erin!erin@192.0.2.1 PART #python :Leaving",
+    ":frank!frank@198.51.100.2 QUIT :Ping timeout: 260 seconds",
+    ":grace!grace@host NICK grace_away",
+    ":irc.libera.chat 353 me = #python :@op +voiced alice bob carol dave",
+    ":irc.libera.chat 332 me #python :Welcome to #python | Be nice",
+    "PING :irc.libera.chat",
+]
+
+LEGACY_PATTERN = r'^(?::([^ ]+) )?([^ ]+)(?: ((?:[^: ][^ ]* ?)*))?(?: :(.*))?$'
+
+
+def legacy_parse(message):
+    """The parse previously performed by IRCClient.process_message"""
+    match = re.match(LEGACY_PATTERN, message)
+    if not match:
+        return None
+    prefix, command, params_str, trailing = match.groups()
+    params = (params_str or '').split()
+    if trailing:
+        params.append(trailing)
+    return prefix, command, params
+
+
+def legacy_double_parse(message):
+    """IRCClient followed by CustomIRCClient each parsing the same line"""
+    legacy_parse(message)
+    return legacy_parse(message)
+
+
+def run_lines(func, lines, repeat):
+    """Run func over lines repeat times and return lines per second"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for line in lines:
+            func(line)
+    elapsed = time.perf_counter() - start
+    return len(lines) * repeat / elapsed
+
+
+def bench_parser(repeat):
+    """Compare the legacy double regex parse with the single-pass parser"""
+    before = run_lines(legacy_double_parse, SAMPLE_LINES, repeat)
+    after = run_lines(parse_message, SAMPLE_LINES, repeat)
+    print("Parser (lines/sec):")
+    print(f"  before (regex, parsed twice): {before:,.0f}")
+    print(f"  after  (parse_message once):  {after:,.0f}")
+    print(f"  speedup: {after / before:.2f}x")
+    return {'before_lines_per_sec': before, 'after_lines_per_sec': after}
+
+
+def quiet_client():
+    """An IRCClient that never touches the network"""
+    client = IRCClient("irc.example.com", 6667, "me")
+    client.send = lambda message: None
+    return client
+
+
+def bench_dispatch(repeat):
+    """Lines/sec through IRCClient.handle_message and process_message"""
+    client = quiet_client()
+    messages = [parse_message(line) for line in SAMPLE_LINES]
+    with contextlib.redirect_stdout(io.StringIO()):
+        handled = run_lines(client.handle_message, messages, repeat)
+    # process_message also logs, parses and dispatches each raw line
+    client = quiet_client()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        processed = run_lines(client.process_message, SAMPLE_LINES, repeat)
+    print("Dispatch (lines/sec):")
+    print(f"  handle_message:  {handled:,.0f}")
+    print(f"  process_message: {processed:,.0f}")
+    return {'handle_message_lines_per_sec': handled, 'process_message_lines_per_sec': processed}
+
+
+def legacy_receive(sock, process):
+    """The str-buffer receive loop previously used by IRCClient"""
+    buffer = ""
+    while True:
+        data = sock.recv(4096).decode('utf-8', errors='ignore')
+        if not data:
+            break
+        buffer += data
+        lines = buffer.split("\r\n")
+        buffer = lines.pop()
+        for line in lines:
+            process(line)
+
+
+def client_receive(sock, process):
+    """IRCClient.receive_messages reading from sock"""
+    client = quiet_client()
+    client.socket = sock
+    client.running = True
+    client.process_message = process
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.receive_messages()
+
+
+def socketpair_throughput(receive, payload):
+    """Push payload through a socketpair into receive and return bytes/sec"""
+    reader, writer = socket.socketpair()
+    count = [0]
+
+    def process(line):
+        count[0] += 1
+
+    def write():
+        writer.sendall(payload)
+        writer.close()
+
+    thread = threading.Thread(target=write)
+    start = time.perf_counter()
+    thread.start()
+    receive(reader, process)
+    elapsed = time.perf_counter() - start
+    thread.join()
+    reader.close()
+    return len(payload) / elapsed, count[0]
+
+
+def bench_receive(megabytes):
+    """Compare the legacy and bytearray receive loops over a socketpair"""
+    # A /list burst: many short lines, plus one long line to stress framing,
+    # which LineBuffer drops for being over MAX_LINE_LENGTH
+    line = ":irc.libera.chat 322 me #channel 42 :[+nt] A topic with ünïcödé\r\n".encode('utf-8')
+    payload = line * (megabytes * 1024 * 1024 // len(line))
+    payload += b":s NOTICE me :" + b"x" * 200000 + b"\r\n"
+
+    print("Receive loop over a socketpair (MB/sec):")
+    results = {}
+    for key, name, receive in (('before', "before (str buffer)", legacy_receive),
+                               ('after', "after  (bytearray)", client_receive)):
+        rate, lines = socketpair_throughput(receive, payload)
+        print(f"  {name}: {rate / 1e6:,.1f} ({lines:,} lines)")
+        results[key] = {'bytes_per_sec': rate, 'lines': lines}
+    return results
+
+
+def legacy_quit(channel_users, nick):
+    """QUIT handling before the reverse index: probe every channel"""
+    for ch, users in channel_users.items():
+        if nick in users:
+            users.remove(nick)
+
+
+def bench_netsplit(channels, users):
+    """Cost of a netsplit QUIT burst while sitting in many channels"""
+    def populate(client):
+        # Each user shares a handful of channels with us
+        for i in range(users):
+            for j in range(3):
+                client.members.add(f"#chan{(i * 7 + j) % channels}", f"user{i}")
+
+    quits = [parse_message(f":user{i}!u@h QUIT :*.net *.split") for i in range(users)]
+
+    client = quiet_client()
+    populate(client)
+    start = time.perf_counter()
+    for msg in quits:
+        legacy_quit(client.channel_users, msg.nick)
+    before = time.perf_counter() - start
+
+    client = quiet_client()
+    populate(client)
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for msg in quits:
+            client.handle_message(msg)
+        after = time.perf_counter() - start
+
+    print(f"Netsplit ({users} QUITs, {channels} channels):")
+    print(f"  before (scan every channel): {before * 1000:.1f} ms")
+    print(f"  after  (nick -> channels):   {after * 1000:.1f} ms")
+    return {'before_seconds': before, 'after_seconds': after}
+
+
+def burst_lines(channels, users):
+    """JOIN, NICK, PART and QUIT bursts of users spread over channels"""
+    return {
+        'join': [f":joiner{i}!u@h JOIN #chan{i % channels}" for i in range(users)],
+        'nick': [f":user{i}!u@h NICK renamed{i}" for i in range(users)],
+        'part': [f":renamed{i}!u@h PART #chan{(i * 7) % channels} :bye" for i in range(users)],
+        'quit': [f":renamed{i}!u@h QUIT :*.net *.split" for i in range(users)],
+    }
+
+
+def bench_state_bursts(channel_counts, users):
+    """Cost of JOIN/PART/QUIT/NICK bursts on channel_users by channels joined"""
+    print(f"State bursts ({users} lines each, through process_message, ms):")
+    print(f"  {'channels':>8} {'join':>8} {'nick':>8} {'part':>8} {'quit':>8}")
+    results = {}
+    for channels in channel_counts:
+        client = quiet_client()
+        for i in range(users):
+            for j in range(3):
+                client.members.add(f"#chan{(i * 7 + j) % channels}", f"user{i}")
+        timings = {}
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            # In this order each burst acts on the users left by the one before
+            for kind, lines in burst_lines(channels, users).items():
+                start = time.perf_counter()
+                for line in lines:
+                    client.process_message(line)
+                timings[kind] = time.perf_counter() - start
+        print(f"  {channels:>8,} " + " ".join(f"{timings[kind] * 1000:8.1f}" for kind in timings))
+        results[str(channels)] = {kind: {'seconds': seconds, 'lines_per_sec': users / seconds}
+                                  for kind, seconds in timings.items()}
+    return results
+
+
+def bench_member_list(users, updates=200):
+    """Producing a sorted member list after each join/part in a big channel"""
+    client = quiet_client()
+    names = [("@" if i % 50 == 0 else "+" if i % 10 == 0 else "") + f"user{i}" for i in range(users)]
+    client.members.stage_names("#big", names)
+    client.members.finish_names("#big")
+    members = client.members
+
+    start = time.perf_counter()
+    for i in range(updates):
+        members.add("#big", f"joiner{i}", "+" if i % 2 else "")
+        modes = members.channel_modes["#big"]
+        sorted(modes, key=lambda nick: members.sort_key(nick, modes[nick]))
+    before = (time.perf_counter() - start) / updates
+
+    start = time.perf_counter()
+    for i in range(updates):
+        members.remove("#big", f"joiner{i}")
+        members.member_list("#big")
+    after = (time.perf_counter() - start) / updates
+
+    # Bytes sent to the browser per change: the whole list, or a delta as
+    # built by the web GUI's member listener
+    deltas = []
+    members.listener = lambda channel, version, op, nick, value: deltas.append(
+        {'channel': channel, 'version': version, 'op': op, 'nick': nick, 'prefix': (value or '')[:1]})
+    for i in range(updates):
+        members.add("#big", f"joiner{i}", "+" if i % 2 else "")
+    members.listener = None
+    full = len(json.dumps({'channel': "#big", 'users': members.member_list("#big")}))
+    delta = sum(len(json.dumps(d)) for d in deltas) / len(deltas)
+
+    print(f"Sorted member list ({users} users, per update):")
+    print(f"  full sort:          {before * 1000:.2f} ms")
+    print(f"  incremental view:   {after * 1000:.2f} ms")
+    print(f"  full list sent:     {full:,} bytes")
+    print(f"  delta sent:         {delta:,.0f} bytes")
+    return {'full_sort_seconds': before, 'incremental_seconds': after,
+            'full_list_bytes': full, 'delta_bytes': delta}
+
+
+def slow_emit(event, data, room=None):
+    """Stand-in for socketio.emit: a short blocking socket write"""
+    time.sleep(0.0001)
+
+
+def bench_fanout(session_count, lines):
+    """Web fan-out with a global lock versus per-session state"""
+    def run(handlers, args):
+        threads = [threading.Thread(target=lambda h=h: [h(*args) for _ in range(lines)])
+                   for h in handlers]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return session_count * lines / (time.perf_counter() - start)
+
+    # The handler previously created per session by handle_connect_to_server
+    clients_lock = threading.Lock()
+    message_buffers = {}
+
+    def legacy_handler(session_id):
+        message_buffers[session_id] = []
+
+        def message_handler(message):
+            with clients_lock:
+                if session_id in message_buffers:
+                    message_buffers[session_id].append(message)
+                    slow_emit('message', {'message': message}, room=session_id)
+        return message_handler
+
+    before = run([legacy_handler(i) for i in range(session_count)], (SAMPLE_LINES[0],))
+
+    sessions = SessionRegistry()
+    after = run([sessions.attach(i, None, slow_emit)[0].on_message for i in range(session_count)],
+                ('bench', parse_message(SAMPLE_LINES[0]), ['#python']))
+
+    print(f"Web fan-out ({session_count} sessions, lines/sec):")
+    print(f"  before (global clients_lock): {before:,.0f}")
+    print(f"  after  (per-session lock):    {after:,.0f}")
+    return {'before_lines_per_sec': before, 'after_lines_per_sec': after}
+
+
+def bench_scrollback(lines):
+    """Memory held by one session after a long run of traffic"""
+    data = [line.encode('utf-8') for line in SAMPLE_LINES]
+    client = quiet_client()
+
+    def retained(handler):
+        tracemalloc.start()
+        for i in range(lines):
+            # Decode each time so every message holds its own strings, as received ones do
+            msg = parse_message(data[i % len(data)].decode('utf-8'))
+            handler(msg, message_targets(msg, client))
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return size
+
+    # The per-session list previously kept by the web GUI
+    message_buffer = []
+    before = retained(lambda msg, targets: message_buffer.append(msg.raw))
+
+    session = SessionRegistry(emit_max_inflight=0).attach('bench', None, lambda event, data, callback=None: None)[0]
+    after = retained(lambda msg, targets: session.on_message('bench', msg, targets))
+
+    print(f"Session memory after {lines:,} lines:")
+    print(f"  unbounded list:      {before / 1024:,.0f} KiB")
+    print(f"  bounded scrollback:  {after / 1024:,.0f} KiB")
+    return {'unbounded_bytes': before, 'scrollback_bytes': after}
+
+
+def bench_events(repeat):
+    """JSON payload size and build cost of the events sent per line"""
+    client = quiet_client()
+    for nick in ("frank", "grace"):
+        client.members.add("#python", nick)
+    sent = []
+    session = SessionRegistry(emit_window=0).attach('bench', None, lambda event, data, callback=None: sent.append(data))[0]
+    messages = [parse_message(line) for line in SAMPLE_LINES]
+    routed = [(msg, message_targets(msg, client)) for msg in messages]
+
+    # What the web GUI sent before: the raw line for the browser to parse
+    before = sum(len(json.dumps({'message': msg.raw, 'targets': targets, 'network': 'bench'}))
+                 for msg, targets in routed
+                 if targets)
+    for msg, targets in routed:
+        session.on_message('bench', msg, targets)
+    after = sum(len(json.dumps(data)) for data in sent)
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for msg in messages:
+            message_event(msg)
+    elapsed = time.perf_counter() - start
+
+    print(f"Browser events ({len(SAMPLE_LINES)} sample lines):")
+    print(f"  raw lines JSON:      {before} bytes")
+    print(f"  typed events JSON:   {after} bytes")
+    print(f"  message_event():     {repeat * len(messages) / elapsed:,.0f} lines/sec")
+    return {'raw_bytes': before, 'typed_bytes': after,
+            'message_event_lines_per_sec': repeat * len(messages) / elapsed}
+
+
+def bench_batching(lines, rate):
+    """Frames, throughput and latency of batched emits to one browser"""
+    messages = [parse_message(f":peer!p@h PRIVMSG #bench :{i}") for i in range(lines)]
+    targets = ['#bench']
+
+    def run(window, interval):
+        added = [0.0] * lines
+        latencies = []
+        frames = [0]
+
+        def emit(event, data, callback=None):
+            slow_emit(event, data)
+            now = time.perf_counter()
+            frames[0] += 1
+            for name, payload in data['events']:
+                latencies.append(now - added[int(payload['text'])])
+
+        # No acknowledgements here: this measures batching on its own
+        session = SessionRegistry(emit_window=window, emit_max_inflight=0).attach('bench', None, emit)[0]
+        start = time.perf_counter()
+        for i, msg in enumerate(messages):
+            if interval:
+                # Busy-wait to the line's arrival time; sleep() is too coarse
+                while time.perf_counter() < start + i * interval:
+                    pass
+            added[i] = time.perf_counter()
+            session.on_message('bench', msg, targets)
+        while len(latencies) < lines:
+            time.sleep(0.001)
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        return frames[0], lines / elapsed, latencies[len(latencies) // 2], latencies[-1]
+
+    results = {}
+    for key, label, interval in (('burst', "burst", 0), ('paced', f"{rate:,} lines/sec", 1.0 / rate)):
+        print(f"Batched emits ({lines:,} lines, {label}):")
+        for window in (0, 0.01, 0.05):
+            frames, throughput, median, worst = run(window, interval)
+            name = "unbatched" if not window else f"{window * 1000:.0f} ms window"
+            print(f"  {name:16} {frames:6,} frames  {throughput:9,.0f} lines/sec  "
+                  f"median {median * 1000:5.1f} ms  max {worst * 1000:6.1f} ms")
+            results.setdefault(key, {})[str(window)] = {
+                'frames': frames, 'lines_per_sec': throughput,
+                'median_seconds': median, 'max_seconds': worst}
+    return results
+
+
+def bench_slow_browser(lines, batch_time=0.02):
+    """Backlog held for a browser that handles one batch per batch_time"""
+    client = quiet_client()
+    routed = []
+    for i in range(lines):
+        msg = parse_message(SAMPLE_LINES[i % len(SAMPLE_LINES)])
+        routed.append((msg, message_targets(msg, client)))
+
+    def run(**options):
+        frames = queue.Queue()
+        backlog = [0, 0]  # events not yet handled by the browser, peak
+        lock = threading.Lock()
+
+        def emit(event, data, callback=None):
+            with lock:
+                backlog[0] += len(data['events'])
+                backlog[1] = max(backlog[1], backlog[0] + len(session.events.events))
+            frames.put((data, callback))
+
+        def browser():
+            while True:
+                data, callback = frames.get()
+                if data is None:
+                    return
+                time.sleep(batch_time)
+                with lock:
+                    backlog[0] -= len(data['events'])
+                if callback:
+                    callback()
+
+        session = SessionRegistry(**options).attach('bench', None, emit)[0]
+        thread = threading.Thread(target=browser)
+        thread.start()
+        for msg, targets in routed:
+            session.on_message('bench', msg, targets)
+        while session.events.stats()['queue_depth'] or backlog[0]:
+            time.sleep(0.01)
+        frames.put((None, None))
+        thread.join()
+        return backlog[1], session.events.stats()
+
+    print(f"Slow browser ({lines:,} lines in a burst, {batch_time * 1000:.0f} ms per batch):")
+    peak, stats = run(emit_max_inflight=0)
+    print(f"  unbounded:  peak backlog {peak:6,} events")
+    results = {'unbounded': {'peak_backlog': peak}}
+    for policy in ('drop', 'collapse', 'replay'):
+        peak, stats = run(emit_policy=policy)
+        print(f"  {policy:10}  peak backlog {peak:6,} events  dropped {stats['dropped']:6,}  "
+              f"collapsed {stats['collapsed']:6,}  resyncs {stats['resyncs']}")
+        results[policy] = {'peak_backlog': peak, 'dropped': stats['dropped'],
+                           'collapsed': stats['collapsed'], 'resyncs': stats['resyncs']}
+    return results
+
+
+async def start_welcome_server(lines):
+    """Local server that welcomes each client and then sends it lines"""
+    burst = b":server 001 bench :Welcome\r\n"
+    burst += b":peer!p@h PRIVMSG #bench :benchmark line\r\n" * lines
+
+    async def handle(reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if line.startswith(b"USER"):
+                writer.write(burst)
+        writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0, backlog=4096)
+
+
+class DeliveryCounter:
+    """Counts PRIVMSGs handled across clients and signals when all arrived"""
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.count = 0
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+
+    def __call__(self, msg):
+        with self.lock:
+            self.count += 1
+            if self.count >= self.expected:
+                self.done.set()
+
+
+def run_engine(engine, connections, lines, server_port):
+    """Connect clients with one engine and wait until every line arrived"""
+    counter = DeliveryCounter(connections * lines)
+    clients = []
+    client_loop = IRCEventLoop() if engine == "asyncio" else None
+    start = time.perf_counter()
+
+    if engine == "asyncio":
+        async def connect_all():
+            for i in range(connections):
+                client = AsyncIRCClient("127.0.0.1", server_port, f"bench{i}")
+                client.add_handler('PRIVMSG', counter)
+                clients.append(client)
+            return await asyncio.gather(*(client.connect_async() for client in clients))
+        connected = sum(client_loop.run_coroutine(connect_all()))
+    else:
+        connected = 0
+        for i in range(connections):
+            client = IRCClient("127.0.0.1", server_port, f"bench{i}")
+            client.add_handler('PRIVMSG', counter)
+            clients.append(client)
+            connected += client.connect()
+
+    counter.done.wait(120)
+    elapsed = time.perf_counter() - start
+    threads = threading.active_count()
+
+    for client in clients:
+        client.disconnect()
+    time.sleep(0.5)
+    if client_loop:
+        client_loop.stop()
+
+    return {
+        'connected': connected,
+        'lines_delivered': counter.count,
+        'seconds': elapsed,
+        'threads': threads,
+    }
+
+
+def bench_engines(connections, lines):
+    """Compare the threaded and asyncio engines with many connections"""
+    server_loop = IRCEventLoop()
+    server = server_loop.run_coroutine(start_welcome_server(lines))
+    port = server.sockets[0].getsockname()[1]
+
+    print(f"Engines ({connections} connections, {lines} lines each):")
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        results = [(engine, run_engine(engine, connections, lines, port))
+                   for engine in ("thread", "asyncio")]
+    for engine, result in results:
+        print(f"  {engine:7}: {result['seconds']:.2f}s, "
+              f"{result['connected']} connected, "
+              f"{result['lines_delivered']:,} lines, "
+              f"{result['threads']} threads")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(f"  peak RSS: {peak / 1024 / 1024:.0f} MB")
+
+    server.close()
+    server_loop.stop()
+    results = dict(results)
+    results['peak_rss_bytes'] = peak
+    return results
+
+
+async def stamped_lines(server, nick, channel, rate, count):
+    """Have a simulated user send count lines, each holding its send time"""
+    start = time.perf_counter()
+    for n in range(count):
+        server.say(nick, channel, repr(time.perf_counter()))
+        delay = start + (n + 1) / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def end_to_end_latencies(client_class, server, port, sender, window, lines, rate):
+    """Latencies from the fake server writing a line to its Socket.IO emit"""
+    latencies = []
+    done = threading.Event()
+
+    def emit(event, data, callback=None):
+        now = time.perf_counter()
+        if event != 'messages':
+            return
+        for name, payload in data['events']:
+            if payload.get('type') == 'privmsg' and payload.get('nick') == sender:
+                latencies.append(now - float(payload['text']))
+        if len(latencies) >= lines:
+            done.set()
+
+    session = SessionRegistry(emit_window=window, emit_max_inflight=0).attach('bench', None, emit)[0]
+    client = client_class("127.0.0.1", port, "bench", network='bench',
+                          message_callback=session.on_message,
+                          event_callback=session.send_event)
+    joined = threading.Event()
+    client.add_handler('366', lambda msg: joined.set())
+    if not client.connect():
+        return latencies
+    client.join_channel("#bench")
+    joined.wait(5)
+    server.call(stamped_lines, server, sender, "#bench", rate, lines)
+    done.wait(10)
+    client.disconnect()
+    return latencies
+
+
+def bench_end_to_end(lines, rate):
+    """Latency from an upstream line to its Socket.IO emit in CustomIRCClient"""
+    try:
+        from irc_client_gui_updated import AsyncCustomIRCClient, CustomIRCClient
+    except ImportError as e:
+        print(f"End-to-end latency: skipped ({e})")
+        return {'skipped': str(e)}
+
+    server = FakeIRCServer()
+    port = server.start_in_thread()
+    sender = server.call(server.populate, "#bench", 1)[0].nick
+    print(f"End-to-end latency ({lines:,} lines at {rate:,} lines/sec, fake server to emit):")
+    results = {}
+    try:
+        for engine, client_class in (("thread", CustomIRCClient), ("asyncio", AsyncCustomIRCClient)):
+            for window in (0, 0.05):
+                with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                    latencies = sorted(end_to_end_latencies(client_class, server, port, sender,
+                                                            window, lines, rate))
+                if not latencies:
+                    print(f"  {engine:7} no lines arrived")
+                    continue
+                median = latencies[len(latencies) // 2]
+                p99 = latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)]
+                name = "unbatched" if not window else f"{window * 1000:.0f} ms window"
+                print(f"  {engine:7} {name:16} median {median * 1000:6.2f} ms  "
+                      f"p99 {p99 * 1000:6.2f} ms  max {latencies[-1] * 1000:6.2f} ms")
+                results.setdefault(engine, {})[str(window)] = {
+                    'lines': len(latencies), 'median_seconds': median,
+                    'p99_seconds': p99, 'max_seconds': latencies[-1]}
+    finally:
+        server.stop()
+    return results
+
+
+def git_revision():
+    """The git revision of the working tree, or None outside a checkout"""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True,
+                              text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    """Parse arguments and run the benchmarks"""
+    parser = argparse.ArgumentParser(description="IRC Client benchmarks")
+    parser.add_argument("--repeat", type=int, default=20000, help="Iterations over the sample lines")
+    parser.add_argument("--megabytes", type=int, default=16, help="Data pushed through the receive loop")
+    parser.add_argument("--channels", type=int, default=300, help="Joined channels for the netsplit benchmark")
+    parser.add_argument("--users", type=int, default=2000, help="Users quitting in the netsplit benchmark")
+    parser.add_argument("--channel-size", type=int, default=10000, help="Users in the channel for the member list benchmark")
+    parser.add_argument("--sessions", type=int, default=50, help="Web sessions for the fan-out benchmark")
+    parser.add_argument("--session-lines", type=int, default=200, help="Lines per session in the fan-out benchmark")
+    parser.add_argument("--scrollback-lines", type=int, default=200000, help="Lines received by the session in the scrollback benchmark")
+    parser.add_argument("--emit-lines", type=int, default=5000, help="Lines sent to the browser in the batching benchmark")
+    parser.add_argument("--emit-rate", type=int, default=2000, help="Paced lines/sec in the batching benchmark")
+    parser.add_argument("--slow-lines", type=int, default=50000, help="Lines sent to a slow browser in the backpressure benchmark")
+    parser.add_argument("--connections", type=int, default=1000, help="Concurrent connections for the engine benchmark")
+    parser.add_argument("--lines", type=int, default=20, help="Lines sent to each connection in the engine benchmark")
+    parser.add_argument("--burst-channels", default="10,100,1000",
+                        help="Comma-separated joined channel counts for the state burst benchmark")
+    parser.add_argument("--latency-lines", type=int, default=2000, help="Lines timed in the end-to-end latency benchmark")
+    parser.add_argument("--latency-rate", type=int, default=500, help="Lines/sec sent in the end-to-end latency benchmark")
+    parser.add_argument("--only", help="Comma-separated benchmarks to run, e.g. parser,state")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results as JSON to FILE ('-' for stdout)")
+    args = parser.parse_args()
+
+    benchmarks = {
+        'parser': lambda: bench_parser(args.repeat),
+        'dispatch': lambda: bench_dispatch(args.repeat),
+        'receive': lambda: bench_receive(args.megabytes),
+        'netsplit': lambda: bench_netsplit(args.channels, args.users),
+        'state': lambda: bench_state_bursts([int(n) for n in args.burst_channels.split(',')], args.users),
+        'member_list': lambda: bench_member_list(args.channel_size),
+        'fanout': lambda: bench_fanout(args.sessions, args.session_lines),
+        'scrollback': lambda: bench_scrollback(args.scrollback_lines),
+        'events': lambda: bench_events(args.repeat),
+        'batching': lambda: bench_batching(args.emit_lines, args.emit_rate),
+        'slow_browser': lambda: bench_slow_browser(args.slow_lines),
+        'end_to_end': lambda: bench_end_to_end(args.latency_lines, args.latency_rate),
+        'engines': lambda: bench_engines(args.connections, args.lines),
+    }
+    names = args.only.split(',') if args.only else list(benchmarks)
+    unknown = [name for name in names if name not in benchmarks]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)} (choose from {', '.join(benchmarks)})")
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'started': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'arguments': vars(args),
+        'results': {},
+    }
+    # With JSON on stdout, the readable output goes to stderr instead
+    with contextlib.redirect_stdout(sys.stderr if args.json == '-' else sys.stdout):
+        for name in names:
+            report['results'][name] = benchmarks[name]()
+
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
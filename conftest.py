@@ -0,0 +1,7 @@
+"""
+pytest configuration
+
+The legacy test scripts are run by hand against a real network and the
+web GUI (see README.md); they are not collected with the offline tests.
+"""
+collect_ignore = ["test_irc_client.py", "test_irc_client_all.py", "test_irc_client_simple.py"]
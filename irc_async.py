@@ -0,0 +1,265 @@
+"""
+asyncio engine for the IRC client
+
+AsyncIRCClient has the same public methods and message handling as
+IRCClient, but instead of a receive thread and a writer thread per
+connection, any number of connections share one asyncio event loop.
+
+Code that is not itself running on the loop (the CLI, Flask-SocketIO
+handlers) can use the blocking connect()/disconnect()/send() methods,
+which hand the work over to the loop. Code running on the loop should
+await connect_async() instead.
+"""
+import asyncio
+import threading
+import time
+
+from irc_client import IRCClient
+from irc_framing import LineBuffer
+from irc_proxy import connect_via_proxy_async
+from irc_writer import OutboundQueue, DEFAULT_RATE, DEFAULT_BURST, PRIORITY_COMMANDS, line_command
+
+
+class IRCEventLoop:
+    """An asyncio event loop running in a background thread"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        """Thread target: run the loop until stop() is called"""
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def run_coroutine(self, coro, timeout=None):
+        """Run a coroutine on the loop and wait for its result
+
+        Must not be called from the loop thread itself.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def stop(self):
+        """Stop the loop and wait for its thread to finish"""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+shared_loop = None
+shared_loop_lock = threading.Lock()
+
+
+def get_shared_loop():
+    """The IRCEventLoop shared by every AsyncIRCClient by default"""
+    global shared_loop
+    with shared_loop_lock:
+        if shared_loop is None:
+            shared_loop = IRCEventLoop()
+        return shared_loop
+
+
+class AsyncIRCWriter(OutboundQueue):
+    """Flood-controlled writer for an asyncio transport
+
+    put() and close() may be called from any thread; the queue itself is
+    only touched on the event loop thread.
+    """
+
+    def __init__(self, loop, transport, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 max_queue=1000, bytes_per_token=None):
+        super().__init__(rate, burst, max_queue, bytes_per_token)
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.transport = transport
+        self.running = True
+        self.flush_scheduled = False
+        self.timer = None
+
+    def put(self, line):
+        """Queue a line (without CRLF) for sending
+
+        Returns:
+            False if the line was dropped. Lines put from other threads are
+            handed to the loop and always reported as queued.
+        """
+        if threading.get_ident() == self.loop_thread:
+            return self.put_now(line)
+        self.loop.call_soon_threadsafe(self.put_now, line)
+        return True
+
+    def put_many(self, lines):
+        """Queue several lines at once, so they go out in the same write"""
+        if threading.get_ident() == self.loop_thread:
+            return all([self.put_now(line) for line in lines])
+        self.loop.call_soon_threadsafe(lambda: [self.put_now(line) for line in lines])
+        return True
+
+    def put_now(self, line):
+        """Queue a line; must run on the loop thread"""
+        if not self.running or not self.push(line):
+            return False
+        # Flushing on the next loop iteration coalesces everything queued
+        # while handling the current batch of received data
+        if not self.flush_scheduled and (self.timer is None or line_command(line) in PRIORITY_COMMANDS):
+            self.flush_scheduled = True
+            self.loop.call_soon(self.flush)
+        return True
+
+    def flush(self):
+        """Write every line that may be sent now and schedule the rest"""
+        self.flush_scheduled = False
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.transport.is_closing():
+            self.clear()
+            return
+
+        batch, wait = self.take()
+        if batch:
+            self.transport.write(b''.join(data for data, queued_at in batch))
+            self.record_sent(batch)
+        if wait:
+            self.timer = self.loop.call_later(wait, self.flush)
+
+    def close(self, timeout=None):
+        """Flush priority lines (e.g. QUIT) and close the transport"""
+        if threading.get_ident() == self.loop_thread:
+            self.close_now()
+        else:
+            self.loop.call_soon_threadsafe(self.close_now)
+
+    def close_now(self):
+        """Close the writer; must run on the loop thread"""
+        self.running = False
+        self.clear(priority=False)
+        self.flush()
+        self.transport.close()
+
+
+class IRCProtocol(asyncio.Protocol):
+    """Feeds data received on a transport into an AsyncIRCClient"""
+
+    def __init__(self, client):
+        self.client = client
+        self.lines = LineBuffer()
+
+    def data_received(self, data):
+        if self.client.tracer:
+            self.client.received_at = self.client.tracer.now()
+        if self.client.link:
+            self.client.link.received()
+        for line in self.lines.feed(data):
+            self.client.process_message(line)
+
+    def connection_lost(self, exc):
+        self.client.connection_lost(exc)
+
+
+class AsyncIRCClient(IRCClient):
+    """IRC client whose connection runs on a shared asyncio event loop
+
+    Takes the same arguments as IRCClient, plus:
+        event_loop: The IRCEventLoop used by the blocking connect(). Defaults
+            to a loop shared by all clients.
+    """
+
+    def __init__(self, *args, event_loop=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.event_loop = event_loop
+        self.transport = None
+        self.reconnect_task = None
+
+    async def connect_async(self):
+        """Connect to the IRC server from a coroutine on the event loop"""
+        loop = asyncio.get_running_loop()
+        if not self.reconnecting:
+            self.closing = False
+        self.connect_started = time.monotonic()
+        self.connect_time = self.welcome_time = None
+        try:
+            tls = {}
+            if self.tls_context:
+                tls = {'ssl': self.tls_context, 'server_hostname': self.server}
+            if self.proxy:
+                sock = await connect_via_proxy_async(self.proxy, self.server, self.port)
+                self.transport, protocol = await loop.create_connection(
+                    lambda: IRCProtocol(self), sock=sock, **tls)
+            else:
+                self.transport, protocol = await loop.create_connection(
+                    lambda: IRCProtocol(self), self.server, self.port, **tls)
+        except OSError as e:
+            print(f"Connection error: {e}")
+            return False
+
+        self.writer = AsyncIRCWriter(loop, self.transport, rate=self.send_rate, burst=self.send_burst)
+        self.connect_time = time.monotonic() - self.connect_started
+
+        self.register()
+
+        self.running = True
+        self.start_keepalive()
+        return True
+
+    def connect(self):
+        """Connect to the IRC server, blocking until connected
+
+        Must not be called from the event loop thread; use connect_async there.
+        """
+        if self.event_loop is None:
+            self.event_loop = get_shared_loop()
+        return self.event_loop.run_coroutine(self.connect_async())
+
+    def tls_object(self):
+        """The SSLObject of a TLS connection, or None"""
+        return self.transport.get_extra_info('ssl_object') if self.transport else None
+
+    def schedule_keepalive(self, generation, deadline):
+        """Run keepalive_check(generation) on the loop at a time.monotonic() deadline"""
+        self.writer.loop.call_later(max(0.0, deadline - time.monotonic()), self.keepalive_check, generation)
+
+    def abort_connection(self):
+        """Drop the connection without QUIT, e.g. because the link is dead"""
+        if threading.get_ident() == self.writer.loop_thread:
+            self.transport.abort()
+        else:
+            self.writer.loop.call_soon_threadsafe(self.transport.abort)
+
+    def connection_lost(self, exc):
+        """Called by the protocol when the connection is closed"""
+        if self.running:
+            if exc:
+                print(f"Error receiving data: {exc}")
+            else:
+                print("Disconnected from server.")
+            self.running = False
+        self.connection_closed()
+
+    def start_reconnect_timer(self, delay):
+        """Run reconnect_async() after delay seconds; called on the loop thread"""
+        self.reconnect_timer = asyncio.get_running_loop().call_later(delay, self.start_reconnect)
+
+    def start_reconnect(self):
+        """Timer callback: start a reconnect attempt on the loop"""
+        self.reconnect_timer = None
+        self.reconnect_task = asyncio.ensure_future(self.reconnect_async())
+
+    def cancel_reconnect(self):
+        """Stop the pending reconnect timer, from any thread"""
+        timer = self.reconnect_timer
+        self.reconnect_timer = None
+        if timer and self.writer:
+            self.writer.loop.call_soon_threadsafe(timer.cancel)
+
+    async def reconnect_async(self):
+        """Connect again, scheduling another attempt if that fails"""
+        if not self.reconnecting:
+            return
+        if not await self.connect_async():
+            if self.reconnecting:
+                self.schedule_reconnect()
+        elif self.closing:
+            # disconnect() was called while connecting
+            self.disconnect()
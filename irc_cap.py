@@ -0,0 +1,220 @@
+"""
+IRCv3 capability negotiation and SASL authentication
+
+Registration starts with CAP LS 302, NICK and USER sent in one write.
+The server then holds registration until CAP END, which we send as soon
+as the capabilities we want are acknowledged and, if configured, SASL
+has logged us in. That replaces identifying to NickServ after the
+welcome, and the extra round trips and seconds it takes.
+
+CapNegotiation holds the state of one registration and returns the
+lines to send in reply to each CAP, AUTHENTICATE and SASL numeric.
+"""
+import base64
+from typing import NamedTuple, Optional
+
+# Capabilities requested when the server offers them
+DEFAULT_CAPS = ('multi-prefix',)
+
+SASL_MECHANISMS = ('PLAIN', 'EXTERNAL')
+
+# AUTHENTICATE payloads are sent in chunks of this many base64 characters
+SASL_CHUNK = 400
+
+# SASL numerics ending the exchange: logged in (903) or already logged
+# in (907), and failures with their meaning
+SASL_SUCCESS = ('903', '907')
+SASL_FAILURES = {
+    '902': "nick is locked",
+    '904': "authentication failed",
+    '905': "message too long",
+    '906': "aborted",
+}
+
+
+class SaslConfig(NamedTuple):
+    """How to authenticate with SASL; holds no state, so clients can share one
+
+    Attributes:
+        mechanism: 'PLAIN' (account name and password) or 'EXTERNAL' (the
+            TLS client certificate, e.g. registered with NickServ CertFP).
+        username: Account name for PLAIN.
+        password: Password for PLAIN.
+        allow_plaintext: Send the PLAIN password over a connection without
+            TLS, where anyone on the path can read it.
+    """
+    mechanism: str = 'PLAIN'
+    username: Optional[str] = None
+    password: Optional[str] = None
+    allow_plaintext: bool = False
+
+
+def sasl_config_error(sasl, tls_context):
+    """Why a SaslConfig cannot be used with a connection's TLS context, or None
+
+    PLAIN needs TLS unless allow_plaintext is set, and EXTERNAL needs a
+    client certificate, which create_tls_context() records as certfile.
+    """
+    if sasl.mechanism not in SASL_MECHANISMS:
+        return f"Unknown SASL mechanism: {sasl.mechanism}"
+    if sasl.mechanism == 'PLAIN' and tls_context is None and not sasl.allow_plaintext:
+        return "SASL PLAIN would send the password unencrypted; connect with TLS"
+    if sasl.mechanism == 'EXTERNAL' and getattr(tls_context, 'certfile', None) is None:
+        return "SASL EXTERNAL needs a TLS client certificate"
+    return None
+
+
+def parse_cap_list(text):
+    """Split a capability list into a dict of name -> value (None if no value)"""
+    caps = {}
+    for token in text.split():
+        name, _, value = token.partition('=')
+        caps[name] = value or None
+    return caps
+
+
+def sasl_plain_payload(username, password, authzid=''):
+    """The PLAIN response: authorization id, account name and password"""
+    return f"{authzid}\0{username}\0{password}".encode('utf-8')
+
+
+def authenticate_lines(payload):
+    """AUTHENTICATE lines carrying a payload, split into SASL_CHUNK pieces
+
+    An empty payload, or one filling its last chunk exactly, is ended by
+    'AUTHENTICATE +'.
+    """
+    encoded = base64.b64encode(payload).decode('ascii')
+    lines = [f"AUTHENTICATE {encoded[i:i + SASL_CHUNK]}" for i in range(0, len(encoded), SASL_CHUNK)]
+    if len(encoded) % SASL_CHUNK == 0:
+        lines.append("AUTHENTICATE +")
+    return lines
+
+
+class CapNegotiation:
+    """Capability negotiation and SASL of one connection's registration
+
+    Args:
+        wanted: Capabilities to request if the server offers them.
+        sasl: A SaslConfig, or None not to authenticate.
+
+    Attributes:
+        available: Capabilities offered by the server, name -> value.
+        enabled: Capabilities acknowledged by the server.
+        finished: Whether CAP END was sent, or the server has no CAP.
+        sasl_status: None until SASL is over, then 'success', 'failed'
+            or 'unavailable'.
+        sasl_error: Why SASL failed or was unavailable.
+        account: The account logged in to.
+    """
+
+    def __init__(self, wanted=DEFAULT_CAPS, sasl=None):
+        self.wanted = tuple(wanted)
+        self.sasl = sasl
+        self.available = {}
+        self.enabled = set()
+        self.finished = False
+        self.sasl_status = None
+        self.sasl_error = None
+        self.account = None
+
+    def start(self):
+        """The line starting negotiation, sent along with NICK and USER"""
+        return "CAP LS 302"
+
+    def end(self):
+        """CAP END, unless it was sent already"""
+        if self.finished:
+            return []
+        self.finished = True
+        return ["CAP END"]
+
+    def sasl_unavailable(self, reason):
+        """Note that SASL cannot be used with this server"""
+        self.sasl_status = 'unavailable'
+        self.sasl_error = reason
+
+    def on_cap(self, params):
+        """Handle a CAP reply; returns the lines to send
+
+        Args:
+            params: The CAP message's parameters: target, subcommand, then
+                '*' if more lines follow, and the capability list.
+        """
+        if len(params) < 3:
+            return []
+        subcommand = params[1].upper()
+        caps = params[-1]
+        more = len(params) > 3 and params[2] == '*'
+
+        if subcommand == 'LS':
+            self.available.update(parse_cap_list(caps))
+            if more or self.finished:
+                return []
+            return self.request()
+        if subcommand == 'ACK':
+            for name in caps.split():
+                if name.startswith('-'):
+                    self.enabled.discard(name[1:])
+                else:
+                    self.enabled.add(name)
+            if self.finished:
+                return []
+            if 'sasl' in self.enabled and self.sasl and self.sasl_status is None:
+                return [f"AUTHENTICATE {self.sasl.mechanism}"]
+            return self.end()
+        if subcommand == 'NAK':
+            if self.sasl and self.sasl_status is None:
+                self.sasl_unavailable("the server refused the sasl capability")
+            return self.end()
+        if subcommand == 'NEW':
+            self.available.update(parse_cap_list(caps))
+        elif subcommand == 'DEL':
+            for name in caps.split():
+                self.available.pop(name, None)
+                self.enabled.discard(name)
+        return []
+
+    def request(self):
+        """CAP REQ for the wanted capabilities the server offers, or CAP END"""
+        request = [name for name in self.wanted if name in self.available]
+        if self.sasl:
+            mechanisms = self.available.get('sasl', '')
+            if 'sasl' not in self.available:
+                self.sasl_unavailable("the server does not support SASL")
+            elif mechanisms and self.sasl.mechanism not in mechanisms.split(','):
+                self.sasl_unavailable(f"the server only supports {mechanisms}")
+            elif 'sasl' not in request:
+                request.append('sasl')
+        if not request:
+            return self.end()
+        return [f"CAP REQ :{' '.join(request)}"]
+
+    def on_authenticate(self, params):
+        """Handle the server's AUTHENTICATE challenge; returns the lines to send"""
+        if not self.sasl or self.sasl_status is not None or not params or params[0] != '+':
+            return []
+        if self.sasl.mechanism == 'PLAIN':
+            return authenticate_lines(sasl_plain_payload(self.sasl.username or '', self.sasl.password or ''))
+        return authenticate_lines(b'')
+
+    def on_logged_in(self, params):
+        """RPL_LOGGEDIN (900): params are target, prefix, account and text"""
+        if len(params) >= 3:
+            self.account = params[2]
+
+    def on_sasl_result(self, code, params):
+        """Handle a SASL success or failure numeric; returns the lines to send"""
+        if code in SASL_SUCCESS:
+            self.sasl_status = 'success'
+        else:
+            self.sasl_status = 'failed'
+            self.sasl_error = params[-1] if params else SASL_FAILURES.get(code)
+        return self.end()
+
+    def on_unknown_command(self, params):
+        """ERR_UNKNOWNCOMMAND (421): a server without CAP registers us on NICK/USER"""
+        if len(params) >= 2 and params[1].upper() == 'CAP':
+            self.finished = True
+            if self.sasl:
+                self.sasl_unavailable("the server does not support CAP")
@@ -1,10 +1,21 @@
 import socket
+import ssl
 import threading
 import sys
-import re
 import argparse
 import time
 from getpass import getpass
+from irc_cap import (DEFAULT_CAPS, SASL_FAILURES, SASL_SUCCESS, CapNegotiation, SaslConfig,
+                    sasl_config_error)
+from irc_framing import LineBuffer, MIN_RECV_SIZE, MAX_RECV_SIZE, next_recv_size
+from irc_keepalive import KeepalivePolicy, LinkMonitor
+from irc_members import MemberIndex
+from irc_parser import parse_message
+from irc_proxy import PROXY_TYPES, ProxyConfig, connect_via_proxy
+from irc_reconnect import ReconnectPolicy, join_lines
+from irc_scheduler import get_shared_scheduler
+from irc_tls import create_tls_context, get_shared_tls_context
+from irc_writer import IRCWriter, DEFAULT_RATE, DEFAULT_BURST
 
 """
 A simple IRC client
@@ -12,8 +23,32 @@ A simple IRC client
 class IRCClient:
     def __init__(self, server, port, nickname, username=None, realname=None,
                  proxy_type=None, proxy_host=None, proxy_port=None,
-                 proxy_username=None, proxy_password=None):
-        """Initialize IRC Client with server and proxy settings"""
+                 proxy_username=None, proxy_password=None,
+                 send_rate=DEFAULT_RATE, send_burst=DEFAULT_BURST, tracer=None, proxy=None,
+                 tls=False, tls_context=None, reconnect=None, keepalive=None,
+                 sasl=None, caps=DEFAULT_CAPS):
+        """Initialize IRC Client with server and proxy settings
+
+        A ProxyConfig (irc_proxy) may be given as proxy instead of the
+        separate proxy_* settings, so many clients can share one.
+
+        With tls, the connection uses TLS with tls_context, by default the
+        context shared by all clients with default settings (irc_tls).
+        Giving a tls_context implies tls.
+
+        With a ReconnectPolicy (irc_reconnect) as reconnect, a connection
+        that drops is reconnected after a backoff delay, and the channels
+        are rejoined once registered again.
+
+        With a KeepalivePolicy (irc_keepalive) as keepalive, the client
+        PINGs the server when the connection has been idle, measuring the
+        round trip time, and drops the connection when nothing comes back.
+
+        Registration negotiates the IRCv3 capabilities in caps that the
+        server offers and, given a SaslConfig (irc_cap) as sasl, logs in
+        with SASL before the welcome. A ValueError is raised for SASL
+        settings the connection cannot use, see sasl_config_error().
+        """
         self.server = server
         self.port = port
         self.nickname = nickname
@@ -22,32 +57,115 @@ class IRCClient:
         self.channels = set()
         self.running = False
         self.socket = None
+        # Outbound queue with flood control, created on connect
+        self.writer = None
+        self.send_rate = send_rate
+        self.send_burst = send_burst
+        # Optional LatencyTracer (irc_trace), and when the data being
+        # processed was received, which is only kept while tracing
+        self.tracer = tracer
+        self.received_at = 0.0
         self.current_channel = None
+        # Users in each channel, with a reverse nick -> channels index
+        self.members = MemberIndex()
         # Dictionary to store users in each channel
-        self.channel_users = {}
+        self.channel_users = self.members.channel_users
         # Dictionary to store topics for each channel
         self.channel_topics = {}
+        # Handlers for each command or numeric, see add_handler
+        self.handlers = {}
+        self.add_handler('PING', self.handle_ping)
+        self.add_handler('PONG', self.handle_pong)
+        self.add_handler('CAP', self.handle_cap)
+        self.add_handler('AUTHENTICATE', self.handle_authenticate)
+        self.add_handler('900', self.handle_logged_in)
+        for code in SASL_SUCCESS + tuple(SASL_FAILURES):
+            self.add_handler(code, self.handle_sasl_result)
+        self.add_handler('421', self.handle_unknown_command)
+        self.add_handler('001', self.handle_welcome)
+        self.add_handler('005', self.handle_isupport)
+        self.add_handler('332', self.handle_topic)
+        self.add_handler('353', self.handle_names)
+        self.add_handler('366', self.handle_end_of_names)
+        self.add_handler('JOIN', self.handle_join)
+        self.add_handler('PART', self.handle_part)
+        self.add_handler('KICK', self.handle_kick)
+        self.add_handler('QUIT', self.handle_quit)
+        self.add_handler('NICK', self.handle_nick)
+        self.add_handler('MODE', self.handle_mode)
+        self.add_handler('433', self.handle_nick_in_use)
         
+        # TLS context, and whether the last TLS handshake resumed a session
+        self.tls_context = tls_context or (get_shared_tls_context() if tls else None)
+        self.tls_resumed = False
+
+        # Reconnect policy, attempts made since the last welcome, and the
+        # pending reconnect timer. closing is set by disconnect(), so a
+        # connection closed on purpose is not reconnected.
+        self.reconnect_policy = reconnect
+        self.reconnect_attempts = 0
+        self.reconnect_timer = None
+        self.reconnecting = False
+        self.closing = False
+
+        # Keepalive state and round trip times, kept across reconnects, and
+        # the connection the scheduled keepalive checks belong to
+        self.link = LinkMonitor(keepalive) if keepalive else None
+        self.link_generation = 0
+
+        # Capabilities to request and SASL settings, and the negotiation of
+        # the current connection's registration
+        if sasl:
+            error = sasl_config_error(sasl, self.tls_context)
+            if error:
+                raise ValueError(error)
+        self.sasl = sasl
+        self.wanted_caps = caps
+        self.cap = None
+        # Seconds from the start of connect() until the connection was
+        # made and until the welcome (001): the registration latency
+        self.connect_started = 0.0
+        self.connect_time = None
+        self.welcome_time = None
+
         # Set up proxy if specified
+        self.proxy = proxy
         if proxy_type and proxy_host and proxy_port:
             self.setup_proxy(proxy_type, proxy_host, proxy_port,
                            proxy_username, proxy_password)
     
     def setup_proxy(self, proxy_type, proxy_host, proxy_port, username=None, password=None):
-        """Configure the socket to use a proxy"""
-        print("Warning: Proxy support requires PySocks module. Running without proxy support.")
-        # The standard socket library doesn't support proxies natively
-        # Consider installing PySocks if you need proxy support
+        """Connect through a SOCKS4, SOCKS5 or HTTP CONNECT proxy"""
+        proxy_type = proxy_type.lower()
+        if proxy_type not in PROXY_TYPES:
+            print(f"Unknown proxy type {proxy_type}, connecting without a proxy")
+            return
+        try:
+            proxy_port = int(proxy_port)
+        except ValueError:
+            print(f"Invalid proxy port {proxy_port}, connecting without a proxy")
+            return
+        self.proxy = ProxyConfig(proxy_type, proxy_host, proxy_port,
+                                 username or None, password or None)
     
     def connect(self):
         """Connect to the IRC server"""
+        if not self.reconnecting:
+            self.closing = False
+        self.connect_started = time.monotonic()
+        self.connect_time = self.welcome_time = None
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.server, self.port))
+            if self.proxy:
+                self.socket = connect_via_proxy(self.proxy, self.server, self.port)
+            else:
+                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self.socket.connect((self.server, self.port))
+            if self.tls_context:
+                self.socket = self.tls_context.wrap_socket(self.socket, server_hostname=self.server)
+            self.writer = IRCWriter(self.socket, rate=self.send_rate, burst=self.send_burst)
+            self.connect_time = time.monotonic() - self.connect_started
             
-            # Register with the server
-            self.send(f"NICK {self.nickname}")
-            self.send(f"USER {self.username} 0 * :{self.realname}")
+            self.register()
             
             self.running = True
             
@@ -55,19 +173,44 @@ class IRCClient:
             self.receive_thread = threading.Thread(target=self.receive_messages)
             self.receive_thread.daemon = True
             self.receive_thread.start()
+            self.start_keepalive()
             
             return True
         except socket.error as e:
             print(f"Connection error: {e}")
+            if self.socket:
+                self.socket.close()
             return False
     
+    def register(self):
+        """Send CAP LS, NICK and USER in one write
+
+        The server holds registration until CAP END, which the CAP and
+        SASL handlers send once negotiation is done.
+        """
+        self.cap = CapNegotiation(self.wanted_caps, self.sasl)
+        self.send_lines([self.cap.start(),
+                         f"NICK {self.nickname}",
+                         f"USER {self.username} 0 * :{self.realname}"])
+
     def disconnect(self):
-        """Disconnect from the IRC server"""
+        """Disconnect from the IRC server, cancelling any pending reconnect"""
+        self.closing = True
+        self.reconnecting = False
+        self.reconnect_attempts = 0
+        self.cancel_reconnect()
         if self.running:
             self.send("QUIT :Leaving")
             self.running = False
+            if self.writer:
+                self.writer.close()
             if self.socket:
-                self.socket.close()
+                try:
+                    # Wake up the receive thread blocked in recv(), which
+                    # then closes the socket
+                    self.socket.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
     
     def join_channel(self, channel):
         """Join an IRC channel"""
@@ -94,125 +237,382 @@ class IRCClient:
         self.send(f"PRIVMSG {target} :{message}")
     
     def send(self, message):
-        """Send raw command to the IRC server"""
-        if self.socket:
-            self.socket.send((message + "\r\n").encode('utf-8'))
+        """Queue a raw command for sending to the IRC server
+
+        Lines are paced by the connection's IRCWriter; PONG and QUIT skip
+        ahead of queued messages.
+        """
+        if self.writer:
+            if not self.writer.put(message):
+                print(f"Send queue full or closed, dropped: {message}")
+
+    def send_lines(self, lines):
+        """Queue several raw commands at once, so they are sent in one write"""
+        if self.writer and lines:
+            if not self.writer.put_many(lines):
+                print(f"Send queue full or closed, dropped some of: {', '.join(lines)}")
     
     def receive_messages(self):
         """Receive and process messages from the server"""
-        buffer = ""
+        lines = LineBuffer()
+        recv_size = MIN_RECV_SIZE
+        chunk = memoryview(bytearray(MAX_RECV_SIZE))
+        # This thread owns the socket: a reconnect replaces self.socket, and
+        # closing it elsewhere while recv() may still run lets a new
+        # connection reuse the descriptor and have its data read here
+        sock = self.socket
         
         while self.running:
             try:
-                data = self.socket.recv(4096).decode('utf-8', errors='ignore')
-                if not data:
+                received = sock.recv_into(chunk[:recv_size])
+                if not received:
                     print("Disconnected from server.")
                     self.running = False
                     break
                 
-                buffer += data
-                lines = buffer.split("\r\n")
-                buffer = lines.pop()
-                
-                for line in lines:
+                if self.tracer:
+                    self.received_at = self.tracer.now()
+                if self.link:
+                    self.link.received()
+                for line in lines.feed(chunk[:received]):
                     self.process_message(line)
+                
+                recv_size = next_recv_size(recv_size, received)
                     
             except socket.error as e:
                 if self.running:
                     print(f"Error receiving data: {e}")
                     self.running = False
                 break
+
+        sock.close()
+        self.connection_closed()
+
+    def connection_status(self, message):
+        """Report a change of the connection's state, such as a reconnect"""
+        print(message)
+
+    def connection_closed(self):
+        """Called once the connection has ended, reconnects unless disconnect() ended it"""
+        if self.closing or not self.reconnect_policy:
+            return
+        # Release the dead connection before making a new one
+        if self.writer:
+            self.writer.close()
+        self.reconnecting = True
+        self.schedule_reconnect()
+
+    def schedule_reconnect(self):
+        """Start the timer for the next reconnect attempt, or give up"""
+        delay = self.reconnect_policy.delay(self.reconnect_attempts)
+        if delay is None:
+            self.reconnecting = False
+            # The browser drops the network on this message
+            self.connection_status(f"Disconnected from server: gave up after "
+                                   f"{self.reconnect_attempts} reconnect attempts")
+            return
+        self.reconnect_attempts += 1
+        self.connection_status(f"Connection to {self.server} lost, reconnecting in "
+                               f"{delay:.1f}s (attempt {self.reconnect_attempts})")
+        self.start_reconnect_timer(delay)
+
+    def start_reconnect_timer(self, delay):
+        """Call reconnect() after delay seconds"""
+        self.reconnect_timer = threading.Timer(delay, self.reconnect)
+        self.reconnect_timer.daemon = True
+        self.reconnect_timer.start()
+
+    def cancel_reconnect(self):
+        """Stop the pending reconnect timer, if any"""
+        timer = self.reconnect_timer
+        self.reconnect_timer = None
+        if timer:
+            timer.cancel()
+
+    def reconnect(self):
+        """Timer target: connect again, scheduling another attempt if that fails"""
+        self.reconnect_timer = None
+        if not self.reconnecting:
+            return
+        if not self.connect():
+            if self.reconnecting:
+                self.schedule_reconnect()
+        elif self.closing:
+            # disconnect() was called while connecting
+            self.disconnect()
+
+    def start_keepalive(self):
+        """Start the keepalive checks of a new connection"""
+        if self.link is None:
+            return
+        self.link.reset()
+        self.link_generation += 1
+        self.schedule_keepalive(self.link_generation, self.link.last_received + self.link.policy.interval)
+
+    def schedule_keepalive(self, generation, deadline):
+        """Run keepalive_check(generation) at a time.monotonic() deadline"""
+        get_shared_scheduler().schedule(lambda: self.keepalive_check(generation), deadline)
+
+    def keepalive_check(self, generation):
+        """Send a PING if the link is idle, or drop it if it is dead"""
+        if generation != self.link_generation or not self.running:
+            return
+        action, deadline = self.link.poll()
+        if action == 'dead':
+            self.connection_status(f"No reply from {self.server} for "
+                                   f"{self.link.policy.timeout:g}s, dropping the connection")
+            self.abort_connection()
+            return
+        if action == 'ping':
+            self.send(f"PING :{self.link.start_ping()}")
+        self.schedule_keepalive(generation, deadline)
+
+    def abort_connection(self):
+        """Drop the connection without QUIT, e.g. because the link is dead"""
+        try:
+            # Wakes up the receive thread, which then handles the loss
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+    def registration_stats(self):
+        """Registration latency and the outcome of capability negotiation"""
+        cap = self.cap
+        return {
+            'connect_time': self.connect_time,
+            'welcome_time': self.welcome_time,
+            'caps': sorted(cap.enabled) if cap else [],
+            'sasl': cap.sasl_status if cap else None,
+            'account': cap.account if cap else None,
+        }
+
+    def link_stats(self):
+        """Round trip times and keepalive counters, or None without keepalive"""
+        return self.link.stats() if self.link else None
+
+    def rejoin_channels(self):
+        """Join every channel again after reconnecting, several per JOIN line"""
+        for line in join_lines(sorted(self.channels)):
+            self.send(line)
     
     def process_message(self, message):
-        """Process a message from the server"""
+        """Process a raw line from the server
+
+        The line is parsed once here and the resulting IRCMessage is passed
+        to handle_message, so subclasses never need to re-parse it.
+        """
         print(f">> {message}")
-        
-        # Respond to PING with PONG
-        if message.startswith("PING"):
-            pong = message.replace("PING", "PONG", 1)
-            self.send(pong)
+
+        msg = parse_message(message)
+        if msg is None:
             return
-        
-        # Parse IRC message
-        match = re.match(r'^(?::([^ ]+) )?([^ ]+)(?: ((?:[^: ][^ ]* ?)*))?(?: :(.*))?$', message)
-        if not match:
+
+        tracer = self.tracer
+        if tracer:
+            tracer.parsed(self.received_at)
+        self.handle_message(msg)
+        if tracer:
+            tracer.handled()
+
+    def add_handler(self, command, handler):
+        """Register a handler for a command or numeric
+
+        Args:
+            command: The IRC command or numeric (e.g. 'PRIVMSG', '353'),
+                or '*' to receive every message.
+            handler: Callable taking the parsed IRCMessage.
+        """
+        self.handlers.setdefault(command.upper(), []).append(handler)
+
+    def remove_handler(self, command, handler):
+        """Unregister a handler previously added with add_handler"""
+        handlers = self.handlers.get(command.upper())
+        if handlers and handler in handlers:
+            handlers.remove(handler)
+            if not handlers:
+                del self.handlers[command.upper()]
+
+    def handle_message(self, msg):
+        """Dispatch a parsed IRCMessage to the handlers for its command"""
+        handlers = self.handlers.get(msg.command)
+        if handlers:
+            for handler in handlers:
+                handler(msg)
+
+        handlers = self.handlers.get('*')
+        if handlers:
+            for handler in handlers:
+                handler(msg)
+
+    def handle_ping(self, msg):
+        """Respond to PING with PONG"""
+        self.send(f"PONG :{msg.params[0]}" if msg.params else "PONG")
+
+    def handle_pong(self, msg):
+        """PONG, the reply to a keepalive PING gives the round trip time"""
+        if self.link and msg.params:
+            self.link.pong(msg.params[-1])
+
+    def handle_cap(self, msg):
+        """Capability negotiation (CAP LS/ACK/NAK/NEW/DEL)"""
+        if self.cap:
+            self.send_lines(self.cap.on_cap(msg.params))
+
+    def handle_authenticate(self, msg):
+        """SASL challenge (AUTHENTICATE +)"""
+        if self.cap:
+            self.send_lines(self.cap.on_authenticate(msg.params))
+
+    def handle_logged_in(self, msg):
+        """Logged in to an account (900)"""
+        if self.cap:
+            self.cap.on_logged_in(msg.params)
+
+    def handle_sasl_result(self, msg):
+        """End of SASL authentication (902-907); registration can go on"""
+        if not self.cap or not self.sasl:
             return
-        
-        prefix, command, params_str, trailing = match.groups()
-        params = (params_str or '').split() 
-        if trailing:
-            params.append(trailing)
-        
-        # Handle specific responses
-        if command == '001':  # Welcome message
-            print(f"Successfully connected to {self.server}")
-            
-        elif command == '332':  # Channel topic
-            if len(params) >= 3:
-                channel = params[1]
-                topic = params[2]
-                self.channel_topics[channel] = topic
-                print(f"Topic for {channel}: {topic}")
-                
-        elif command == '353':  # Names reply (list of users in channel)
-            if len(params) >= 4:
-                channel = params[2]
-                users = params[3].split()
-                
-                if channel not in self.channel_users:
-                    self.channel_users[channel] = set()
-                    
-                for user in users:
-                    # Remove prefixes like @ (op), + (voice)
-                    if user and len(user) > 0 and user[0] in '@+%&~':
-                        user = user[1:]
-                    self.channel_users[channel].add(user)
-                    
-        elif command == '366':  # End of names list
-            if len(params) >= 2:
-                channel = params[1]
-                if channel in self.channel_users:
-                    users = self.channel_users[channel]
-                    print(f"Users in {channel}: {', '.join(users)}")
-                    
-        elif command == 'JOIN':  # User joined a channel
-            if prefix:
-                nick = prefix.split('!')[0]
-                channel = params[0] if params else None
-                if channel and channel in self.channel_users:
-                    self.channel_users[channel].add(nick)
-                    print(f"{nick} joined {channel}")
-                    
-        elif command == 'PART' or command == 'QUIT':  # User left a channel or quit
-            if prefix:
-                nick = prefix.split('!')[0]
-                channel = params[0] if params else None
-                
-                if command == 'PART' and channel and channel in self.channel_users and nick in self.channel_users[channel]:
-                    self.channel_users[channel].remove(nick)
-                    print(f"{nick} left {channel}")
-                elif command == 'QUIT':  # User quit, remove from all channels
-                    for ch, users in self.channel_users.items():
-                        if nick in users:
-                            users.remove(nick)
-                    print(f"{nick} quit")
-                    
-        elif command == 'NICK':  # User changed nickname
-            if prefix and len(params) >= 1:
-                old_nick = prefix.split('!')[0]
-                new_nick = params[0]
-                
-                # Update the user in all channels
-                for ch, users in self.channel_users.items():
-                    if old_nick in users:
-                        users.remove(old_nick)
-                        users.add(new_nick)
-                print(f"{old_nick} is now known as {new_nick}")
-        
-        elif command == '433':  # Nickname already in use
-            self.nickname = self.nickname + "_"
-            print(f"Nickname already in use, trying {self.nickname}")
-            self.send(f"NICK {self.nickname}")
+        lines = self.cap.on_sasl_result(msg.command, msg.params)
+        if self.cap.sasl_status == 'success':
+            self.connection_status(f"Logged in as {self.cap.account or self.sasl.username}")
+        else:
+            self.connection_status(f"SASL authentication failed: {self.cap.sasl_error}")
+        self.send_lines(lines)
+
+    def handle_unknown_command(self, msg):
+        """Unknown command (421), which CAP is to servers without IRCv3"""
+        if self.cap:
+            self.cap.on_unknown_command(msg.params)
+
+    def handle_welcome(self, msg):
+        """Welcome message (001)"""
+        self.welcome_time = time.monotonic() - self.connect_started
+        print(f"Successfully connected to {self.server}, registered in {self.welcome_time * 1000:.0f} ms")
+        if self.cap and self.cap.sasl_status == 'unavailable':
+            self.connection_status(f"Not logged in: {self.cap.sasl_error}")
+        self.remember_tls_session()
+        if self.reconnecting:
+            self.reconnecting = False
+            self.reconnect_attempts = 0
+            self.connection_status(f"Reconnected to {self.server}")
+            self.rejoin_channels()
+
+    def tls_object(self):
+        """The SSLSocket of a TLS connection, or None"""
+        return self.socket if isinstance(self.socket, ssl.SSLSocket) else None
+
+    def remember_tls_session(self):
+        """Let the TLS context resume this connection's session next time
+
+        Called once the server has sent data, by which time TLS 1.3
+        session tickets have arrived too.
+        """
+        tls = self.tls_object()
+        if tls is None:
+            return
+        self.tls_resumed = tls.session_reused
+        if hasattr(tls.context, 'remember'):
+            tls.context.remember(self.server, tls.session)
+
+    def handle_isupport(self, msg):
+        """Server features (005), used to learn the channel prefix modes"""
+        for token in msg.params[1:-1]:
+            name, _, value = token.partition('=')
+            if name == 'PREFIX' and value:
+                self.members.set_prefix_support(value)
+            elif name == 'CHANMODES' and value:
+                self.members.set_chanmodes(value)
+
+    def handle_topic(self, msg):
+        """Channel topic (332)"""
+        params = msg.params
+        if len(params) >= 3:
+            channel = params[1]
+            topic = params[2]
+            self.channel_topics[channel] = topic
+            print(f"Topic for {channel}: {topic}")
+
+    def handle_names(self, msg):
+        """Names reply (353), staged until the end of the list"""
+        params = msg.params
+        if len(params) >= 4:
+            channel = params[2]
+            users = params[3].split()
+
+            # Prefixes like @ (op), + (voice) are kept as the user's modes
+            self.members.stage_names(channel, users)
+
+    def handle_end_of_names(self, msg):
+        """End of names list (366), the staged reply replaces the channel's users"""
+        params = msg.params
+        if len(params) >= 2:
+            channel = params[1]
+            users = self.members.finish_names(channel)
+            if users is not None:
+                print(f"Users in {channel}: {', '.join(users)}")
+
+    def handle_join(self, msg):
+        """User joined a channel"""
+        if msg.prefix:
+            nick = msg.nick
+            channel = msg.params[0] if msg.params else None
+            if channel and channel in self.channel_users:
+                self.members.add(channel, nick)
+                print(f"{nick} joined {channel}")
+
+    def handle_part(self, msg):
+        """User left a channel"""
+        if msg.prefix:
+            nick = msg.nick
+            channel = msg.params[0] if msg.params else None
+            if channel and nick == self.nickname:
+                # The other members are no longer seen, so none are kept
+                self.members.forget_channel(channel)
+                print(f"You left {channel}")
+            elif channel and self.members.remove(channel, nick):
+                print(f"{nick} left {channel}")
+
+    def handle_kick(self, msg):
+        """User kicked from a channel, possibly us"""
+        params = msg.params
+        if len(params) >= 2:
+            channel, nick = params[0], params[1]
+            if nick == self.nickname:
+                self.members.forget_channel(channel)
+                print(f"You were kicked from {channel} by {msg.nick}")
+            elif self.members.remove(channel, nick):
+                print(f"{nick} was kicked from {channel} by {msg.nick}")
+
+    def handle_quit(self, msg):
+        """User quit, remove from all channels"""
+        if msg.prefix:
+            nick = msg.nick
+            self.members.quit(nick)
+            print(f"{nick} quit")
+
+    def handle_nick(self, msg):
+        """User changed nickname"""
+        if msg.prefix and len(msg.params) >= 1:
+            old_nick = msg.nick
+            new_nick = msg.params[0]
+
+            # Update the user in the channels they are in
+            self.members.rename(old_nick, new_nick)
+            print(f"{old_nick} is now known as {new_nick}")
+
+    def handle_mode(self, msg):
+        """Mode change; channel prefix modes (+o, +v ...) update the member list"""
+        params = msg.params
+        if len(params) >= 2 and params[0] in self.channel_users:
+            channel = params[0]
+            self.members.apply_mode(channel, params[1], params[2:])
+            print(f"{msg.nick} sets mode {' '.join(params[1:])} on {channel}")
+
+    def handle_nick_in_use(self, msg):
+        """Nickname already in use (433)"""
+        self.nickname = self.nickname + "_"
+        print(f"Nickname already in use, trying {self.nickname}")
+        self.send(f"NICK {self.nickname}")
 
     def get_channel_topic(self, channel):
         """Fetch the topic for a channel"""
@@ -253,6 +653,24 @@ class IRCClient:
             
         return self.channel_users.get(channel, set())
     
+    def get_channel_members(self, channel=None):
+        """Get the users of a channel with their highest prefix, sorted by rank
+
+        Args:
+            channel: The channel to get users from. If None, uses current channel.
+
+        Returns:
+            A list like ['@op', '+voiced', 'user'], or None if no channel is given
+        """
+        users = self.get_channel_users(channel)
+        if users is None:
+            return None
+        if not channel:
+            channel = self.current_channel
+        if not channel.startswith('#'):
+            channel = '#' + channel
+        return self.members.member_list(channel)
+
     def get_topic(self, channel=None):
         """Get the topic of a channel
         
@@ -288,7 +706,7 @@ def main():
     
     # IRC Connection settings
     parser.add_argument("-s", "--server", default="irc.libera.chat", help="IRC server address (default: irc.libera.chat)")
-    parser.add_argument("-p", "--port", type=int, default=6667, help="IRC server port (default: 6667)")
+    parser.add_argument("-p", "--port", type=int, help="IRC server port (default: 6697 with --tls, else 6667)")
     parser.add_argument("-n", "--nickname", required=True, help="IRC nickname")
     parser.add_argument("-u", "--username", help="IRC username (default: same as nickname)")
     parser.add_argument("-r", "--realname", help="IRC real name (default: same as nickname)")
@@ -300,15 +718,66 @@ def main():
     parser.add_argument("--proxy-username", help="Proxy authentication username")
     parser.add_argument("--proxy-password-prompt", action="store_true", help="Prompt for proxy password")
     
+    # TLS settings
+    parser.add_argument("--tls", action="store_true", help="Connect using TLS")
+    parser.add_argument("--tls-insecure", action="store_true", help="Do not verify the server's certificate")
+    parser.add_argument("--tls-cert", help="Client certificate (PEM) to present, e.g. for CertFP")
+    parser.add_argument("--tls-key", help="Private key of the client certificate, if not in --tls-cert")
+    
+    # SASL settings
+    parser.add_argument("--sasl-username", help="Log in to this account with SASL PLAIN while registering")
+    parser.add_argument("--sasl-password-prompt", action="store_true", help="Prompt for the SASL password")
+    parser.add_argument("--sasl-external", action="store_true", help="Log in with SASL EXTERNAL, using the --tls-cert certificate")
+    parser.add_argument("--sasl-allow-plaintext", action="store_true", help="Allow SASL PLAIN without TLS, sending the password unencrypted")
+    
+    # Engine settings
+    parser.add_argument("--engine", choices=["thread", "asyncio"], default="thread",
+                        help="Run the connection on its own threads or on an asyncio event loop (default: thread)")
+    
+    # Reconnect settings
+    parser.add_argument("--no-reconnect", action="store_true", help="Exit when the connection drops instead of reconnecting")
+    parser.add_argument("--reconnect-max", type=float, default=ReconnectPolicy().maximum,
+                        help=f"Longest wait in seconds between reconnect attempts (default: {ReconnectPolicy().maximum:g})")
+    
+    # Keepalive settings
+    parser.add_argument("--ping-interval", type=float, default=KeepalivePolicy().interval,
+                        help=f"PING the server after this many idle seconds, 0 to never (default: {KeepalivePolicy().interval:g})")
+    parser.add_argument("--ping-timeout", type=float, default=KeepalivePolicy().timeout,
+                        help=f"Drop the connection when nothing arrives this many seconds after a PING (default: {KeepalivePolicy().timeout:g})")
+    
+    # Flood control settings
+    parser.add_argument("--send-rate", type=float, default=DEFAULT_RATE, help=f"Lines per second after the initial burst (default: {DEFAULT_RATE})")
+    parser.add_argument("--send-burst", type=int, default=DEFAULT_BURST, help=f"Lines that may be sent back to back (default: {DEFAULT_BURST})")
+    
     args = parser.parse_args()
+    tls = args.tls or bool(args.tls_cert)
+    if args.port is None:
+        args.port = 6697 if tls else 6667
+    if args.sasl_external and not args.tls_cert:
+        parser.error("--sasl-external needs a client certificate, see --tls-cert")
+    if args.sasl_username and not args.sasl_external and not tls and not args.sasl_allow_plaintext:
+        parser.error("--sasl-username would send the password unencrypted; use --tls or --sasl-allow-plaintext")
     
     # Get proxy password if needed
     proxy_password = None
     if args.proxy_password_prompt and args.proxy_username:
         proxy_password = getpass("Enter proxy password: ")
     
+    sasl = None
+    if args.sasl_external:
+        sasl = SaslConfig('EXTERNAL')
+    elif args.sasl_username:
+        sasl_password = getpass("Enter SASL password: ") if args.sasl_password_prompt else None
+        sasl = SaslConfig('PLAIN', args.sasl_username, sasl_password,
+                          allow_plaintext=args.sasl_allow_plaintext)
+    
     # Create and connect the IRC client
-    client = IRCClient(
+    client_class = IRCClient
+    if args.engine == "asyncio":
+        from irc_async import AsyncIRCClient
+        client_class = AsyncIRCClient
+    
+    client = client_class(
         server=args.server,
         port=args.port,
         nickname=args.nickname,
@@ -318,7 +787,14 @@ def main():
         proxy_host=args.proxy_host,
         proxy_port=args.proxy_port,
         proxy_username=args.proxy_username,
-        proxy_password=proxy_password
+        proxy_password=proxy_password,
+        send_rate=args.send_rate,
+        send_burst=args.send_burst,
+        tls_context=create_tls_context(not args.tls_insecure, certfile=args.tls_cert,
+                                       keyfile=args.tls_key) if tls else None,
+        reconnect=None if args.no_reconnect else ReconnectPolicy(maximum=args.reconnect_max),
+        keepalive=KeepalivePolicy(args.ping_interval, args.ping_timeout) if args.ping_interval > 0 else None,
+        sasl=sasl
     )
     
     if not client.connect():
@@ -330,7 +806,7 @@ def main():
     
     try:
         # Main command loop
-        while client.running:
+        while client.running or client.reconnecting:
             try:
                 prefix = f"[{client.current_channel}] " if client.current_channel else ""
                 user_input = input(f"{prefix}> ")
@@ -396,6 +872,16 @@ def main():
                         else:
                             print("Usage: /topic <channel> [topic]")
                         
+                    elif command == "lag":
+                        stats = client.link_stats()
+                        if stats is None:
+                            print("Keepalive PINGs are off")
+                        elif stats['rtt'] is None:
+                            print("No round trip measured yet")
+                        else:
+                            print(f"Round trip: {stats['rtt'] * 1000:.0f} ms (average {stats['rtt_avg'] * 1000:.0f} ms, "
+                                  f"max {stats['rtt_max'] * 1000:.0f} ms over {len(stats['rtt_history'])} PINGs)")
+                        
                     elif command == "help":
                         print("Available commands:")
                         print("  /join <channel> - Join a channel")
@@ -404,6 +890,7 @@ def main():
                         print("  /raw <command> - Send a raw IRC command")
                         print("  /list - List available channels")
                         print("  /topic [channel] [topic] - View or set channel topic")
+                        print("  /lag - Show the round trip time to the server")
                         print("  /quit or /exit - Disconnect and exit")
                         print("  /help - Show this help message")
                     
@@ -4,7 +4,6 @@ Web GUI for the IRC Client
 """
 import os
 import json
-import re
 from threading import Lock
 from flask import Flask, render_template, request, jsonify, session
 from flask_socketio import SocketIO, emit
@@ -283,46 +282,38 @@ class CustomIRCClient(IRCClient):
                          proxy_username, proxy_password)
         self.message_callback = message_callback
         self.session_id = None
+        self.add_handler('332', self.emit_topic)
+        self.add_handler('366', self.emit_user_list)
+        self.add_handler('*', self.forward_message)
     
-    def process_message(self, message):
-        """Override process_message to call the callback and handle special messages"""
-        # Call the original implementation
-        super().process_message(message)
-        
-        # Parse IRC message
-        match = re.match(r'^(?::([^ ]+) )?([^ ]+)(?: ((?:[^: ][^ ]* ?)*))?(?: :(.*))?$', message)
-        if match:
-            prefix, command, params_str, trailing = match.groups()
-            params = (params_str or '').split() 
-            if trailing:
-                params.append(trailing)
-            
-            # Handle specific responses that we want to send to the client
-            
-            # Channel topic (332)
-            if command == '332' and len(params) >= 3:
-                channel = params[1]
-                topic = params[2]
-                if self.session_id:
-                    socketio.emit('channel_topic', {
-                        'channel': channel,
-                        'topic': topic
-                    }, room=self.session_id)
-            
-            # Names reply (list of users in channel) - 353
-            elif command == '353' and len(params) >= 4:
-                channel = params[2]
-                users = params[3].split()
-                
-                if self.session_id and channel in self.channel_users:
-                    socketio.emit('user_list', {
-                        'channel': channel,
-                        'users': list(self.channel_users[channel])
-                    }, room=self.session_id)
-        
-        # Call the callback if it exists
+    def emit_topic(self, msg):
+        """Send a channel topic (332) to the browser"""
+        params = msg.params
+        if self.session_id and len(params) >= 3:
+            socketio.emit('channel_topic', {
+                'channel': params[1],
+                'topic': params[2]
+            }, room=self.session_id)
+
+    def emit_user_list(self, msg):
+        """Send the users of a channel to the browser at the end of names (366)
+
+        NAMES replies are staged until 366, so the list is sent once, after
+        IRCClient's own 366 handler has swapped it in.
+        """
+        params = msg.params
+        if len(params) >= 2:
+            channel = params[1]
+            if self.session_id and channel in self.channel_users:
+                socketio.emit('user_list', {
+                    'channel': channel,
+                    'users': list(self.channel_users[channel])
+                }, room=self.session_id)
+
+    def forward_message(self, msg):
+        """Pass every line on to the message callback"""
         if self.message_callback:
-            self.message_callback(message)
+            self.message_callback(msg.raw)
 
 
 @socketio.on('get_channel_list')
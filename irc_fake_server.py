@@ -0,0 +1,759 @@
+#!/usr/bin/env python3
+"""
+Local fake IRC server for tests and benchmarks
+
+FakeIRCServer is a small asyncio ircd implementing what the client uses:
+registration, JOIN, PART, QUIT, NICK, PRIVMSG, NOTICE, NAMES, TOPIC, LIST,
+channel prefix MODEs, PING/PONG, and IRCv3 capability negotiation with
+SASL PLAIN and EXTERNAL. It listens on 127.0.0.1, so client behaviour
+and performance can be tested offline.
+
+Besides connected clients, channels can hold simulated users that only
+exist on the server. They are driven by scripted traffic: filling
+channels to a given size, sending messages at a given rate and netsplits.
+Each channel keeps its connected members apart from the simulated ones,
+so traffic in a channel of 10,000 simulated users only costs a write per
+connected client.
+
+Given an SSLContext, it serves TLS instead, and records the SHA-256
+fingerprint of any client certificate (CertFP) in the user's certfp.
+"""
+import argparse
+import asyncio
+import base64
+import binascii
+import hashlib
+import ssl
+
+from irc_async import IRCEventLoop
+from irc_cap import SASL_CHUNK, SASL_MECHANISMS
+from irc_framing import LineBuffer
+from irc_parser import parse_message
+
+SERVER_NAME = "irc.fake"
+NETWORK_NAME = "FakeNet"
+
+# Sent in RPL_ISUPPORT (005); the client's MemberIndex reads PREFIX
+ISUPPORT = ("PREFIX=(ov)@+", "CHANTYPES=#&", "CHANMODES=beI,k,l,imnpst",
+            f"NETWORK={NETWORK_NAME}", "CASEMAPPING=ascii")
+
+# Nicks per RPL_NAMREPLY (353) line
+NAMES_PER_LINE = 40
+
+# Commands allowed before registration
+REGISTRATION_COMMANDS = frozenset(['NICK', 'USER', 'PING', 'PONG', 'QUIT', 'CAP', 'AUTHENTICATE'])
+
+# Capabilities offered in CAP LS, with their CAP LS 302 values
+CAPABILITIES = {'multi-prefix': None, 'sasl': ",".join(SASL_MECHANISMS)}
+
+
+def encode_line(prefix, command, *params):
+    """Encode a line to send; the last parameter is sent as trailing
+
+    Args:
+        prefix: The source of the line, or None.
+        command: Command or three-digit numeric.
+        params: Parameters; only the last may contain spaces.
+    """
+    parts = [f":{prefix}", command] if prefix else [command]
+    if params:
+        parts.extend(params[:-1])
+        parts.append(f":{params[-1]}")
+    return (" ".join(parts) + "\r\n").encode('utf-8')
+
+
+class FakeUser:
+    """A user known to the server, connected or simulated
+
+    Args:
+        user: The username, None until a connected client sends USER.
+        writer: The StreamWriter of a connected client, None for a
+            simulated user.
+    """
+
+    def __init__(self, nick, user="user", host="fake.host", writer=None):
+        self.nick = nick
+        self.user = user
+        self.host = host
+        self.writer = writer
+        self.registered = writer is None
+        self.quit = False
+        self.channels = set()
+        # SHA-256 of the client certificate of a TLS connection, in hex
+        self.certfp = None
+        # Enabled capabilities; registration waits for CAP END once a
+        # client has started negotiating
+        self.caps = set()
+        self.negotiating = False
+        # SASL mechanism in progress and the payload received so far, and
+        # the account logged in to
+        self.sasl_mechanism = None
+        self.sasl_data = ""
+        self.account = None
+
+    @property
+    def prefix(self):
+        return f"{self.nick}!{self.user}@{self.host}"
+
+    def send(self, data):
+        """Write an encoded line to a connected user; simulated users ignore it"""
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.write(data)
+
+
+class FakeChannel:
+    """A channel with its members' prefixes ('@', '+' or '') and topic
+
+    local holds the members that are connected clients, the only ones
+    that need to be sent anything.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.members = {}
+        self.local = set()
+        self.topic = None
+
+
+class FakeIRCServer:
+    """Fake IRC server on an asyncio event loop
+
+    Its methods must be called on the server's loop. A server started with
+    start_in_thread() runs on a loop of its own, and call() runs a method
+    on it from any other thread.
+
+    Args:
+        name: Server name, the prefix of numerics.
+        record: Keep every line received from clients in received.
+    """
+
+    def __init__(self, name=SERVER_NAME, record=False):
+        self.name = name
+        self.record = record
+        self.received = []
+        # SASL accounts: PLAIN passwords by account name, and the accounts
+        # of client certificate fingerprints for EXTERNAL
+        self.accounts = {}
+        self.certfp_accounts = {}
+        # Users by lowercase nick, channels by lowercase name
+        self.users = {}
+        self.channels = {}
+        self.server = None
+        # Tasks serving connected clients, registered or not
+        self.handlers = set()
+        self.event_loop = None
+        self.port = None
+        self.simulated = 0
+        # Lines written to connected clients
+        self.sent_lines = 0
+
+        self.commands = {
+            'NICK': self.on_nick,
+            'USER': self.on_user,
+            'PING': self.on_ping,
+            'PONG': self.on_pong,
+            'JOIN': self.on_join,
+            'PART': self.on_part,
+            'QUIT': self.on_quit,
+            'PRIVMSG': self.on_privmsg,
+            'NOTICE': self.on_privmsg,
+            'NAMES': self.on_names,
+            'TOPIC': self.on_topic,
+            'LIST': self.on_list,
+            'MODE': self.on_mode,
+            'CAP': self.on_cap,
+            'AUTHENTICATE': self.on_authenticate,
+        }
+
+    async def start(self, host="127.0.0.1", port=0, ssl=None):
+        """Start listening, using TLS if an SSLContext is given; returns the port"""
+        self.server = await asyncio.start_server(self.handle, host, port, backlog=4096, ssl=ssl)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    async def close(self):
+        """Stop listening and drop every connected client"""
+        self.server.close()
+        for task in list(self.handlers):
+            task.cancel()
+        await asyncio.gather(*self.handlers, return_exceptions=True)
+        await self.server.wait_closed()
+
+    def start_in_thread(self, host="127.0.0.1", port=0, ssl=None):
+        """Start the server on an event loop thread of its own; returns the port"""
+        self.event_loop = IRCEventLoop()
+        return self.event_loop.run_coroutine(self.start(host, port, ssl))
+
+    def call(self, func, *args):
+        """Run func(*args) on the server's loop and return its result
+
+        func may be a coroutine function such as flood().
+        """
+        async def run():
+            result = func(*args)
+            if asyncio.iscoroutine(result):
+                result = await result
+            return result
+        return self.event_loop.run_coroutine(run())
+
+    def stop(self):
+        """Close a server started with start_in_thread() and stop its loop"""
+        self.event_loop.run_coroutine(self.close())
+        self.event_loop.stop()
+
+    async def handle(self, reader, writer):
+        """Serve one client connection"""
+        task = asyncio.current_task()
+        self.handlers.add(task)
+        host = writer.get_extra_info('peername')[0]
+        user = FakeUser("*", user=None, host=host, writer=writer)
+        tls = writer.get_extra_info('ssl_object')
+        certificate = tls.getpeercert(binary_form=True) if tls else None
+        if certificate:
+            user.certfp = hashlib.sha256(certificate).hexdigest()
+        lines = LineBuffer()
+        try:
+            while not user.quit:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                for line in lines.feed(data):
+                    if self.record:
+                        self.received.append(line)
+                    msg = parse_message(line)
+                    if msg is not None:
+                        self.dispatch(user, msg)
+                    if user.quit:
+                        break
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if not user.quit:
+                self.remove_user(user, "Connection closed")
+            writer.close()
+            self.handlers.discard(task)
+
+    def dispatch(self, user, msg):
+        """Run the handler of a command received from a client"""
+        handler = self.commands.get(msg.command)
+        if not user.registered and msg.command not in REGISTRATION_COMMANDS:
+            self.numeric(user, '451', "You have not registered")
+        elif handler is None:
+            self.numeric(user, '421', msg.command, "Unknown command")
+        else:
+            handler(user, msg)
+
+    # Sending
+
+    def numeric(self, user, code, *params):
+        """Send a numeric reply to a connected user"""
+        user.send(encode_line(self.name, code, user.nick, *params))
+        self.sent_lines += 1
+
+    def send_to(self, users, data):
+        """Send an encoded line to several users"""
+        for user in users:
+            user.send(data)
+        self.sent_lines += len(users)
+
+    def peers(self, user):
+        """The connected users sharing a channel with user, not including it"""
+        peers = set()
+        for name in user.channels:
+            peers.update(self.channels[name].local)
+        peers.discard(user)
+        return peers
+
+    # Users and channels
+
+    def find_user(self, nick):
+        return self.users.get(nick.lower())
+
+    def find_channel(self, name):
+        return self.channels.get(name.lower())
+
+    def join(self, user, name, announce=True):
+        """Add a user to a channel, creating it with the user as operator"""
+        channel = self.find_channel(name)
+        if channel is None:
+            channel = self.channels[name.lower()] = FakeChannel(name)
+        if user.nick in channel.members:
+            return channel
+        channel.members[user.nick] = '' if channel.members else '@'
+        if user.writer is not None:
+            channel.local.add(user)
+        user.channels.add(name.lower())
+        if announce:
+            self.send_to(channel.local, encode_line(user.prefix, 'JOIN', channel.name))
+        return channel
+
+    def part(self, user, channel):
+        """Remove a user from a channel, dropping the channel once empty"""
+        del channel.members[user.nick]
+        channel.local.discard(user)
+        user.channels.discard(channel.name.lower())
+        if not channel.members:
+            del self.channels[channel.name.lower()]
+
+    def remove_user(self, user, reason):
+        """Remove a user from the server, telling everyone who shares a channel"""
+        user.quit = True
+        if user.registered:
+            self.send_to(self.peers(user), encode_line(user.prefix, 'QUIT', reason))
+        for name in list(user.channels):
+            self.part(user, self.channels[name])
+        if self.users.get(user.nick.lower()) is user:
+            del self.users[user.nick.lower()]
+
+    def send_names(self, user, channel):
+        """Send the member list of a channel (353 lines, then 366)"""
+        entries = [prefix + nick for nick, prefix in channel.members.items()]
+        for i in range(0, len(entries), NAMES_PER_LINE):
+            self.numeric(user, '353', '=', channel.name, " ".join(entries[i:i + NAMES_PER_LINE]))
+        self.numeric(user, '366', channel.name, "End of /NAMES list.")
+
+    # Command handlers
+
+    def on_nick(self, user, msg):
+        if not msg.params:
+            self.numeric(user, '431', "No nickname given")
+            return
+        nick = msg.params[0]
+        if nick[0] in '#&:' or ' ' in nick:
+            self.numeric(user, '432', nick, "Erroneous nickname")
+            return
+        existing = self.find_user(nick)
+        if existing is not None and existing is not user:
+            self.numeric(user, '433', nick, "Nickname is already in use")
+            return
+        if not user.registered:
+            user.nick = nick
+            self.try_register(user)
+            return
+
+        data = encode_line(user.prefix, 'NICK', nick)
+        self.send_to(self.peers(user) | {user}, data)
+        del self.users[user.nick.lower()]
+        for name in user.channels:
+            members = self.channels[name].members
+            members[nick] = members.pop(user.nick)
+        user.nick = nick
+        self.users[nick.lower()] = user
+
+    def on_user(self, user, msg):
+        if user.registered:
+            self.numeric(user, '462', "You may not reregister")
+            return
+        if len(msg.params) < 4:
+            self.numeric(user, '461', 'USER', "Not enough parameters")
+            return
+        user.user = msg.params[0]
+        self.try_register(user)
+
+    def try_register(self, user):
+        """Welcome a client once it has sent NICK and USER, and ended CAP negotiation"""
+        if user.nick == "*" or user.user is None or user.negotiating:
+            return
+        user.registered = True
+        self.users[user.nick.lower()] = user
+        self.numeric(user, '001', f"Welcome to the {NETWORK_NAME} IRC Network {user.prefix}")
+        self.numeric(user, '002', f"Your host is {self.name}, running fake-ircd")
+        self.numeric(user, '003', "This server was created for testing")
+        self.numeric(user, '004', self.name, "fake-ircd", "i", "beIklmnopstv")
+        self.numeric(user, '005', *ISUPPORT, "are supported by this server")
+        self.numeric(user, '422', "MOTD File is missing")
+
+    def on_cap(self, user, msg):
+        if not msg.params:
+            self.numeric(user, '461', 'CAP', "Not enough parameters")
+            return
+        subcommand = msg.params[0].upper()
+        if subcommand == 'LS':
+            if not user.registered:
+                user.negotiating = True
+            values = len(msg.params) > 1 and msg.params[1].isdigit() and int(msg.params[1]) >= 302
+            caps = " ".join(f"{name}={value}" if value and values else name
+                            for name, value in CAPABILITIES.items())
+            user.send(encode_line(self.name, 'CAP', user.nick, 'LS', caps))
+        elif subcommand == 'LIST':
+            user.send(encode_line(self.name, 'CAP', user.nick, 'LIST', " ".join(sorted(user.caps))))
+        elif subcommand == 'REQ' and len(msg.params) > 1:
+            if not user.registered:
+                user.negotiating = True
+            requested = msg.params[1].split()
+            if all(name.lstrip('-') in CAPABILITIES for name in requested):
+                for name in requested:
+                    if name.startswith('-'):
+                        user.caps.discard(name[1:])
+                    else:
+                        user.caps.add(name)
+                user.send(encode_line(self.name, 'CAP', user.nick, 'ACK', msg.params[1]))
+            else:
+                user.send(encode_line(self.name, 'CAP', user.nick, 'NAK', msg.params[1]))
+        elif subcommand == 'END':
+            if user.negotiating:
+                user.negotiating = False
+                self.try_register(user)
+        else:
+            self.numeric(user, '410', subcommand, "Invalid CAP command")
+
+    def on_authenticate(self, user, msg):
+        if 'sasl' not in user.caps or not msg.params:
+            self.numeric(user, '904', "SASL authentication failed")
+            return
+        if user.account is not None:
+            self.numeric(user, '907', "You have already authenticated using SASL")
+            return
+        data = msg.params[0]
+        if user.sasl_mechanism is None:
+            if data.upper() not in SASL_MECHANISMS:
+                self.numeric(user, '908', ",".join(SASL_MECHANISMS), "are available SASL mechanisms")
+                self.numeric(user, '904', "SASL authentication failed")
+                return
+            user.sasl_mechanism = data.upper()
+            user.sasl_data = ""
+            user.send(encode_line(None, 'AUTHENTICATE', '+'))
+            return
+        if data == '*':
+            user.sasl_mechanism = None
+            self.numeric(user, '906', "SASL authentication aborted")
+            return
+        if data != '+':
+            user.sasl_data += data
+        if len(data) == SASL_CHUNK:
+            return
+
+        mechanism, user.sasl_mechanism = user.sasl_mechanism, None
+        account = None
+        try:
+            payload = base64.b64decode(user.sasl_data, validate=True)
+        except binascii.Error:
+            payload = None
+        if mechanism == 'PLAIN' and payload and payload.count(b'\0') == 2:
+            authzid, name, password = payload.decode('utf-8', 'replace').split('\0')
+            if self.accounts.get(name) == password and authzid in ('', name):
+                account = name
+        elif mechanism == 'EXTERNAL' and payload is not None:
+            account = self.certfp_accounts.get(user.certfp)
+        if account is None:
+            self.numeric(user, '904', "SASL authentication failed")
+            return
+        user.account = account
+        self.numeric(user, '900', f"{user.nick}!{user.user or '*'}@{user.host}", account,
+                     f"You are now logged in as {account}")
+        self.numeric(user, '903', "SASL authentication successful")
+
+    def on_ping(self, user, msg):
+        token = msg.params[-1] if msg.params else self.name
+        user.send(encode_line(self.name, 'PONG', self.name, token))
+        self.sent_lines += 1
+
+    def on_pong(self, user, msg):
+        pass
+
+    def on_join(self, user, msg):
+        if not msg.params:
+            self.numeric(user, '461', 'JOIN', "Not enough parameters")
+            return
+        for name in msg.params[0].split(','):
+            if not name or name[0] not in '#&':
+                self.numeric(user, '403', name, "No such channel")
+                continue
+            channel = self.find_channel(name)
+            if channel is not None and user.nick in channel.members:
+                continue
+            channel = self.join(user, name)
+            if channel.topic:
+                self.numeric(user, '332', channel.name, channel.topic)
+            self.send_names(user, channel)
+
+    def on_part(self, user, msg):
+        if not msg.params:
+            self.numeric(user, '461', 'PART', "Not enough parameters")
+            return
+        reason = msg.params[1] if len(msg.params) > 1 else user.nick
+        for name in msg.params[0].split(','):
+            channel = self.find_channel(name)
+            if channel is None or user.nick not in channel.members:
+                self.numeric(user, '442', name, "You're not on that channel")
+                continue
+            self.send_to(channel.local, encode_line(user.prefix, 'PART', channel.name, reason))
+            self.part(user, channel)
+
+    def on_quit(self, user, msg):
+        reason = f"Quit: {msg.params[0]}" if msg.params else "Client Quit"
+        user.send(encode_line(None, 'ERROR', f"Closing Link: {user.host} ({reason})"))
+        self.remove_user(user, reason)
+
+    def on_privmsg(self, user, msg):
+        notice = msg.command == 'NOTICE'
+        if not msg.params:
+            if not notice:
+                self.numeric(user, '411', f"No recipient given ({msg.command})")
+            return
+        if len(msg.params) < 2:
+            if not notice:
+                self.numeric(user, '412', "No text to send")
+            return
+        text = msg.params[-1]
+        for target in msg.params[0].split(','):
+            channel = self.find_channel(target) if target[0] in '#&' else None
+            if channel is not None:
+                if user.nick not in channel.members:
+                    if not notice:
+                        self.numeric(user, '404', target, "Cannot send to channel")
+                    continue
+                self.send_to(channel.local - {user}, encode_line(user.prefix, msg.command, channel.name, text))
+                continue
+            recipient = None if target[0] in '#&' else self.find_user(target)
+            if recipient is None:
+                if not notice:
+                    self.numeric(user, '401', target, "No such nick/channel")
+                continue
+            self.send_to([recipient], encode_line(user.prefix, msg.command, recipient.nick, text))
+
+    def on_names(self, user, msg):
+        if not msg.params:
+            self.numeric(user, '366', '*', "End of /NAMES list.")
+            return
+        for name in msg.params[0].split(','):
+            channel = self.find_channel(name)
+            if channel is None:
+                self.numeric(user, '366', name, "End of /NAMES list.")
+            else:
+                self.send_names(user, channel)
+
+    def on_topic(self, user, msg):
+        if not msg.params:
+            self.numeric(user, '461', 'TOPIC', "Not enough parameters")
+            return
+        channel = self.find_channel(msg.params[0])
+        if channel is None:
+            self.numeric(user, '403', msg.params[0], "No such channel")
+        elif len(msg.params) == 1:
+            if channel.topic:
+                self.numeric(user, '332', channel.name, channel.topic)
+            else:
+                self.numeric(user, '331', channel.name, "No topic is set")
+        elif user.nick not in channel.members:
+            self.numeric(user, '442', channel.name, "You're not on that channel")
+        else:
+            self.set_topic(channel.name, msg.params[1], user)
+
+    def on_list(self, user, msg):
+        self.numeric(user, '321', "Channel", "Users  Name")
+        for channel in list(self.channels.values()):
+            self.numeric(user, '322', channel.name, str(len(channel.members)), channel.topic or "")
+        self.numeric(user, '323', "End of /LIST")
+
+    def on_mode(self, user, msg):
+        if not msg.params:
+            self.numeric(user, '461', 'MODE', "Not enough parameters")
+            return
+        target = msg.params[0]
+        if target[0] not in '#&':
+            # User modes are not supported; report none set
+            self.numeric(user, '221', "+")
+            return
+        channel = self.find_channel(target)
+        if channel is None:
+            self.numeric(user, '403', target, "No such channel")
+        elif len(msg.params) == 1:
+            self.numeric(user, '324', channel.name, "+nt")
+        elif '@' not in channel.members.get(user.nick, ''):
+            self.numeric(user, '482', channel.name, "You're not channel operator")
+        else:
+            self.set_modes(channel.name, msg.params[1], msg.params[2:], user)
+
+    # Scripted traffic
+
+    def add_user(self, nick=None, channels=(), announce=True):
+        """Add a simulated user and join it to channels
+
+        Args:
+            nick: Its nick; a free 'simN' nick if None.
+            announce: Send its JOINs to the connected members.
+
+        Returns:
+            The FakeUser.
+        """
+        if nick is None:
+            nick = self.free_nick("sim")
+        user = FakeUser(nick, user=nick[:10], host="sim.fake")
+        self.users[nick.lower()] = user
+        for name in channels:
+            self.join(user, name, announce)
+        return user
+
+    def free_nick(self, prefix):
+        while True:
+            self.simulated += 1
+            nick = f"{prefix}{self.simulated}"
+            if nick.lower() not in self.users:
+                return nick
+
+    def populate(self, channel, count, prefix="user", announce=False):
+        """Fill a channel with count simulated users
+
+        Without announce they are added silently, as if they had been in
+        the channel all along: they only show up in NAMES.
+
+        Returns:
+            The list of FakeUsers added.
+        """
+        return [self.add_user(self.free_nick(prefix), [channel], announce) for _ in range(count)]
+
+    def say(self, nick, target, text, command='PRIVMSG'):
+        """Have a simulated user send a message to a channel or nick"""
+        user = self.find_user(nick)
+        channel = self.find_channel(target)
+        if channel is not None:
+            self.send_to(channel.local - {user}, encode_line(user.prefix, command, channel.name, text))
+        else:
+            recipient = self.find_user(target)
+            self.send_to([recipient], encode_line(user.prefix, command, recipient.nick, text))
+
+    def set_topic(self, name, topic, user=None):
+        """Set a channel's topic, announcing it as set by user (or the server)"""
+        channel = self.find_channel(name)
+        channel.topic = topic
+        prefix = user.prefix if user else self.name
+        self.send_to(channel.local, encode_line(prefix, 'TOPIC', channel.name, topic))
+
+    def set_modes(self, name, modes, nicks, user=None):
+        """Apply +o/-o/+v/-v to channel members, announcing the change
+
+        Returns:
+            The modes actually applied, e.g. '+ov'.
+        """
+        channel = self.find_channel(name)
+        symbols = {'o': '@', 'v': '+'}
+        adding = True
+        nicks = list(nicks)
+        applied = []
+        applied_nicks = []
+        for mode in modes:
+            if mode in '+-':
+                adding = mode == '+'
+            elif mode in symbols and nicks:
+                nick = nicks.pop(0)
+                if nick not in channel.members:
+                    continue
+                channel.members[nick] = symbols[mode] if adding else ''
+                applied.append(('+' if adding else '-') + mode)
+                applied_nicks.append(nick)
+        if applied:
+            prefix = user.prefix if user else self.name
+            line = encode_line(prefix, 'MODE', channel.name, ''.join(applied), *applied_nicks)
+            self.send_to(channel.local, line)
+        return ''.join(applied)
+
+    async def flood(self, channel, rate, count, text="load test message {n}"):
+        """Have the simulated members of a channel send count messages
+
+        Messages are spread over the channel's simulated members in turn
+        and paced at rate messages per second; at high rates each loop
+        iteration sends the messages that have come due since the last.
+
+        Returns:
+            The number of seconds it took.
+        """
+        loop = asyncio.get_running_loop()
+        channel = self.find_channel(channel)
+        senders = [self.users[nick.lower()] for nick in channel.members
+                   if self.users[nick.lower()].writer is None]
+        if not senders:
+            raise ValueError(f"{channel.name} has no simulated members")
+        start = loop.time()
+        sent = 0
+        while sent < count:
+            due = min(count, int((loop.time() - start) * rate) + 1)
+            while sent < due:
+                sender = senders[sent % len(senders)]
+                self.send_to(channel.local, encode_line(sender.prefix, 'PRIVMSG', channel.name,
+                                                        text.format(n=sent)))
+                sent += 1
+            if sent < count:
+                await asyncio.sleep(max(0.0, start + sent / rate - loop.time()))
+        return loop.time() - start
+
+    def kill(self, nick, reason="Killed"):
+        """Drop a connected user's connection, as a server KILL or ping timeout would"""
+        user = self.find_user(nick)
+        user.send(encode_line(None, 'ERROR', f"Closing Link: {user.host} ({reason})"))
+        self.remove_user(user, reason)
+        user.writer.close()
+
+    def netsplit(self, fraction=0.5, servers=f"{SERVER_NAME} split.{SERVER_NAME}"):
+        """Have a fraction of the simulated users quit at once, as in a netsplit
+
+        Returns:
+            (nick, channel names) of each user split off, for netjoin().
+        """
+        simulated = [user for user in self.users.values() if user.writer is None]
+        split = []
+        for user in simulated[:int(len(simulated) * fraction)]:
+            channels = [self.channels[name].name for name in user.channels]
+            split.append((user.nick, channels))
+            self.remove_user(user, servers)
+        return split
+
+    def netjoin(self, split):
+        """Bring users back after a netsplit, rejoining their channels"""
+        for nick, channels in split:
+            self.add_user(nick, channels)
+
+
+def main():
+    """Run a fake server for manual testing or load testing"""
+    parser = argparse.ArgumentParser(description="Fake IRC server for offline testing")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("-p", "--port", type=int, default=6667, help="Port to listen on (default: 6667)")
+    parser.add_argument("--channels", type=int, default=1, help="Channels to create, #load1, #load2 ... (default: 1)")
+    parser.add_argument("--channel-size", type=int, default=100, help="Simulated users per channel (default: 100)")
+    parser.add_argument("--rate", type=float, default=0, help="Messages per second in each channel (default: 0)")
+    parser.add_argument("--netsplit-every", type=float, default=0,
+                        help="Seconds between netsplits of half the simulated users (default: never)")
+    parser.add_argument("--tls-cert", help="Serve TLS with this certificate (PEM)")
+    parser.add_argument("--tls-key", help="Private key of the certificate, if not in --tls-cert")
+    args = parser.parse_args()
+
+    context = None
+    if args.tls_cert:
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(args.tls_cert, args.tls_key)
+
+    async def run():
+        server = FakeIRCServer()
+        await server.start(args.host, args.port, context)
+        names = [f"#load{i + 1}" for i in range(args.channels)]
+        for name in names:
+            server.populate(name, args.channel_size)
+        print(f"Fake IRC server listening on {args.host}:{server.port} "
+              f"with {len(names)} channels of {args.channel_size} users")
+
+        tasks = []
+        if args.rate:
+            async def traffic(name):
+                while True:
+                    await server.flood(name, args.rate, max(1, int(args.rate)))
+            tasks.extend(asyncio.create_task(traffic(name)) for name in names)
+        if args.netsplit_every:
+            async def splits():
+                while True:
+                    await asyncio.sleep(args.netsplit_every)
+                    split = server.netsplit()
+                    await asyncio.sleep(args.netsplit_every / 2)
+                    server.netjoin(split)
+            tasks.append(asyncio.create_task(splits()))
+        await server.server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
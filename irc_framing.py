@@ -0,0 +1,136 @@
+"""
+Line framing for data received from an IRC server
+
+Received bytes are kept in a bytearray and split on LF (with an optional
+preceding CR) before any decoding happens, so multibyte characters that
+straddle two recv() chunks are never cut in half.
+"""
+
+# recv() sizes used by the adaptive read loop
+MIN_RECV_SIZE = 4096
+MAX_RECV_SIZE = 65536
+
+# Lines longer than this are dropped (IRCv3 allows 8191 bytes of tags + 512)
+MAX_LINE_LENGTH = 16384
+
+
+def decode_line(data, encoding='utf-8', fallback_encoding='latin-1'):
+    """Decode one complete line
+
+    IRC has no mandated encoding; lines that are not valid in the primary
+    encoding are decoded with the fallback instead of dropping bytes.
+    """
+    try:
+        return data.decode(encoding)
+    except UnicodeDecodeError:
+        return data.decode(fallback_encoding, errors='replace')
+
+
+def next_recv_size(current, received):
+    """Grow the recv() size while reads fill it, shrink it when they do not"""
+    if received >= current and current < MAX_RECV_SIZE:
+        return current * 2
+    if received < current // 4 and current > MIN_RECV_SIZE:
+        return current // 2
+    return current
+
+
+class LineBuffer:
+    """Accumulates received bytes and returns complete decoded lines"""
+
+    def __init__(self, encoding='utf-8', fallback_encoding='latin-1',
+                 max_line_length=MAX_LINE_LENGTH):
+        self.encoding = encoding
+        self.fallback_encoding = fallback_encoding
+        self.max_line_length = max_line_length
+        self.buffer = bytearray()
+        # Offset up to which the buffer is known not to contain a newline
+        self.scanned = 0
+        # Set while dropping the rest of a line that grew too long
+        self.discarding = False
+
+    def feed(self, data):
+        """Add received bytes and return the list of completed lines
+
+        Args:
+            data: bytes, bytearray or memoryview as returned by recv().
+
+        Returns:
+            The decoded lines without their line terminators.
+        """
+        buffer = self.buffer
+        buffer += data
+
+        if self.discarding:
+            start = buffer.find(b'\n')
+            if start == -1:
+                buffer.clear()
+                return []
+            del buffer[:start + 1]
+            self.discarding = False
+
+        end = buffer.rfind(b'\n', self.scanned)
+        if end == -1:
+            self.scanned = len(buffer)
+            lines = []
+        else:
+            block = buffer[:end]
+            # Deleting from the front of a bytearray only moves its start
+            # pointer, so the unconsumed tail is not copied
+            del buffer[:end + 1]
+            self.scanned = len(buffer)
+            if len(block) > self.max_line_length and self.has_long_line(block):
+                block = self.drop_long_lines(block)
+            lines = self.split_lines(block)
+
+        if self.scanned > self.max_line_length:
+            buffer.clear()
+            self.scanned = 0
+            self.discarding = True
+
+        return lines
+
+    def has_long_line(self, block):
+        """Whether a block of complete lines has one over max_line_length
+
+        Jumps to the last newline within reach of each line start, so a
+        block of short lines takes one search per max_line_length bytes.
+        """
+        limit = self.max_line_length
+        start = 0
+        while len(block) - start > limit:
+            newline = block.rfind(b'\n', start, start + limit + 1)
+            if newline == -1:
+                return True
+            start = newline + 1
+        return False
+
+    def drop_long_lines(self, block):
+        """Remove the lines longer than max_line_length from a block of lines"""
+        return b'\n'.join(line for line in block.split(b'\n')
+                           if len(line.rstrip(b'\r')) <= self.max_line_length)
+
+    def split_lines(self, block):
+        """Decode a block of complete lines and split it
+
+        The block is decoded in one call; only when it is not valid in the
+        primary encoding is each line decoded on its own with the fallback.
+        """
+        try:
+            text = block.decode(self.encoding)
+        except UnicodeDecodeError:
+            lines = [decode_line(line.rstrip(b'\r'), self.encoding, self.fallback_encoding)
+                     for line in block.split(b'\n')]
+        else:
+            lines = text.split('\r\n')
+            # Joining the lines back is cheaper than counting the newlines
+            if '\n' in ''.join(lines):
+                # Some lines are terminated by a bare LF
+                lines = text.replace('\r\n', '\n').split('\n')
+            last = lines[-1]
+            if last[-1:] == '\r':
+                lines[-1] = last[:-1]
+
+        if '' in lines:
+            lines = [line for line in lines if line]
+        return lines
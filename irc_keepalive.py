@@ -0,0 +1,121 @@
+"""
+Keepalive PINGs and dead link detection
+
+A TCP connection whose path silently goes away (a NAT entry expiring, a
+laptop changing networks) only notices after many minutes, and until
+then a blocking recv() waits forever. The client therefore sends a PING
+of its own once nothing has been received for a while; if nothing at
+all arrives within the timeout after it, the link is declared dead and
+the connection is dropped, so it can be reconnected.
+
+The PONG replies also measure the round trip time of each connection,
+whose recent history is kept in the connection's LinkMonitor.
+"""
+import collections
+import time
+from typing import NamedTuple
+
+DEFAULT_PING_INTERVAL = 60.0
+DEFAULT_PING_TIMEOUT = 30.0
+DEFAULT_RTT_HISTORY = 20
+
+# Sent as the PING token, followed by a counter
+PING_TOKEN_PREFIX = "keepalive-"
+
+
+class KeepalivePolicy(NamedTuple):
+    """When to PING and when to give up on a link; can be shared by clients
+
+    Attributes:
+        interval: Seconds without receiving anything before sending a PING.
+        timeout: Seconds without receiving anything after a PING before the
+            link is declared dead.
+        history: Number of round trip times kept per connection.
+    """
+    interval: float = DEFAULT_PING_INTERVAL
+    timeout: float = DEFAULT_PING_TIMEOUT
+    history: int = DEFAULT_RTT_HISTORY
+
+
+class LinkMonitor:
+    """Keepalive state and round trip times of one client's connection
+
+    Not locked: received() is called by the receiving side, the rest by
+    whichever side runs the keepalive checks, and each attribute is only
+    ever replaced whole.
+
+    Args:
+        policy: The KeepalivePolicy.
+        clock: Monotonic time source, replaceable for tests.
+    """
+
+    def __init__(self, policy, clock=time.monotonic):
+        self.policy = policy
+        self.clock = clock
+        self.rtts = collections.deque(maxlen=policy.history)
+        self.pings_sent = 0
+        self.pongs_received = 0
+        self.dead_links = 0
+        self.reset()
+
+    def reset(self):
+        """Start monitoring a new connection; the RTT history is kept"""
+        self.last_received = self.clock()
+        self.ping_token = None
+        self.ping_sent_at = None
+
+    def received(self):
+        """Note that data arrived"""
+        self.last_received = self.clock()
+
+    def poll(self):
+        """What is due now
+
+        Returns:
+            (action, deadline): action is 'ping' when a PING should be sent
+            (see start_ping()), 'dead' when the link is dead, or None; the
+            deadline is the clock() time of the next poll.
+        """
+        now = self.clock()
+        if self.ping_sent_at is not None and self.last_received < self.ping_sent_at:
+            deadline = self.ping_sent_at + self.policy.timeout
+            if now >= deadline:
+                self.dead_links += 1
+                return 'dead', None
+            return None, deadline
+        deadline = self.last_received + self.policy.interval
+        if now >= deadline:
+            return 'ping', now + self.policy.timeout
+        return None, deadline
+
+    def start_ping(self):
+        """Note that a PING is being sent; returns the token to send with it"""
+        self.pings_sent += 1
+        self.ping_token = f"{PING_TOKEN_PREFIX}{self.pings_sent}"
+        self.ping_sent_at = self.clock()
+        return self.ping_token
+
+    def pong(self, token):
+        """Handle a PONG; returns the round trip time, or None if it was not ours"""
+        if token is None or token != self.ping_token:
+            return None
+        rtt = self.clock() - self.ping_sent_at
+        self.ping_token = None
+        self.pongs_received += 1
+        self.rtts.append(rtt)
+        return rtt
+
+    def stats(self):
+        """Round trip times (in seconds) and keepalive counters"""
+        rtts = list(self.rtts)
+        return {
+            'rtt': rtts[-1] if rtts else None,
+            'rtt_avg': sum(rtts) / len(rtts) if rtts else None,
+            'rtt_min': min(rtts) if rtts else None,
+            'rtt_max': max(rtts) if rtts else None,
+            'rtt_history': rtts,
+            'idle': self.clock() - self.last_received,
+            'pings_sent': self.pings_sent,
+            'pongs_received': self.pongs_received,
+            'dead_links': self.dead_links,
+        }
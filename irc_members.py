@@ -0,0 +1,337 @@
+"""
+Channel membership tracking
+
+Members are indexed both by channel and by nick, so a QUIT or NICK only
+touches the channels the user is actually in instead of probing every
+channel we have joined. Each member's channel prefix modes (@, + ...) are
+kept too, along with a per-channel list sorted by rank then nick that is
+updated in place on join/part/mode instead of being re-sorted.
+
+Every change to a channel's members bumps the channel's version and is
+reported to an optional listener, so a consumer such as the web GUI can
+send a member list once and then only the changes.
+"""
+from bisect import bisect_left, insort
+
+# Defaults used until the server sends ISUPPORT (005)
+DEFAULT_PREFIX = "(qaohv)~&@%+"
+DEFAULT_CHANMODES = "beI,k,l,imnpst"
+
+
+class MemberIndex:
+    """Two-way index of channel members with their prefix modes
+
+    channel_users maps each channel to the set of nicks in it and is what
+    IRCClient exposes; nick_channels is the reverse index. channel_modes
+    maps each channel to {nick: prefixes} with prefixes ordered by rank
+    (e.g. '@+'), and sorted_members holds (rank, lowercase nick, nick)
+    keys in display order. All of them are kept consistent by the methods
+    below and must not be modified directly.
+
+    versions maps each channel to a counter bumped on every change. If
+    listener is set, it is called as listener(channel, version, op, nick,
+    value) after each change, where op is one of:
+
+        'add': nick joined with prefixes value
+        'remove': nick left
+        'rename': nick is now known as value
+        'mode': nick's prefixes are now value
+        'reset': the whole member list was replaced (NAMES)
+    """
+
+    def __init__(self):
+        self.channel_users = {}
+        self.nick_channels = {}
+        self.channel_modes = {}
+        self.sorted_members = {}
+        # NAMES replies (353) being received, swapped in at 366
+        self.pending_names = {}
+        self.versions = {}
+        self.listener = None
+        self.prefixes = None
+        self.mode_prefixes = {}
+        self.set_prefix_support(DEFAULT_PREFIX)
+        self.set_chanmodes(DEFAULT_CHANMODES)
+
+    def set_prefix_support(self, value):
+        """Apply the ISUPPORT PREFIX token, e.g. '(ov)@+'
+
+        Ranks come from the prefix order, so the sorted member lists of
+        channels already tracked (a late 005, or one after a reconnect)
+        are rebuilt, dropping prefixes the server no longer has.
+        """
+        modes, _, prefixes = value[1:].partition(')')
+        mode_prefixes = dict(zip(modes, prefixes))
+        if prefixes == self.prefixes and mode_prefixes == self.mode_prefixes:
+            return
+        self.mode_prefixes = mode_prefixes
+        self.prefixes = prefixes
+        for channel, members in self.channel_modes.items():
+            for nick, old in members.items():
+                members[nick] = self.order_prefixes(old)
+            self.sorted_members[channel] = sorted(self.sort_key(nick, prefixes)
+                                                  for nick, prefixes in members.items())
+            self.changed(channel, 'reset')
+
+    def set_chanmodes(self, value):
+        """Apply the ISUPPORT CHANMODES token, e.g. 'beI,k,l,imnpst'
+
+        Only used to know which non-prefix modes take a parameter.
+        """
+        groups = (value.split(',') + ['', '', '', ''])[:4]
+        self.always_param_modes = groups[0] + groups[1]
+        self.set_param_modes = groups[2]
+
+    def rank(self, prefixes):
+        """Sort rank of a member, lower is more privileged"""
+        return self.prefixes.find(prefixes[0]) if prefixes else len(self.prefixes)
+
+    def sort_key(self, nick, prefixes):
+        return (self.rank(prefixes), nick.lower(), nick)
+
+    def split_prefixes(self, entry):
+        """Split a NAMES entry like '@+nick' into ('nick', '@+')"""
+        i = 0
+        while i < len(entry) and entry[i] in self.prefixes:
+            i += 1
+        if not i:
+            return entry, ''
+        return entry[i:], self.order_prefixes(entry[:i])
+
+    def order_prefixes(self, prefixes):
+        """Order prefix characters by rank"""
+        return ''.join(prefix for prefix in self.prefixes if prefix in prefixes)
+
+    def changed(self, channel, op, nick=None, value=None):
+        """Bump a channel's version and report the change to the listener"""
+        version = self.versions[channel] = self.versions.get(channel, 0) + 1
+        if self.listener:
+            self.listener(channel, version, op, nick, value)
+
+    def insert_sorted(self, channel, nick, prefixes):
+        insort(self.sorted_members[channel], self.sort_key(nick, prefixes))
+
+    def remove_sorted(self, channel, nick, prefixes):
+        members = self.sorted_members[channel]
+        key = self.sort_key(nick, prefixes)
+        i = bisect_left(members, key)
+        if i < len(members) and members[i] == key:
+            del members[i]
+
+    def ensure_channel(self, channel):
+        """Start tracking a channel if it is not tracked yet"""
+        users = self.channel_users.get(channel)
+        if users is None:
+            users = self.channel_users[channel] = set()
+            self.channel_modes[channel] = {}
+            self.sorted_members[channel] = []
+        return users
+
+    def add(self, channel, nick, prefixes=''):
+        """Add a nick to a channel, tracking the channel if needed"""
+        users = self.ensure_channel(channel)
+        if nick in users:
+            return
+        users.add(nick)
+        self.channel_modes[channel][nick] = prefixes
+        self.insert_sorted(channel, nick, prefixes)
+        channels = self.nick_channels.get(nick)
+        if channels is None:
+            channels = self.nick_channels[nick] = set()
+        channels.add(channel)
+        self.changed(channel, 'add', nick, prefixes)
+
+    def remove(self, channel, nick):
+        """Remove a nick from a channel
+
+        Returns:
+            True if the nick was in the channel.
+        """
+        users = self.channel_users.get(channel)
+        if users is None or nick not in users:
+            return False
+        users.remove(nick)
+        self.remove_sorted(channel, nick, self.channel_modes[channel].pop(nick))
+        channels = self.nick_channels[nick]
+        channels.discard(channel)
+        if not channels:
+            del self.nick_channels[nick]
+        self.changed(channel, 'remove', nick)
+        return True
+
+    def quit(self, nick):
+        """Remove a nick from every channel
+
+        Returns:
+            The set of channels the nick was in.
+        """
+        channels = self.nick_channels.pop(nick, set())
+        for channel in channels:
+            self.channel_users[channel].discard(nick)
+            self.remove_sorted(channel, nick, self.channel_modes[channel].pop(nick))
+            self.changed(channel, 'remove', nick)
+        return channels
+
+    def rename(self, old_nick, new_nick):
+        """Apply a nick change to every channel the nick is in
+
+        Returns:
+            The set of channels the nick is in.
+        """
+        channels = self.nick_channels.pop(old_nick, set())
+        if not channels:
+            return channels
+        for channel in channels:
+            users = self.channel_users[channel]
+            modes = self.channel_modes[channel]
+            if new_nick != old_nick and new_nick in users:
+                # A stale entry, e.g. from a missed QUIT: the renamed user
+                # takes its place
+                self.remove_sorted(channel, new_nick, modes.pop(new_nick))
+                self.changed(channel, 'remove', new_nick)
+            users.discard(old_nick)
+            users.add(new_nick)
+            prefixes = modes.pop(old_nick)
+            modes[new_nick] = prefixes
+            self.remove_sorted(channel, old_nick, prefixes)
+            self.insert_sorted(channel, new_nick, prefixes)
+            self.changed(channel, 'rename', old_nick, new_nick)
+        self.nick_channels.setdefault(new_nick, set()).update(channels)
+        return channels
+
+    def forget_channel(self, channel):
+        """Stop tracking a channel we left, along with all of its members
+
+        Its version goes too, so the listener is not called: there is no
+        member list left to update.
+        """
+        users = self.channel_users.pop(channel, set())
+        for nick in users:
+            channels = self.nick_channels.get(nick)
+            if channels is not None:
+                channels.discard(channel)
+                if not channels:
+                    del self.nick_channels[nick]
+        self.channel_modes.pop(channel, None)
+        self.sorted_members.pop(channel, None)
+        self.versions.pop(channel, None)
+        self.pending_names.pop(channel, None)
+
+    def set_mode(self, channel, nick, mode, adding):
+        """Add or remove a prefix mode (e.g. 'o') for a channel member
+
+        Returns:
+            True if the member's prefixes changed.
+        """
+        prefix = self.mode_prefixes.get(mode)
+        modes = self.channel_modes.get(channel)
+        if prefix is None or modes is None or nick not in modes:
+            return False
+        old = modes[nick]
+        if adding:
+            new = self.order_prefixes(old + prefix)
+        else:
+            new = old.replace(prefix, '')
+        if new == old:
+            return False
+        modes[nick] = new
+        if self.rank(new) != self.rank(old):
+            self.remove_sorted(channel, nick, old)
+            self.insert_sorted(channel, nick, new)
+        self.changed(channel, 'mode', nick, new)
+        return True
+
+    def apply_mode(self, channel, modestring, args):
+        """Apply a channel MODE line, e.g. ('+ov-v', ['a', 'b', 'c'])
+
+        Returns:
+            A list of (nick, mode, adding) for the member modes that changed.
+        """
+        changes = []
+        args = list(args)
+        adding = True
+        for mode in modestring:
+            if mode == '+':
+                adding = True
+            elif mode == '-':
+                adding = False
+            elif mode in self.mode_prefixes:
+                if args:
+                    nick = args.pop(0)
+                    if self.set_mode(channel, nick, mode, adding):
+                        changes.append((nick, mode, adding))
+            elif mode in self.always_param_modes or (adding and mode in self.set_param_modes):
+                if args:
+                    args.pop(0)
+        return changes
+
+    def stage_names(self, channel, entries):
+        """Collect entries from a NAMES reply (353) without touching the channel
+
+        Args:
+            entries: Nicks with their prefixes, e.g. ['@+alice', 'bob'].
+        """
+        pending = self.pending_names.get(channel)
+        if pending is None:
+            pending = self.pending_names[channel] = {}
+        for entry in entries:
+            nick, prefixes = self.split_prefixes(entry)
+            pending[nick] = prefixes
+
+    def finish_names(self, channel):
+        """Replace a channel's members with the staged NAMES reply (366)
+
+        The channel's set, modes and sorted list are swapped for new ones in
+        a single step each, so readers see either the old or the complete
+        new member list, and users who left without us noticing are dropped.
+
+        Returns:
+            The new set of members, or None if the channel is not tracked
+            and no reply was staged for it.
+        """
+        modes = self.pending_names.pop(channel, None)
+        old_users = self.channel_users.get(channel)
+        if modes is None:
+            if old_users is None:
+                return None
+            modes = {}
+        users = set(modes)
+
+        if old_users:
+            for nick in old_users - users:
+                channels = self.nick_channels[nick]
+                channels.discard(channel)
+                if not channels:
+                    del self.nick_channels[nick]
+            added = users - old_users
+        else:
+            added = users
+        for nick in added:
+            channels = self.nick_channels.get(nick)
+            if channels is None:
+                channels = self.nick_channels[nick] = set()
+            channels.add(channel)
+
+        self.sorted_members[channel] = sorted(self.sort_key(nick, prefixes)
+                                              for nick, prefixes in modes.items())
+        self.channel_modes[channel] = modes
+        self.channel_users[channel] = users
+        self.changed(channel, 'reset')
+        return users
+
+    def prefixes_of(self, channel, nick):
+        """The prefixes of a member in a channel, e.g. '@+'"""
+        return self.channel_modes.get(channel, {}).get(nick, '')
+
+    def member_list(self, channel):
+        """Members of a channel sorted by rank then nick, e.g. ['@op', '+v', 'nick']
+
+        Only the highest prefix of each member is shown.
+        """
+        prefixes = self.prefixes
+        return [prefixes[rank] + nick if rank < len(prefixes) else nick
+                for rank, lower, nick in self.sorted_members.get(channel, ())]
+
+    def channels_of(self, nick):
+        """The channels a nick is known to be in"""
+        return self.nick_channels.get(nick, set())
@@ -0,0 +1,77 @@
+"""
+IRC line parser
+
+Every line received from the server is parsed exactly once into an
+immutable IRCMessage which is then handed to every layer (client state,
+web GUI, callbacks) instead of each layer re-running its own regex.
+"""
+from typing import NamedTuple, Optional, Tuple
+
+
+class IRCMessage(NamedTuple):
+    """A single parsed IRC protocol line"""
+    raw: str
+    tags: Optional[str]
+    prefix: Optional[str]
+    nick: Optional[str]
+    user: Optional[str]
+    host: Optional[str]
+    command: str
+    params: Tuple[str, ...]
+    trailing: Optional[str]
+
+
+def parse_prefix(prefix):
+    """Split a message prefix into (nick, user, host)
+
+    Server prefixes (no '!' or '@') are returned as the nick with no
+    user or host, which matches how the client used prefix.split('!')[0].
+    """
+    nick, sep, rest = prefix.partition('!')
+    if sep:
+        user, sep, host = rest.partition('@')
+        return nick, user, (host if sep else None)
+    nick, sep, host = prefix.partition('@')
+    return nick, None, (host if sep else None)
+
+
+def parse_message(line):
+    """Parse a raw IRC line (without the trailing CRLF)
+
+    Args:
+        line: The line as received from the server.
+
+    Returns:
+        An IRCMessage, or None if the line does not contain a command.
+    """
+    if not line:
+        return None
+
+    rest = line
+    tags = None
+    if rest[0] == '@':
+        tags, _, rest = rest[1:].partition(' ')
+        rest = rest.lstrip(' ')
+
+    prefix = nick = user = host = None
+    if rest[:1] == ':':
+        prefix, _, rest = rest[1:].partition(' ')
+        rest = rest.lstrip(' ')
+        nick, user, host = parse_prefix(prefix)
+
+    trailing = None
+    index = rest.find(' :')
+    if index != -1:
+        trailing = rest[index + 2:]
+        rest = rest[:index]
+
+    parts = rest.split()
+    if not parts:
+        return None
+
+    command = parts[0].upper()
+    if trailing is not None:
+        parts.append(trailing)
+    params = tuple(parts[1:])
+
+    return IRCMessage(line, tags, prefix, nick, user, host, command, params, trailing)
@@ -0,0 +1,77 @@
+"""
+Automatic reconnection
+
+When a connection drops, the client waits and connects again, waiting
+longer after each failed attempt (exponential backoff). Each wait is
+drawn at random between zero and the backoff ceiling ("full jitter"),
+so when a server restart drops hundreds of connections at once they do
+not all come back in the same instant.
+
+Once registered again, the client rejoins its channels with as few
+JOIN lines as fit, rather than one line and round trip per channel.
+"""
+import random
+from typing import NamedTuple, Optional
+
+DEFAULT_RECONNECT_INITIAL = 2.0
+DEFAULT_RECONNECT_MAX = 300.0
+
+# Longest line the server accepts, without the CRLF
+MAX_LINE_BYTES = 510
+
+
+class ReconnectPolicy(NamedTuple):
+    """When to reconnect; holds no state, so it can be shared by clients
+
+    Attributes:
+        initial: Backoff ceiling in seconds for the first attempt.
+        maximum: Largest backoff ceiling.
+        multiplier: Factor the ceiling grows by after each failed attempt.
+        max_attempts: Attempts before giving up, None to retry forever.
+    """
+    initial: float = DEFAULT_RECONNECT_INITIAL
+    maximum: float = DEFAULT_RECONNECT_MAX
+    multiplier: float = 2.0
+    max_attempts: Optional[int] = None
+
+    def delay(self, attempt, random=random.random):
+        """Seconds to wait before attempt (counting from 0)
+
+        Returns:
+            A random delay up to the attempt's backoff ceiling, or None
+            once max_attempts have been made.
+        """
+        if self.max_attempts is not None and attempt >= self.max_attempts:
+            return None
+        ceiling = min(self.maximum, self.initial * self.multiplier ** min(attempt, 64))
+        return ceiling * random()
+
+
+def join_lines(channels, limit=MAX_LINE_BYTES):
+    """JOIN commands for channels, each with as many channels as fit in limit bytes
+
+    Args:
+        channels: Channel names, joined in the order given.
+        limit: Longest line in bytes, without the CRLF.
+
+    Returns:
+        A list of lines like 'JOIN #a,#b,#c'.
+    """
+    lines = []
+    line = None
+    # Length of line in bytes, which channel names in UTF-8 may exceed
+    # its length in characters by
+    size = 0
+    for channel in channels:
+        channel_size = len(channel.encode('utf-8'))
+        if line is not None and size + 1 + channel_size <= limit:
+            line += "," + channel
+            size += 1 + channel_size
+            continue
+        if line is not None:
+            lines.append(line)
+        line = "JOIN " + channel
+        size = len("JOIN ") + channel_size
+    if line is not None:
+        lines.append(line)
+    return lines
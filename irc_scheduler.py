@@ -0,0 +1,80 @@
+"""
+Deadline scheduler shared by the whole process
+
+Ending a browser's batching window, checking a connection's keepalive
+and closing a session whose browser went away are all callbacks due at
+some time. Rather than a timer thread per callback, they are kept in a
+heap that one background thread works through as their deadlines pass.
+"""
+import heapq
+import threading
+import time
+
+
+class DeadlineScheduler:
+    """Background thread calling callbacks at their deadlines
+
+    The thread is started by the first schedule(). Callbacks run on it one
+    after another, so they must be quick and must not block.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.queue = []
+        self.sequence = 0
+        self.thread = None
+
+    def schedule(self, callback, deadline):
+        """Call callback() at the given time.monotonic() deadline
+
+        Returns:
+            A handle for cancel().
+        """
+        with self.condition:
+            # A list, so cancel() can clear its callback in place
+            entry = [deadline, self.sequence, callback]
+            self.sequence += 1
+            heapq.heappush(self.queue, entry)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify()
+        return entry
+
+    def cancel(self, handle):
+        """Do not make a call scheduled by schedule(); it is skipped when due"""
+        with self.condition:
+            handle[2] = None
+
+    def run(self):
+        """Thread target: run callbacks as their deadlines pass"""
+        while True:
+            with self.condition:
+                while True:
+                    wait = None
+                    if self.queue:
+                        wait = self.queue[0][0] - time.monotonic()
+                        if wait <= 0:
+                            callback = heapq.heappop(self.queue)[2]
+                            if callback is None:
+                                continue
+                            break
+                    self.condition.wait(wait)
+            try:
+                callback()
+            except Exception as e:
+                print(f"Scheduled call failed: {e}")
+
+
+shared_scheduler = None
+shared_scheduler_lock = threading.Lock()
+
+
+def get_shared_scheduler():
+    """The DeadlineScheduler shared by every client and session"""
+    global shared_scheduler
+    with shared_scheduler_lock:
+        if shared_scheduler is None:
+            shared_scheduler = DeadlineScheduler()
+        return shared_scheduler
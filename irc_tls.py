@@ -0,0 +1,108 @@
+"""
+TLS for IRC connections
+
+Every connection with the same TLS settings shares one SSLContext, so
+certificates and keys are loaded once, however many connections there
+are. The context also remembers the last TLS session of each server and
+offers it when connecting again, so reconnects (e.g. hundreds of web
+sessions after a restart) resume the session with an abbreviated
+handshake instead of a full one.
+
+Sessions are offered from wrap_socket() and wrap_bio(), which the
+threaded and asyncio engines call respectively, so both resume them.
+"""
+import ssl
+import threading
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """Client SSLContext remembering one TLS session per server host name
+
+    Clients call remember() once the session is established (for TLS 1.3
+    the session tickets arrive after the handshake, with the first data).
+    """
+
+    def __new__(cls, protocol=ssl.PROTOCOL_TLS_CLIENT, *args, **kwargs):
+        return super().__new__(cls, protocol, *args, **kwargs)
+
+    def __init__(self, protocol=ssl.PROTOCOL_TLS_CLIENT):
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+        # Client certificate presented, if any (SSLContext cannot tell)
+        self.certfile = None
+
+    def remember(self, server_hostname, session):
+        """Keep a server's TLS session to resume on the next connection"""
+        if session is not None:
+            with self.sessions_lock:
+                self.sessions[server_hostname] = session
+
+    def forget(self, server_hostname):
+        """Drop a server's remembered session"""
+        with self.sessions_lock:
+            self.sessions.pop(server_hostname, None)
+
+    def session_for(self, server_hostname):
+        """The remembered session of a server, or None"""
+        return self.sessions.get(server_hostname)
+
+    def wrap_socket(self, sock, server_side=False, do_handshake_on_connect=True,
+                    suppress_ragged_eofs=True, server_hostname=None, session=None):
+        if session is None and not server_side:
+            session = self.session_for(server_hostname)
+        return super().wrap_socket(sock, server_side, do_handshake_on_connect,
+                                   suppress_ragged_eofs, server_hostname, session)
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        if session is None and not server_side:
+            session = self.session_for(server_hostname)
+        return super().wrap_bio(incoming, outgoing, server_side, server_hostname, session)
+
+
+def create_tls_context(verify=True, cafile=None, certfile=None, keyfile=None, password=None):
+    """A new client context for IRC over TLS
+
+    Args:
+        verify: Check the server's certificate and host name. Many IRC
+            servers use self-signed certificates, which need verify=False
+            or their certificate as cafile.
+        cafile: Certificates to trust instead of the system's.
+        certfile: Client certificate (PEM) to present, e.g. for CertFP
+            (NickServ authentication by certificate fingerprint).
+        keyfile: Its private key, if not in certfile.
+        password: Password of the private key, if it is encrypted.
+
+    Returns:
+        A ResumingSSLContext.
+    """
+    context = ResumingSSLContext()
+    if verify:
+        if cafile:
+            context.load_verify_locations(cafile)
+        else:
+            context.load_default_certs()
+    else:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if certfile:
+        context.load_cert_chain(certfile, keyfile, password)
+        context.certfile = certfile
+    return context
+
+
+shared_contexts = {}
+shared_contexts_lock = threading.Lock()
+
+
+def get_shared_tls_context(verify=True, cafile=None, certfile=None, keyfile=None):
+    """The context shared by every connection with these TLS settings
+
+    Created on first use; see create_tls_context() for the arguments.
+    Keys that need a password cannot be shared this way.
+    """
+    key = (verify, cafile, certfile, keyfile)
+    with shared_contexts_lock:
+        context = shared_contexts.get(key)
+        if context is None:
+            context = shared_contexts[key] = create_tls_context(verify, cafile, certfile, keyfile)
+        return context
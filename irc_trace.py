@@ -0,0 +1,140 @@
+"""
+Per-stage latency tracing
+
+A LatencyTracer follows received lines on their way to the browser and
+keeps a histogram of the time spent in each stage:
+
+    'parse': data received from the socket to the line being parsed,
+        including framing, decoding and waiting behind earlier lines
+        of the same read
+    'handler': parsed to every handler being done, including state
+        updates, the scrollback and the web session's lock
+    'queue': queued for the browser to its batch being emitted, i.e. the
+        batching window and waiting for the browser to catch up
+    'emit': the socketio.emit() call of a batch
+    'ack': a batch being emitted to the browser acknowledging it
+    'total': data received to its batch having been emitted
+
+Tracing is off unless a tracer is given to the clients and sessions; the
+per-line cost is then a single attribute check.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+STAGES = ('parse', 'handler', 'queue', 'emit', 'ack', 'total')
+
+# Upper bounds of the histogram buckets in seconds: 10 us doubling up to
+# about 10 s, plus one bucket for anything slower
+DEFAULT_BOUNDS = tuple(0.00001 * 2 ** i for i in range(21))
+
+
+class LatencyHistogram:
+    """Counts of durations in fixed buckets, with their sum and maximum
+
+    Not thread-safe; LatencyTracer serializes access.
+    """
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of durations
+
+        The last bucket has no bound, so the maximum is used there.
+        """
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self):
+        """Summary and non-empty buckets as a dict of seconds"""
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            # [upper bound, count]; the last bound is None for "slower"
+            'buckets': [[self.bounds[i] if i < len(self.bounds) else None, count]
+                        for i, count in enumerate(self.counts) if count],
+        }
+
+
+class LatencyTracer:
+    """Latency histograms of each stage, shared by clients and sessions
+
+    The receiving thread (or event loop) calls parsed() and handled()
+    around the handling of each line, and anything queued for the browser
+    in between is linked to the time the line was received through
+    current().
+    """
+
+    def __init__(self, bounds=DEFAULT_BOUNDS):
+        self.bounds = bounds
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = time.time()
+        self.histograms = {stage: LatencyHistogram(bounds) for stage in STAGES}
+
+    @staticmethod
+    def now():
+        """The clock the tracer's timestamps are taken from"""
+        return time.perf_counter()
+
+    def record(self, stage, seconds):
+        """Add a duration to a stage's histogram"""
+        with self.lock:
+            self.histograms[stage].add(seconds)
+
+    def parsed(self, received):
+        """A line received at time received has been parsed"""
+        now = time.perf_counter()
+        self.local.received = received
+        self.local.parsed = now
+        self.record('parse', now - received)
+
+    def handled(self):
+        """The line passed to parsed() has been handled"""
+        received = getattr(self.local, 'received', None)
+        if received is None:
+            return
+        self.local.received = None
+        self.record('handler', time.perf_counter() - self.local.parsed)
+
+    def current(self):
+        """When the line being handled on this thread was received, or None"""
+        return getattr(self.local, 'received', None)
+
+    def snapshot(self):
+        """Histograms of every stage, as a dict for the stats endpoint"""
+        with self.lock:
+            return {
+                'since': self.started,
+                'stages': {stage: histogram.snapshot()
+                           for stage, histogram in self.histograms.items()},
+            }
+
+    def reset(self):
+        """Forget everything recorded so far"""
+        with self.lock:
+            self.started = time.time()
+            self.histograms = {stage: LatencyHistogram(self.bounds) for stage in STAGES}
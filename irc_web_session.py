@@ -0,0 +1,887 @@
+"""
+Per-session state for the web GUI
+
+Each browser session owns a WebSession with its own lock, so IRC traffic
+for one session never waits on another. The process-wide registry lock
+is only taken when sessions are created or removed, never on the
+per-line path.
+
+Received messages are sent to the browser as compact typed events built
+from the parsed message (see message_event()), so the browser never has
+to parse IRC lines itself. They are kept in a Scrollback: one bounded
+ring buffer per channel (or query, or the server buffer), limited by both
+line count and bytes, which is replayed to the browser when it switches
+channel. The least recently used query buffers are dropped once a session
+has too many of them or its scrollback grows too big, and a channel's
+buffer goes when we leave it.
+
+Events for the browser go through an EmitBatcher, which collects them for
+a short window and sends them as one 'messages' event, so a busy channel
+costs the browser a few WebSocket frames per second instead of one per
+line. It also holds events back while the browser has not acknowledged
+earlier batches, and sheds load when too many pile up.
+
+Sessions are keyed by a token the browser keeps across page loads rather
+than by its Socket.IO connection. When the browser goes away, its session
+and IRC connection are kept for a grace period, so a reload or a dropped
+connection reattaches to them and replays the scrollback instead of
+reconnecting and rejoining every channel.
+
+A session may be connected to several IRC networks at once. Each of its
+clients is known by a network id, which every event for the browser
+carries, and scrollback buffers are kept per network.
+"""
+import collections
+from bisect import bisect_left
+import secrets
+import threading
+import time
+
+from irc_scheduler import get_shared_scheduler
+
+# Buffer for server messages that do not belong to a channel or query
+SERVER_BUFFER = '*'
+
+# Characters a channel name may start with
+CHANNEL_PREFIXES = '#&'
+
+# Default limits of each scrollback buffer
+DEFAULT_SCROLLBACK_LINES = 500
+DEFAULT_SCROLLBACK_BYTES = 256 * 1024
+
+# Default limits of a session's whole scrollback: query buffers beyond
+# these are dropped, least recently used first
+DEFAULT_SCROLLBACK_QUERIES = 100
+DEFAULT_SCROLLBACK_TOTAL_BYTES = 8 * 1024 * 1024
+
+# Default limits of each batch of events sent to the browser
+DEFAULT_EMIT_WINDOW = 0.05
+DEFAULT_EMIT_MAX_EVENTS = 100
+DEFAULT_EMIT_MAX_BYTES = 32 * 1024
+
+# How many events may wait for a slow browser, how many batches it may
+# leave unacknowledged, and what to do when it falls behind
+DEFAULT_EMIT_MAX_QUEUE = 2000
+DEFAULT_EMIT_MAX_INFLIGHT = 4
+DEFAULT_EMIT_POLICY = 'collapse'
+EMIT_POLICIES = ('drop', 'collapse', 'replay')
+
+# Seconds a session outlives its browser connection
+DEFAULT_SESSION_GRACE = 300
+
+
+def message_targets(msg, client):
+    """The scrollback buffers a message belongs to
+
+    Must be called before the message is handled, so a QUIT can still be
+    matched to the channels the user was in.
+
+    Args:
+        msg: The IRCMessage.
+        client: The IRCClient that received it.
+
+    Returns:
+        A list of buffer names: channels, query nicks or SERVER_BUFFER.
+        Empty for PING and PONG, which are not shown.
+    """
+    command = msg.command
+    params = msg.params
+    if command in ('PING', 'PONG'):
+        return []
+    if command in ('PRIVMSG', 'NOTICE') and params:
+        target = params[0]
+        if target[:1] in CHANNEL_PREFIXES:
+            return [target]
+        return [msg.nick or SERVER_BUFFER]
+    if command in ('JOIN', 'PART', 'KICK', 'MODE', 'TOPIC') and params:
+        if params[0][:1] in CHANNEL_PREFIXES:
+            return [params[0]]
+        return [SERVER_BUFFER]
+    if command in ('QUIT', 'NICK'):
+        return sorted(client.members.channels_of(msg.nick)) or [SERVER_BUFFER]
+    if command.isdigit():
+        # e.g. '332 nick #chan :topic' or '353 nick = #chan :names'
+        for param in params[1:-1]:
+            if param[:1] in CHANNEL_PREFIXES:
+                return [param]
+    return [SERVER_BUFFER]
+
+
+def is_query_buffer(key):
+    """Whether a scrollback buffer, a name or (network, name), is a private query"""
+    name = key[-1] if isinstance(key, tuple) else key
+    return name != SERVER_BUFFER and name[:1] not in CHANNEL_PREFIXES
+
+
+def message_event(msg):
+    """Compact, typed form of a message for the browser
+
+    Args:
+        msg: The IRCMessage.
+
+    Returns:
+        A dict whose 'type' is one of privmsg, action, notice, join, part,
+        kick, quit, nick, mode, topic, numeric or command, with just the
+        fields that type needs.
+    """
+    command = msg.command
+    params = msg.params
+    nick = msg.nick
+    if command == 'PRIVMSG' and len(params) >= 2:
+        text = params[1]
+        if text.startswith('\x01ACTION '):
+            return {'type': 'action', 'nick': nick, 'target': params[0], 'text': text[8:].rstrip('\x01')}
+        return {'type': 'privmsg', 'nick': nick, 'target': params[0], 'text': text}
+    if command == 'NOTICE' and len(params) >= 2:
+        return {'type': 'notice', 'nick': nick, 'target': params[0], 'text': params[1]}
+    if command == 'JOIN' and params:
+        return {'type': 'join', 'nick': nick, 'channel': params[0]}
+    if command == 'PART' and params:
+        return {'type': 'part', 'nick': nick, 'channel': params[0],
+                'text': params[1] if len(params) > 1 else ''}
+    if command == 'KICK' and len(params) >= 2:
+        return {'type': 'kick', 'nick': nick, 'channel': params[0], 'target': params[1],
+                'text': params[2] if len(params) > 2 else ''}
+    if command == 'QUIT':
+        return {'type': 'quit', 'nick': nick, 'text': params[0] if params else ''}
+    if command == 'NICK' and params:
+        return {'type': 'nick', 'nick': nick, 'new': params[0]}
+    if command == 'MODE' and len(params) >= 2:
+        return {'type': 'mode', 'nick': nick, 'target': params[0], 'modes': ' '.join(params[1:])}
+    if command == 'TOPIC' and len(params) >= 2:
+        return {'type': 'topic', 'nick': nick, 'channel': params[0], 'text': params[1]}
+    if command == '332' and len(params) >= 3:
+        return {'type': 'topic', 'channel': params[1], 'text': params[2]}
+    if command.isdigit():
+        # The first parameter is our own nick
+        return {'type': 'numeric', 'code': command, 'params': list(params[1:])}
+    event = {'type': 'command', 'command': command, 'params': list(params)}
+    if nick:
+        event['nick'] = nick
+    return event
+
+
+class Scrollback:
+    """Bounded per-buffer history of parsed messages
+
+    Each buffer keeps at most max_lines messages and max_bytes bytes of
+    raw lines; the oldest messages are dropped first. Sizes are measured
+    as the length of the raw line, which is what the browser receives.
+
+    Anyone can open a query buffer by messaging us, so whole query buffers
+    are dropped, least recently used first, while there are more than
+    max_queries of them or all buffers together hold more than
+    max_total_bytes. Channel buffers are only dropped by remove().
+
+    Every message gets an id, increasing over the whole session, which the
+    browser uses to page back through a buffer.
+
+    Not thread-safe on its own; WebSession guards it with its lock.
+
+    Args:
+        max_lines: Maximum number of messages per buffer.
+        max_bytes: Maximum total length of the raw lines per buffer.
+        max_queries: Maximum number of query buffers.
+        max_total_bytes: Size above which query buffers are dropped.
+    """
+
+    def __init__(self, max_lines=DEFAULT_SCROLLBACK_LINES, max_bytes=DEFAULT_SCROLLBACK_BYTES,
+                 max_queries=DEFAULT_SCROLLBACK_QUERIES, max_total_bytes=DEFAULT_SCROLLBACK_TOTAL_BYTES):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.max_queries = max_queries
+        self.max_total_bytes = max_total_bytes
+        self.buffers = {}
+        self.sizes = {}
+        # Query buffers, least recently used first
+        self.queries = collections.OrderedDict()
+        self.total_bytes = 0
+        self.dropped = 0
+        self.dropped_buffers = 0
+        self.last_id = 0
+
+    def add(self, targets, msg):
+        """Append a message to buffers, evicting old ones over the limits
+
+        Returns:
+            The message's id.
+        """
+        self.last_id += 1
+        entry = (self.last_id, msg)
+        size = len(msg.raw)
+        for target in targets:
+            buffer = self.buffers.get(target)
+            if buffer is None:
+                buffer = self.buffers[target] = collections.deque()
+                self.sizes[target] = 0
+            buffer.append(entry)
+            total = self.sizes[target] + size
+            freed = 0
+            while len(buffer) > self.max_lines or (total - freed > self.max_bytes and len(buffer) > 1):
+                freed += len(buffer.popleft()[1].raw)
+                self.dropped += 1
+            self.sizes[target] = total - freed
+            self.total_bytes += size - freed
+            if target in self.queries:
+                self.queries.move_to_end(target)
+            elif is_query_buffer(target):
+                self.queries[target] = None
+
+        while self.queries:
+            oldest = next(iter(self.queries))
+            # Buffers just written to are the most recently used; they are
+            # not dropped for size, channels may be what fills it
+            if len(self.queries) <= self.max_queries and \
+                    (self.total_bytes <= self.max_total_bytes or oldest in targets):
+                break
+            self.remove(oldest)
+        return self.last_id
+
+    def remove(self, target):
+        """Drop a whole buffer, e.g. of a channel we left"""
+        buffer = self.buffers.pop(target, None)
+        if buffer is None:
+            return
+        self.total_bytes -= self.sizes.pop(target)
+        self.queries.pop(target, None)
+        self.dropped += len(buffer)
+        self.dropped_buffers += 1
+
+    def recent(self, target, limit=None, before=None):
+        """The last limit messages of a buffer, oldest first
+
+        Args:
+            before: Only return messages with a lower id than this.
+
+        Returns:
+            A list of (id, IRCMessage).
+        """
+        buffer = self.buffers.get(target)
+        if not buffer:
+            return []
+        entries = list(buffer)
+        if before is not None:
+            entries = entries[:bisect_left(entries, (before,))]
+        if limit is not None and limit < len(entries):
+            entries = entries[-limit:]
+        return entries
+
+    def has_older(self, target, message_id):
+        """Whether a buffer holds messages older than message_id"""
+        buffer = self.buffers.get(target)
+        return bool(buffer) and buffer[0][0] < message_id
+
+    def memory(self):
+        """Size of the scrollback, in total and per buffer"""
+        return {
+            'lines': sum(len(buffer) for buffer in self.buffers.values()),
+            'bytes': self.total_bytes,
+            'dropped': self.dropped,
+            'dropped_buffers': self.dropped_buffers,
+            'buffers': {target: {'lines': len(buffer), 'bytes': self.sizes[target]}
+                        for target, buffer in self.buffers.items()},
+        }
+
+
+class EmitBatcher:
+    """Collects the events of one browser and emits them in batches
+
+    A batch is sent as a single 'messages' event whose 'events' are
+    [event, data] pairs in the order they were added. It goes out once the
+    first event in it has waited window seconds, or as soon as it holds
+    max_events events or max_bytes bytes.
+
+    The browser acknowledges each batch. While max_inflight batches are
+    unacknowledged (a backgrounded tab or a slow link) events wait here,
+    and once more than max_queue are waiting the policy sheds load:
+
+        'drop': discard the oldest 'message' events.
+        'collapse': fold queued join/part/quit/nick events into one
+            summary event, then drop as above if that is not enough.
+        'replay': discard every queued 'message' event and tell the browser
+            to fetch the scrollback ('resync') once it catches up.
+
+    Other events (history, user lists, topics) are never shed.
+
+    Args:
+        emit: Callable emit(event, data, callback) delivering to the
+            browser; callback is called when the browser acknowledges.
+        scheduler: The DeadlineScheduler (irc_scheduler) that ends the
+            windows.
+        window: Seconds an event may wait for others; 0 sends each event
+            as soon as it is added.
+        max_events: Number of events that triggers an early flush.
+        max_bytes: Payload size that triggers an early flush.
+        max_queue: Number of waiting events above which the policy applies.
+        max_inflight: Unacknowledged batches allowed, 0 for no limit.
+        policy: 'drop', 'collapse' or 'replay'.
+        tracer: Optional LatencyTracer (irc_trace) recording the 'queue',
+            'emit', 'ack' and 'total' stages.
+    """
+
+    def __init__(self, emit, scheduler, window=DEFAULT_EMIT_WINDOW,
+                 max_events=DEFAULT_EMIT_MAX_EVENTS, max_bytes=DEFAULT_EMIT_MAX_BYTES,
+                 max_queue=DEFAULT_EMIT_MAX_QUEUE, max_inflight=DEFAULT_EMIT_MAX_INFLIGHT,
+                 policy=DEFAULT_EMIT_POLICY, tracer=None):
+        if policy not in EMIT_POLICIES:
+            raise ValueError(f"Unknown emit policy: {policy}")
+        self.emit = emit
+        self.scheduler = scheduler
+        self.window = window
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.max_queue = max_queue
+        self.max_inflight = max_inflight
+        self.policy = policy
+        self.events = []
+        # Size of each waiting event, and their total
+        self.sizes = []
+        self.size = 0
+        self.first_added = 0.0
+        self.scheduled = False
+        self.inflight = 0
+        # 'message' events discarded since the browser last resynced
+        self.lost = 0
+        # Set while no browser is attached
+        self.suspended = False
+        self.tracer = tracer
+        # While tracing: (received, queued) of the events of received lines
+        # waiting to be sent, and when each unacknowledged batch was sent.
+        # Events shed by the policy are still counted when the batch goes out.
+        self.traced = []
+        self.emitted_at = collections.deque()
+        self.lock = threading.Lock()
+        # Held while emitting so batches reach the browser in order;
+        # reentrant in case an acknowledgement comes back synchronously
+        self.flush_lock = threading.RLock()
+
+        # Metrics, see stats()
+        self.sent_events = 0
+        self.sent_batches = 0
+        self.max_batch = 0
+        self.total_delay = 0.0
+        self.max_depth = 0
+        self.dropped = 0
+        self.collapsed = 0
+        self.resyncs = 0
+
+    def paused(self):
+        """Whether the browser has too many batches unacknowledged"""
+        return bool(self.max_inflight) and self.inflight >= self.max_inflight
+
+    def add(self, event, data, size=0, urgent=False):
+        """Queue an event for the browser
+
+        Args:
+            size: Approximate payload size in bytes, counted towards max_bytes.
+            urgent: Send the batch without waiting for the window to end.
+
+        Returns:
+            True if the batch is due and the caller should call flush(),
+            which it may do after releasing its own locks.
+        """
+        with self.lock:
+            if self.suspended:
+                return False
+            if not self.events:
+                self.first_added = time.monotonic()
+            if self.tracer:
+                received = self.tracer.current()
+                if received is not None:
+                    self.traced.append((received, self.tracer.now()))
+            self.events.append([event, data])
+            self.sizes.append(size)
+            self.size += size
+            if len(self.events) > self.max_queue:
+                self.shed()
+            if len(self.events) > self.max_depth:
+                self.max_depth = len(self.events)
+            if self.paused():
+                # acked() flushes once the browser catches up
+                return False
+            if (urgent or not self.window or len(self.events) >= self.max_events
+                    or self.size >= self.max_bytes):
+                return True
+            if self.scheduled:
+                return False
+            self.scheduled = True
+            deadline = self.first_added + self.window
+        self.scheduler.schedule(self.flush, deadline)
+        return False
+
+    def suspend(self):
+        """Stop sending while no browser is attached
+
+        Queued events are discarded and later ones ignored; whoever attaches
+        next is sent the scrollback instead.
+        """
+        with self.lock:
+            self.suspended = True
+            self.events, self.sizes, self.size, self.lost = [], [], 0, 0
+            self.traced = []
+
+    def resume(self, emit):
+        """Send to a newly attached browser through emit
+
+        Batches the previous browser never acknowledged are forgotten.
+        """
+        with self.flush_lock, self.lock:
+            self.emit = emit
+            self.suspended = False
+            self.inflight = 0
+            self.emitted_at.clear()
+
+    def shed(self):
+        """Apply the policy to the waiting events; called with the lock held
+
+        Sheds down to three quarters of max_queue, so a browser that stays
+        slow does not pay for this on every event.
+        """
+        events = list(zip(self.events, self.sizes))
+        target = self.max_queue * 3 // 4
+        if self.policy == 'replay':
+            kept = [(item, size) for item, size in events if item[0] != 'message']
+            self.lost += len(events) - len(kept)
+            self.dropped += len(events) - len(kept)
+            events = kept
+        else:
+            if self.policy == 'collapse':
+                events = self.collapse(events)
+            excess = len(events) - target
+            if excess > 0:
+                kept = []
+                for item, size in events:
+                    if excess and item[0] == 'message':
+                        excess -= 1
+                        self.dropped += 1
+                    else:
+                        kept.append((item, size))
+                events = kept
+        self.events = [item for item, size in events]
+        self.sizes = [size for item, size in events]
+        self.size = sum(self.sizes)
+
+    def collapse(self, events):
+        """Fold join/part/quit/nick events into one summary event per network
+
+        Args:
+            events: (item, size) pairs; a summary keeps the size of the
+                first event it folds.
+        """
+        summaries = {}
+        kept = []
+        for item, size in events:
+            event, data = item
+            kind = data.get('type') if event == 'message' else None
+            if kind in ('join', 'part', 'quit', 'nick', 'summary'):
+                network = data.get('network')
+                summary = summaries.get(network)
+                if summary is None:
+                    # The summary takes the place of the first folded event
+                    summary = summaries[network] = {
+                        'type': 'summary', 'network': network,
+                        'join': 0, 'part': 0, 'quit': 0, 'nick': 0, 'targets': []}
+                    kept.append((['message', summary], size))
+                if kind == 'summary':
+                    for key in ('join', 'part', 'quit', 'nick'):
+                        summary[key] += data[key]
+                else:
+                    summary[kind] += 1
+                    self.collapsed += 1
+                targets = summary['targets']
+                for target in data.get('targets') or [data.get('channel', SERVER_BUFFER)]:
+                    if target not in targets:
+                        targets.append(target)
+            else:
+                kept.append((item, size))
+        return kept
+
+    def flush(self):
+        """Emit the queued events, if any and the browser is keeping up"""
+        with self.flush_lock:
+            with self.lock:
+                self.scheduled = False
+                if self.suspended or self.paused() or not (self.events or self.lost):
+                    return
+                events, self.events, self.sizes, self.size = self.events, [], [], 0
+                if self.lost:
+                    events.append(['resync', {'dropped': self.lost}])
+                    self.lost = 0
+                    self.resyncs += 1
+                self.inflight += 1
+                first_added = self.first_added
+                traced, self.traced = self.traced, []
+            self.sent_events += len(events)
+            self.sent_batches += 1
+            self.max_batch = max(self.max_batch, len(events))
+            self.total_delay += time.monotonic() - first_added
+            if not self.tracer:
+                self.emit('messages', {'events': events}, self.acked)
+                return
+            start = self.tracer.now()
+            with self.lock:
+                self.emitted_at.append(start)
+            self.emit('messages', {'events': events}, self.acked)
+            self.record_emit(traced, start)
+
+    def record_emit(self, traced, start):
+        """Record the tracer's stages for a batch emitted at start"""
+        tracer = self.tracer
+        end = tracer.now()
+        tracer.record('emit', end - start)
+        for received, queued in traced:
+            tracer.record('queue', start - queued)
+            tracer.record('total', end - received)
+
+    def acked(self, *args):
+        """Called when the browser acknowledges a batch"""
+        with self.lock:
+            self.inflight = max(0, self.inflight - 1)
+            due = bool(self.events or self.lost)
+            emitted_at = self.emitted_at.popleft() if self.emitted_at else None
+        if emitted_at is not None:
+            self.tracer.record('ack', self.tracer.now() - emitted_at)
+        if due:
+            self.flush()
+
+    def stats(self):
+        """Batching and backpressure metrics for this browser"""
+        with self.flush_lock, self.lock:
+            return {
+                'sent_events': self.sent_events,
+                'sent_batches': self.sent_batches,
+                'max_batch': self.max_batch,
+                'avg_delay': self.total_delay / self.sent_batches if self.sent_batches else 0.0,
+                'queue_depth': len(self.events),
+                'queue_bytes': self.size,
+                'max_queue_depth': self.max_depth,
+                'inflight': self.inflight,
+                'dropped': self.dropped,
+                'collapsed': self.collapsed,
+                'resyncs': self.resyncs,
+            }
+
+
+class WebSession:
+    """State of one browser session
+
+    sid is the Socket.IO connection of the attached browser, or None while
+    detached, in which case detached_at holds the monotonic time it left.
+
+    Args:
+        session_id: The session token, which outlives browser connections.
+        emit: Callable emit(event, data, callback) delivering to this
+            session's browser, see EmitBatcher.
+        scrollback_lines: Maximum number of messages kept per buffer.
+        scrollback_bytes: Maximum bytes of messages kept per buffer.
+        scrollback_queries: Maximum number of query buffers kept.
+        scrollback_total_bytes: Size of all buffers above which query
+            buffers are dropped.
+        scheduler: DeadlineScheduler for the session's EmitBatcher; the
+            shared one if not given.
+        Remaining arguments are passed to EmitBatcher.
+    """
+
+    def __init__(self, session_id, emit, scrollback_lines=DEFAULT_SCROLLBACK_LINES,
+                 scrollback_bytes=DEFAULT_SCROLLBACK_BYTES,
+                 scrollback_queries=DEFAULT_SCROLLBACK_QUERIES,
+                 scrollback_total_bytes=DEFAULT_SCROLLBACK_TOTAL_BYTES, scheduler=None,
+                 emit_window=DEFAULT_EMIT_WINDOW, emit_max_events=DEFAULT_EMIT_MAX_EVENTS,
+                 emit_max_bytes=DEFAULT_EMIT_MAX_BYTES, emit_max_queue=DEFAULT_EMIT_MAX_QUEUE,
+                 emit_max_inflight=DEFAULT_EMIT_MAX_INFLIGHT, emit_policy=DEFAULT_EMIT_POLICY,
+                 tracer=None):
+        self.session_id = session_id
+        self.sid = None
+        self.detached_at = None
+        # Scheduled reap() while detached, see SessionRegistry.detach()
+        self.reap_handle = None
+        # IRC clients by network id
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.scrollback = Scrollback(scrollback_lines, scrollback_bytes,
+                                     scrollback_queries, scrollback_total_bytes)
+        self.events = EmitBatcher(emit, scheduler or get_shared_scheduler(),
+                                  emit_window, emit_max_events, emit_max_bytes,
+                                  emit_max_queue, emit_max_inflight, emit_policy, tracer)
+
+    def attach_client(self, network, client):
+        """Make client the session's connection to network, returning the previous one"""
+        with self.lock:
+            previous = self.clients.pop(network, None)
+            if client is not None:
+                self.clients[network] = client
+        return previous
+
+    def detach_client(self, network):
+        """Remove and return the session's connection to network"""
+        return self.attach_client(network, None)
+
+    def detach_clients(self):
+        """Remove and return all of the session's connections"""
+        with self.lock:
+            clients, self.clients = list(self.clients.values()), {}
+        return clients
+
+    def get_client(self, network=None):
+        """The connection to network, or None
+
+        Without a network, the only connection if there is exactly one.
+        """
+        if network is not None:
+            return self.clients.get(network)
+        clients = list(self.clients.values())
+        return clients[0] if len(clients) == 1 else None
+
+    def attach_browser(self, sid, emit):
+        """Send the session's events to a browser connection from now on"""
+        with self.lock:
+            self.sid = sid
+            self.detached_at = None
+            self.events.resume(emit)
+
+    def detach_browser(self):
+        """Stop sending events: the browser connection went away
+
+        Messages still go to the scrollback, to be replayed on reattach.
+        """
+        with self.lock:
+            self.sid = None
+            self.detached_at = time.monotonic()
+            self.events.suspend()
+
+    def on_message(self, network, msg, targets):
+        """Record a message received for this session and send it to the browser
+
+        Called from the connection's receive thread or event loop.
+
+        Args:
+            network: The network id of the connection.
+            msg: The parsed IRCMessage.
+            targets: The buffers it belongs to, see message_targets().
+        """
+        if not targets:
+            return
+        event = message_event(msg)
+        if targets != [event.get('channel', event.get('target'))]:
+            # Left out when the browser can tell from the event itself
+            event['targets'] = targets
+        event['network'] = network
+        with self.lock:
+            event['id'] = self.scrollback.add([(network, target) for target in targets], msg)
+            channel = self.left_channel(network, msg)
+            if channel:
+                self.scrollback.remove((network, channel))
+            # Queued under the lock so it is ordered with send_history()
+            due = self.events.add('message', event, len(msg.raw))
+        if due:
+            self.events.flush()
+
+    def left_channel(self, network, msg):
+        """The channel a PART or KICK takes us out of, or None"""
+        client = self.clients.get(network)
+        if client is None or len(msg.params) < (2 if msg.command == 'KICK' else 1):
+            return None
+        if msg.command == 'PART' and msg.nick == client.nickname:
+            return msg.params[0]
+        if msg.command == 'KICK' and msg.params[1] == client.nickname:
+            return msg.params[0]
+        return None
+
+    def send_event(self, event, data, size=0):
+        """Send an event to the browser in the session's next batch"""
+        if self.events.add(event, data, size):
+            self.events.flush()
+
+    def history(self, network, target, limit=None, before=None):
+        """Recent history of a buffer as message events with ids, oldest first"""
+        with self.lock:
+            entries = self.scrollback.recent((network, target), limit, before)
+        return [dict(message_event(msg), id=message_id, network=network)
+                for message_id, msg in entries]
+
+    def send_history(self, network, target, limit=None, before=None):
+        """Send the recent history of a buffer to the browser right away
+
+        Without before, the 'history' event is queued behind any messages
+        not sent yet, all of which it already contains, and ahead of any
+        received later. With before, it is an older page of the buffer.
+        """
+        buffer = (network, target)
+        with self.lock:
+            entries = self.scrollback.recent(buffer, limit, before)
+            more = bool(entries) and self.scrollback.has_older(buffer, entries[0][0])
+            messages = [dict(message_event(msg), id=message_id, network=network)
+                        for message_id, msg in entries]
+            self.events.add('history', {'network': network, 'target': target, 'before': before,
+                                        'more': more, 'messages': messages},
+                            sum(len(msg.raw) for message_id, msg in entries), urgent=True)
+        self.events.flush()
+
+    def memory(self):
+        """Memory used by this session's scrollback, see Scrollback.memory()
+
+        Buffers are keyed by (network, target).
+        """
+        with self.lock:
+            return self.scrollback.memory()
+
+
+class SessionRegistry:
+    """All WebSessions of the process, keyed by session token
+
+    sids maps each browser connection to its session. A session whose
+    browser disconnects stays for grace seconds with its IRC clients, and
+    is closed by reap() unless a browser attaches to it again.
+
+    The sessions share the process's DeadlineScheduler thread (see
+    irc_scheduler) with the threaded IRC clients. Other keyword arguments
+    are passed to each new WebSession, e.g. scrollback_lines, emit_window
+    or tracer.
+    """
+
+    def __init__(self, grace=DEFAULT_SESSION_GRACE, **session_options):
+        self.sessions = {}
+        self.sids = {}
+        self.grace = grace
+        self.lock = threading.Lock()
+        self.scheduler = get_shared_scheduler()
+        self.session_options = session_options
+
+    def attach(self, sid, token, emit):
+        """Attach a browser connection to its session
+
+        Args:
+            sid: The Socket.IO session id of the connection.
+            token: The session token the browser kept, or None.
+            emit: Callable emit(event, data, callback) delivering to sid.
+
+        Returns:
+            (session, reattached). If token is unknown or expired a new
+            session is created, whose session_id the browser must keep as
+            its token. A connection that still held the session (another
+            tab) is detached from it.
+        """
+        with self.lock:
+            session = self.sessions.get(token) if token else None
+            reattached = session is not None
+            if session is None:
+                token = secrets.token_urlsafe(18)
+                session = self.sessions[token] = WebSession(
+                    token, emit, scheduler=self.scheduler, **self.session_options)
+            else:
+                if session.sid is not None:
+                    self.sids.pop(session.sid, None)
+                if session.reap_handle is not None:
+                    self.scheduler.cancel(session.reap_handle)
+                    session.reap_handle = None
+            self.sids[sid] = session
+            session.attach_browser(sid, emit)
+        return session, reattached
+
+    def detach(self, sid):
+        """Detach a browser connection from its session
+
+        The session is closed right away if grace is 0, otherwise once the
+        grace period ends, unless a browser attaches to it before. That is
+        a deadline on the shared scheduler, not a timer thread per session.
+        """
+        with self.lock:
+            session = self.sids.pop(sid, None)
+            # Checked and detached under the lock, so a browser attaching
+            # at the same time is not detached in its place
+            if session is None or session.sid != sid:
+                return
+            session.detach_browser()
+            if self.grace > 0:
+                session.reap_handle = self.scheduler.schedule(
+                    self.reap_expired, time.monotonic() + self.grace)
+        if self.grace <= 0:
+            self.reap()
+
+    def reap_expired(self):
+        """Scheduler callback: close the expired sessions
+
+        Disconnecting may wait for a connection's writer, so it is left to
+        a thread of its own rather than holding up the scheduler.
+        """
+        expired = self.expire(time.monotonic())
+        if expired:
+            thread = threading.Thread(target=self.close_sessions, args=(expired,))
+            thread.daemon = True
+            thread.start()
+
+    def reap(self, now=None):
+        """Close the sessions detached for longer than the grace period
+
+        Returns:
+            The number of sessions closed.
+        """
+        if now is None:
+            now = time.monotonic()
+        expired = self.expire(now)
+        self.close_sessions(expired)
+        return len(expired)
+
+    def expire(self, now):
+        """Remove and return the sessions detached for longer than the grace period"""
+        with self.lock:
+            expired = [session for session in self.sessions.values()
+                       if session.sid is None and session.detached_at is not None
+                       and now - session.detached_at >= self.grace]
+            for session in expired:
+                del self.sessions[session.session_id]
+                session.reap_handle = None
+        return expired
+
+    def close_sessions(self, sessions):
+        """Disconnect the IRC clients of sessions that were removed"""
+        for session in sessions:
+            for client in session.detach_clients():
+                client.disconnect()
+
+    def get(self, sid):
+        """The session a browser connection is attached to, or None
+
+        A plain dict lookup, so it needs no lock.
+        """
+        return self.sids.get(sid)
+
+    def get_client(self, sid, network=None):
+        """The IRC client of a connection's session, see WebSession.get_client()"""
+        session = self.sids.get(sid)
+        return session.get_client(network) if session else None
+
+    def is_open(self, session):
+        """Whether a session has not been closed"""
+        return self.sessions.get(session.session_id) is session
+
+    def memory(self):
+        """Scrollback totals and emit metrics of every session, as a list of dicts"""
+        with self.lock:
+            sessions = list(self.sessions.values())
+        stats = []
+        for session in sessions:
+            memory = session.memory()
+            stats.append({
+                'networks': {network: client.nickname
+                             for network, client in list(session.clients.items())},
+                'attached': session.sid is not None,
+                'lines': memory['lines'],
+                'bytes': memory['bytes'],
+                'dropped': memory['dropped'],
+                'buffers': len(memory['buffers']),
+                'emits': session.events.stats(),
+            })
+        return stats
+
+    def links(self):
+        """State, registration and round trip times of every session's IRC connections, as a list of dicts"""
+        with self.lock:
+            sessions = list(self.sessions.values())
+        return [{network: {'server': client.server,
+                           'connected': client.running,
+                           'reconnecting': client.reconnecting,
+                           'registration': client.registration_stats(),
+                           'link': client.link_stats()}
+                 for network, client in list(session.clients.items())}
+                for session in sessions]
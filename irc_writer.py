@@ -0,0 +1,280 @@
+"""
+Outbound write queue with flood control
+
+All lines sent to the server go through one OutboundQueue per connection.
+It paces them with a token bucket so the server does not disconnect us
+for Excess Flood, and coalesces whatever is ready to go into a single
+write. With the threaded client an IRCWriter thread drains the queue.
+"""
+import collections
+import socket
+import threading
+import time
+
+# Commands that skip ahead of queued messages and are never delayed
+PRIORITY_COMMANDS = frozenset(['PONG', 'PING', 'QUIT', 'CAP', 'AUTHENTICATE'])
+
+# RFC 1459 message timer: one message every 2 seconds with a 10 second
+# allowance, i.e. a burst of 5 lines
+DEFAULT_RATE = 0.5
+DEFAULT_BURST = 5
+
+# Maximum number of bytes written by one sendall()
+MAX_BATCH_BYTES = 4096
+
+
+class TokenBucket:
+    """Token bucket rate limiter
+
+    Args:
+        rate: Tokens added per second.
+        burst: Maximum number of tokens the bucket holds.
+        clock: Monotonic time source, replaceable for tests.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = burst
+        self.updated = clock()
+
+    def refill(self):
+        """Add the tokens accumulated since the last update"""
+        now = self.clock()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, cost=1):
+        """Seconds to wait before cost tokens are available"""
+        self.refill()
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, cost=1):
+        """Take cost tokens; the bucket may go negative for forced sends"""
+        self.refill()
+        self.tokens -= cost
+
+
+def line_command(line):
+    """The command of an outgoing line, upper-cased"""
+    return line.split(' ', 1)[0].upper()
+
+
+class OutboundQueue:
+    """Prioritised, rate-limited queue of encoded outgoing lines
+
+    This holds the queueing and flood-control policy only; IRCWriter and
+    the asyncio engine drive it and do the actual writing. It is not
+    thread-safe on its own.
+
+    Args:
+        rate: Lines per second allowed once the burst is used up.
+        burst: Number of lines that may be sent back to back.
+        max_queue: Maximum number of queued normal-priority lines.
+        bytes_per_token: If set, each line costs one extra token per this
+            many bytes (ircu-style penalty for long lines).
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 max_queue=1000, bytes_per_token=None):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_queue = max_queue
+        self.bytes_per_token = bytes_per_token
+        self.priority = collections.deque()
+        self.normal = collections.deque()
+
+        # Metrics, see stats()
+        self.sent_lines = 0
+        self.sent_batches = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def depth(self):
+        """Number of lines waiting to be sent"""
+        return len(self.priority) + len(self.normal)
+
+    def cost(self, data):
+        """Token cost of an encoded line"""
+        if self.bytes_per_token:
+            return 1 + len(data) / self.bytes_per_token
+        return 1
+
+    def push(self, line):
+        """Queue a line (without CRLF)
+
+        Returns:
+            False if the line was dropped because the queue is full.
+        """
+        item = ((line + "\r\n").encode('utf-8'), time.monotonic())
+        if line_command(line) in PRIORITY_COMMANDS:
+            self.priority.append(item)
+        elif len(self.normal) >= self.max_queue:
+            self.dropped += 1
+            return False
+        else:
+            self.normal.append(item)
+        depth = self.depth()
+        if depth > self.max_depth:
+            self.max_depth = depth
+        return True
+
+    def take(self):
+        """Take every line that may be sent now
+
+        Returns:
+            (batch, wait): the list of (data, queued_at) items to send and,
+            when normal lines are still waiting for tokens, the number of
+            seconds until the next one may go (0.0 otherwise).
+        """
+        batch = []
+        size = 0
+        while self.priority and size < MAX_BATCH_BYTES:
+            item = self.priority.popleft()
+            self.bucket.consume(self.cost(item[0]))
+            batch.append(item)
+            size += len(item[0])
+
+        wait = 0.0
+        while self.normal and size < MAX_BATCH_BYTES:
+            cost = self.cost(self.normal[0][0])
+            wait = self.bucket.delay(cost)
+            if wait:
+                break
+            item = self.normal.popleft()
+            self.bucket.consume(cost)
+            batch.append(item)
+            size += len(item[0])
+
+        return batch, wait
+
+    def record_sent(self, batch):
+        """Update metrics once a batch has been written"""
+        now = time.monotonic()
+        for data, queued_at in batch:
+            waited = now - queued_at
+            self.total_wait += waited
+            if waited > self.max_wait:
+                self.max_wait = waited
+        self.sent_lines += len(batch)
+        self.sent_batches += 1
+
+    def clear(self, priority=True):
+        """Discard queued normal lines, and priority lines if requested"""
+        self.normal.clear()
+        if priority:
+            self.priority.clear()
+
+    def stats(self):
+        """Queue and latency metrics for this connection"""
+        return {
+            'queue_depth': self.depth(),
+            'max_queue_depth': self.max_depth,
+            'sent_lines': self.sent_lines,
+            'sent_batches': self.sent_batches,
+            'dropped': self.dropped,
+            'avg_wait': self.total_wait / self.sent_lines if self.sent_lines else 0.0,
+            'max_wait': self.max_wait,
+        }
+
+
+class IRCWriter(OutboundQueue):
+    """Per-connection outbound queue drained by a writer thread
+
+    Args:
+        sock: Connected socket to write to.
+        Remaining arguments are passed to OutboundQueue.
+    """
+
+    def __init__(self, sock, rate=DEFAULT_RATE, burst=DEFAULT_BURST,
+                 max_queue=1000, bytes_per_token=None):
+        super().__init__(rate, burst, max_queue, bytes_per_token)
+        self.socket = sock
+        self.condition = threading.Condition()
+        self.running = True
+        self.error = None
+
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def put(self, line):
+        """Queue a line (without CRLF) for sending
+
+        Returns:
+            False if the line was dropped because the queue is full or the
+            writer is closed, True otherwise.
+        """
+        with self.condition:
+            if not self.running or not self.push(line):
+                return False
+            self.condition.notify()
+        return True
+
+    def put_many(self, lines):
+        """Queue several lines at once, so they go out in the same write
+
+        Returns:
+            False if any line was dropped.
+        """
+        with self.condition:
+            if not self.running:
+                return False
+            queued = all([self.push(line) for line in lines])
+            self.condition.notify()
+        return queued
+
+    def next_batch(self):
+        """Wait for sendable lines and take them off the queues
+
+        Returns:
+            A list of (data, queued_at) tuples, or None once closed and drained.
+        """
+        with self.condition:
+            while True:
+                batch, wait = self.take()
+                if batch:
+                    return batch
+                if not self.running and not self.priority:
+                    return None
+                self.condition.wait(wait or None)
+
+    def run(self):
+        """Writer thread: send queued lines until closed"""
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                break
+
+            try:
+                self.socket.sendall(b''.join(data for data, queued_at in batch))
+            except (socket.error, ValueError) as e:
+                self.error = e
+                with self.condition:
+                    self.running = False
+                    self.clear()
+                break
+
+            with self.condition:
+                self.record_sent(batch)
+
+    def close(self, timeout=2.0):
+        """Stop accepting lines and wait for priority lines to be flushed
+
+        Normal lines still waiting for tokens are discarded.
+        """
+        with self.condition:
+            self.running = False
+            self.clear(priority=False)
+            self.condition.notify()
+        if threading.current_thread() is not self.thread:
+            self.thread.join(timeout)
+
+    def stats(self):
+        """Queue and latency metrics for this connection"""
+        with self.condition:
+            return super().stats()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Tests for the asyncio engine against a minimal local server
+"""
+import asyncio
+import contextlib
+import io
+import time
+
+from irc_async import AsyncIRCClient, IRCEventLoop
+
+
+async def minimal_server(received):
+    """Server that welcomes a client after USER and answers its PRIVMSGs"""
+
+    async def handle(reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            line = line.decode().rstrip("\r\n")
+            received.append(line)
+            if line.startswith("USER"):
+                writer.write(b":server 001 tester :Welcome\r\nPING :server\r\n")
+            elif line.startswith("PRIVMSG"):
+                writer.write(b":echo!e@h PRIVMSG tester :pong\r\n")
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+def test_connect_and_exchange_on_running_loop():
+    """connect_async registers and messages flow through the handlers"""
+    received = []
+
+    async def scenario():
+        server = await minimal_server(received)
+        port = server.sockets[0].getsockname()[1]
+        client = AsyncIRCClient("127.0.0.1", port, "tester", send_rate=100)
+        welcomed = asyncio.Event()
+        replies = []
+        client.add_handler('001', lambda msg: welcomed.set())
+        client.add_handler('PRIVMSG', replies.append)
+
+        assert await client.connect_async()
+        await asyncio.wait_for(welcomed.wait(), 2)
+        client.send_message("#chan", "hello")
+        for _ in range(100):
+            if replies:
+                break
+            await asyncio.sleep(0.01)
+        client.disconnect()
+        await asyncio.sleep(0.05)
+        server.close()
+        await server.wait_closed()
+        return replies
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        replies = asyncio.run(scenario())
+
+    assert received[:3] == ["CAP LS 302", "NICK tester", "USER tester 0 * :tester"]
+    assert "PONG :server" in received
+    assert "PRIVMSG #chan :hello" in received
+    assert received[-1] == "QUIT :Leaving"
+    assert replies[0].trailing == "pong"
+
+
+def test_blocking_connect_from_another_thread():
+    """The blocking adapter drives a client on a background loop"""
+    received = []
+    event_loop = IRCEventLoop()
+    server = event_loop.run_coroutine(minimal_server(received))
+    port = server.sockets[0].getsockname()[1]
+    try:
+        client = AsyncIRCClient("127.0.0.1", port, "tester", event_loop=event_loop)
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert client.connect()
+            assert client.running
+            client.disconnect()
+        assert not client.running
+        time.sleep(0.1)
+    finally:
+        server.close()
+        event_loop.stop()
+
+
+if __name__ == "__main__":
+    test_connect_and_exchange_on_running_loop()
+    test_blocking_connect_from_another_thread()
+    print("All asyncio engine tests passed")
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Tests for pipelined registration, IRCv3 capability negotiation and SASL
+"""
+import base64
+import contextlib
+import hashlib
+import io
+import shutil
+import socket
+import ssl
+import tempfile
+
+from irc_async import AsyncIRCClient
+from irc_cap import CapNegotiation, SaslConfig, authenticate_lines, parse_cap_list, sasl_config_error
+from irc_client import IRCClient
+from irc_fake_server import FakeIRCServer
+from irc_tls import create_tls_context
+from test_irc_fake_server import wait_for
+from test_irc_tls import make_certificate, tls_server
+
+# The fake server listens without TLS
+PLAIN = SaslConfig('PLAIN', "alice", "secret", allow_plaintext=True)
+
+
+def test_parse_and_chunk():
+    """Capability lists are parsed; SASL payloads are split into 400 byte lines"""
+    assert parse_cap_list("multi-prefix sasl=PLAIN,EXTERNAL") == {'multi-prefix': None, 'sasl': "PLAIN,EXTERNAL"}
+    assert authenticate_lines(b"") == ["AUTHENTICATE +"]
+    assert authenticate_lines(b"\0alice\0secret") == ["AUTHENTICATE " + base64.b64encode(b"\0alice\0secret").decode()]
+    lines = authenticate_lines(b"x" * 300)
+    assert [len(line) for line in lines] == [len("AUTHENTICATE ") + 400, len("AUTHENTICATE +")]
+    lines = authenticate_lines(b"x" * 301)
+    assert len(lines) == 2 and lines[1] != "AUTHENTICATE +"
+
+
+def test_negotiation():
+    """LS (over several lines), REQ, ACK, SASL and END in order"""
+    cap = CapNegotiation(('multi-prefix', 'away-notify'), PLAIN)
+    assert cap.start() == "CAP LS 302"
+    assert cap.on_cap(["*", "LS", "*", "multi-prefix"]) == []
+    assert cap.on_cap(["*", "LS", "sasl=PLAIN,EXTERNAL"]) == ["CAP REQ :multi-prefix sasl"]
+    assert cap.on_cap(["*", "ACK", "multi-prefix sasl"]) == ["AUTHENTICATE PLAIN"]
+    assert cap.on_authenticate(["+"]) == authenticate_lines(b"\0alice\0secret")
+    cap.on_logged_in(["alice", "alice!a@host", "alice", "You are now logged in"])
+    assert cap.on_sasl_result('903', ["alice", "SASL authentication successful"]) == ["CAP END"]
+    assert (cap.sasl_status, cap.account, cap.finished) == ('success', "alice", True)
+    assert cap.enabled == {'multi-prefix', 'sasl'}
+
+    # Capabilities coming and going later send nothing
+    assert cap.on_cap(["alice", "NEW", "away-notify"]) == []
+    assert cap.on_cap(["alice", "DEL", "multi-prefix"]) == []
+    assert 'multi-prefix' not in cap.enabled and 'away-notify' in cap.available
+
+
+def test_negotiation_failures():
+    """Registration goes on, without an account, whenever SASL cannot be used"""
+    cap = CapNegotiation(sasl=PLAIN)
+    assert cap.on_cap(["*", "LS", "multi-prefix"]) == ["CAP REQ :multi-prefix"]
+    assert cap.sasl_status == 'unavailable'
+    assert cap.on_cap(["*", "ACK", "multi-prefix"]) == ["CAP END"]
+
+    cap = CapNegotiation(sasl=SaslConfig('EXTERNAL'))
+    cap.on_cap(["*", "LS", "sasl=PLAIN"])
+    assert cap.sasl_status == 'unavailable' and "PLAIN" in cap.sasl_error
+
+    cap = CapNegotiation(sasl=PLAIN)
+    assert cap.on_cap(["*", "LS", "sasl"]) == ["CAP REQ :sasl"]
+    assert cap.on_cap(["*", "NAK", "sasl"]) == ["CAP END"]
+    assert cap.sasl_status == 'unavailable'
+
+    cap = CapNegotiation(sasl=PLAIN)
+    cap.on_cap(["*", "LS", "sasl"])
+    cap.on_cap(["*", "ACK", "sasl"])
+    assert cap.on_sasl_result('904', ["*", "SASL authentication failed"]) == ["CAP END"]
+    assert cap.sasl_status == 'failed' and cap.sasl_error == "SASL authentication failed"
+    assert cap.on_authenticate(["+"]) == []
+
+    cap = CapNegotiation(sasl=PLAIN)
+    cap.on_unknown_command(["*", "CAP", "Unknown command"])
+    assert cap.finished and cap.sasl_status == 'unavailable'
+    assert CapNegotiation().on_cap(["*", "LS", "away-notify"]) == ["CAP END"]
+
+
+def test_sasl_config_checks():
+    """PLAIN needs TLS unless allowed, EXTERNAL needs a client certificate"""
+    secure = PLAIN._replace(allow_plaintext=False)
+    assert sasl_config_error(PLAIN, None) is None
+    assert sasl_config_error(secure, create_tls_context()) is None
+    assert "unencrypted" in sasl_config_error(secure, None)
+    assert "certificate" in sasl_config_error(SaslConfig('EXTERNAL'), None)
+    assert "certificate" in sasl_config_error(SaslConfig('EXTERNAL'), create_tls_context())
+    assert "Unknown" in sasl_config_error(SaslConfig('SCRAM-SHA-256'), None)
+    for client_class in (IRCClient, AsyncIRCClient):
+        for sasl in (secure, SaslConfig('EXTERNAL')):
+            try:
+                client_class("127.0.0.1", 6667, "careful", sasl=sasl)
+            except ValueError:
+                pass
+            else:
+                assert False, f"{sasl.mechanism} accepted without TLS"
+
+
+def test_single_write():
+    """CAP LS, NICK and USER leave in one write, before any reply"""
+    # Connections are queued by the kernel but never answered
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(4)
+    port = listener.getsockname()[1]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for client_class in (IRCClient, AsyncIRCClient):
+                client = client_class("127.0.0.1", port, "quick")
+                assert client.connect()
+                connection, _ = listener.accept()
+                connection.settimeout(2)
+                received = b""
+                while received.count(b"\r\n") < 3:
+                    received += connection.recv(4096)
+                assert received == b"CAP LS 302\r\nNICK quick\r\nUSER quick 0 * :quick\r\n"
+                assert client.writer.sent_batches == 1
+                assert client.connect_time is not None and client.welcome_time is None
+                client.disconnect()
+                connection.close()
+    finally:
+        listener.close()
+
+
+def test_registration():
+    """Both engines negotiate capabilities and measure the time to the welcome"""
+    server = FakeIRCServer(record=True)
+    port = server.start_in_thread()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            for client_class in (IRCClient, AsyncIRCClient):
+                server.call(server.received.clear)
+                client = client_class("127.0.0.1", port, "capable")
+                assert client.connect()
+                assert wait_for(lambda: client.welcome_time is not None)
+                stats = client.registration_stats()
+                assert 0 < stats['connect_time'] <= stats['welcome_time'] < 2.0
+                assert stats['caps'] == ['multi-prefix'] and stats['sasl'] is None
+                assert server.call(list, server.received)[:5] == [
+                    "CAP LS 302", "NICK capable", "USER capable 0 * :capable",
+                    "CAP REQ :multi-prefix", "CAP END"]
+                client.disconnect()
+                assert wait_for(lambda: server.call(server.find_user, "capable") is None)
+        assert out.getvalue().count("registered in") == 2
+    finally:
+        server.stop()
+
+
+def test_sasl_plain():
+    """SASL PLAIN logs in before the welcome; a wrong password still registers"""
+    server = FakeIRCServer()
+    server.accounts["alice"] = "secret"
+    port = server.start_in_thread()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            for client_class in (IRCClient, AsyncIRCClient):
+                client = client_class("127.0.0.1", port, "alice", sasl=PLAIN)
+                assert client.connect()
+                assert wait_for(lambda: client.welcome_time is not None)
+                assert client.registration_stats()['account'] == "alice"
+                assert client.registration_stats()['sasl'] == 'success'
+                assert server.call(lambda: server.find_user("alice").account) == "alice"
+                client.disconnect()
+                assert wait_for(lambda: server.call(server.find_user, "alice") is None)
+
+                client = client_class("127.0.0.1", port, "mallory", sasl=PLAIN._replace(password="guess"))
+                assert client.connect()
+                assert wait_for(lambda: client.welcome_time is not None)
+                assert client.registration_stats()['sasl'] == 'failed'
+                assert server.call(lambda: server.find_user("mallory").account) is None
+                client.disconnect()
+        assert out.getvalue().count("Logged in as alice") == 2
+        assert out.getvalue().count("SASL authentication failed: ") == 2
+    finally:
+        server.stop()
+
+
+def test_sasl_external():
+    """SASL EXTERNAL logs in with the TLS client certificate"""
+    if not shutil.which("openssl"):
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        client_cert, client_key = make_certificate(directory, "client")
+        with open(client_cert) as f:
+            fingerprint = hashlib.sha256(ssl.PEM_cert_to_DER_cert(f.read())).hexdigest()
+        with tls_server(client_ca=client_cert) as (server, port, certfile):
+            server.certfp_accounts[fingerprint] = "bob"
+            context = create_tls_context(cafile=certfile, certfile=client_cert, keyfile=client_key)
+            with contextlib.redirect_stdout(io.StringIO()):
+                for client_class in (IRCClient, AsyncIRCClient):
+                    client = client_class("localhost", port, "bob", tls_context=context,
+                                          sasl=SaslConfig('EXTERNAL'))
+                    assert client.connect()
+                    assert wait_for(lambda: client.welcome_time is not None)
+                    assert client.registration_stats()['account'] == "bob"
+                    client.disconnect()
+                    assert wait_for(lambda: server.call(server.find_user, "bob") is None)
+
+
+if __name__ == "__main__":
+    test_parse_and_chunk()
+    test_negotiation()
+    test_negotiation_failures()
+    test_sasl_config_checks()
+    test_single_write()
+    test_registration()
+    test_sasl_plain()
+    test_sasl_external()
+    print("All CAP and SASL tests passed")
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Offline tests for IRCClient message handling and channel state
+"""
+import contextlib
+import io
+
+from irc_client import IRCClient
+
+
+class RecordingClient(IRCClient):
+    """IRCClient that records outgoing lines instead of using a socket"""
+
+    def __init__(self, nickname="me"):
+        super().__init__("irc.example.com", 6667, nickname)
+        self.sent = []
+
+    def send(self, message):
+        self.sent.append(message)
+
+
+def feed(client, *lines):
+    """Run lines through process_message with console output suppressed"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        for line in lines:
+            client.process_message(line)
+
+
+def test_ping_is_answered():
+    """PING is answered with a PONG carrying the same token"""
+    client = RecordingClient()
+    feed(client, "PING :irc.example.com")
+    assert client.sent == ["PONG :irc.example.com"]
+
+
+def test_registered_handlers_are_dispatched():
+    """External handlers receive parsed messages for their command only"""
+    client = RecordingClient()
+    seen, everything = [], []
+    client.add_handler('privmsg', seen.append)
+    client.add_handler('*', everything.append)
+    feed(client, ":a!a@h PRIVMSG #chan :hi", ":a!a@h NOTICE #chan :hi")
+    assert [msg.command for msg in seen] == ["PRIVMSG"]
+    assert len(everything) == 2
+
+    client.remove_handler('PRIVMSG', seen.append)
+    feed(client, ":a!a@h PRIVMSG #chan :again")
+    assert len(seen) == 1
+
+
+def test_nick_in_use_retries():
+    """433 appends an underscore and retries the nickname"""
+    client = RecordingClient()
+    feed(client, ":server 433 * me :Nickname is already in use")
+    assert client.nickname == "me_"
+    assert client.sent == ["NICK me_"]
+
+
+def test_quit_and_nick_update_only_member_channels():
+    """QUIT and NICK keep channel_users and the reverse index consistent"""
+    client = RecordingClient()
+    feed(client,
+         ":server 353 me = #a :@alice bob",
+         ":server 353 me = #b :alice",
+         ":server 353 me = #c :carol",
+         ":server 366 me #a :End of /NAMES list.",
+         ":server 366 me #b :End of /NAMES list.",
+         ":server 366 me #c :End of /NAMES list.",
+         ":dave!d@h JOIN #c")
+    assert client.members.channels_of("alice") == {"#a", "#b"}
+    assert client.get_channel_users("#c") == {"carol", "dave"}
+
+    feed(client, ":alice!a@h NICK alicia")
+    assert client.channel_users["#a"] == {"alicia", "bob"}
+    assert client.channel_users["#b"] == {"alicia"}
+    assert client.members.channels_of("alice") == set()
+    assert client.members.channels_of("alicia") == {"#a", "#b"}
+
+    feed(client, ":alicia!a@h QUIT :bye", ":bob!b@h PART #a")
+    assert client.channel_users == {"#a": set(), "#b": set(), "#c": {"carol", "dave"}}
+    assert set(client.members.nick_channels) == {"carol", "dave"}
+
+
+def test_leaving_forgets_channel():
+    """Our own PART or KICK drops the channel and its members; others' only them"""
+    client = RecordingClient()
+    feed(client,
+         ":server 353 me = #a :me @alice bob",
+         ":server 353 me = #b :me alice",
+         ":server 366 me #a :End of /NAMES list.",
+         ":server 366 me #b :End of /NAMES list.",
+         ":alice!a@h KICK #a bob :out")
+    assert client.channel_users["#a"] == {"me", "alice"}
+    assert client.members.channels_of("bob") == set()
+
+    feed(client, ":me!u@h PART #a")
+    assert "#a" not in client.channel_users and "#a" not in client.members.versions
+    assert client.members.channels_of("alice") == {"#b"}
+    feed(client, ":alice!a@h KICK #b me :out")
+    assert client.channel_users == {} and client.members.nick_channels == {}
+    assert client.members.sorted_members == {} and client.members.channel_modes == {}
+
+
+def test_names_refresh_is_swapped_in_at_end():
+    """A NAMES refresh is invisible until 366 and drops stale users"""
+    client = RecordingClient()
+    feed(client, ":server 353 me = #a :alice bob", ":server 366 me #a :End")
+    before = client.channel_users["#a"]
+
+    feed(client, ":server 353 me = #a :@alice", ":server 353 me = #a :carol")
+    assert client.channel_users["#a"] is before
+    assert before == {"alice", "bob"}
+
+    feed(client, ":server 366 me #a :End")
+    assert client.channel_users["#a"] == {"alice", "carol"}
+    assert before == {"alice", "bob"}
+    assert client.members.channels_of("bob") == set()
+    assert client.members.channels_of("carol") == {"#a"}
+
+
+def test_prefix_modes_and_sorted_members():
+    """Prefix modes come from NAMES and MODE and keep the list sorted by rank"""
+    client = RecordingClient()
+    feed(client,
+         ":server 005 me PREFIX=(ov)@+ CHANMODES=beI,k,l,imnpst :are supported",
+         ":server 353 me = #a :bob @+Carol alice +dave",
+         ":server 366 me #a :End")
+    assert client.get_channel_members("#a") == ["@Carol", "+dave", "alice", "bob"]
+    assert client.members.prefixes_of("#a", "Carol") == "@+"
+
+    feed(client, ":op!o@h MODE #a +o-o+bv alice Carol *!*@spam bob")
+    assert client.get_channel_members("#a") == ["@alice", "+bob", "+Carol", "+dave"]
+
+    feed(client, ":erin!e@h JOIN #a", ":dave!d@h NICK aaron", ":bob!b@h PART #a")
+    assert client.get_channel_members("#a") == ["@alice", "+aaron", "+Carol", "erin"]
+    assert client.get_channel_users("#a") == {"alice", "aaron", "Carol", "erin"}
+
+
+def test_nick_change_onto_stale_member():
+    """A nick change to a nick still listed (missed QUIT) replaces that entry"""
+    client = RecordingClient()
+    feed(client,
+         ":server 353 me = #a :@bob +alice carol",
+         ":server 366 me #a :End",
+         ":alice!a@h NICK bob")
+    assert client.get_channel_members("#a") == ["+bob", "carol"]
+    assert [nick for rank, lower, nick in client.members.sorted_members["#a"]] == ["bob", "carol"]
+    assert client.members.prefixes_of("#a", "bob") == "+"
+    assert client.members.channels_of("bob") == {"#a"}
+    assert client.members.channels_of("alice") == set()
+
+
+def test_prefix_change_resorts_members():
+    """A PREFIX arriving after NAMES re-ranks tracked channels"""
+    client = RecordingClient()
+    feed(client,
+         ":server 353 me = #a :@op %half +voice user",
+         ":server 366 me #a :End")
+    assert client.get_channel_members("#a") == ["@op", "%half", "+voice", "user"]
+
+    feed(client, ":server 005 me PREFIX=(ov)@+ :are supported")
+    assert client.get_channel_members("#a") == ["@op", "+voice", "half", "user"]
+    feed(client, ":server 005 me PREFIX=(ov)@+ :are supported")
+    assert client.members.versions["#a"] == 2
+
+    feed(client, ":x!x@h MODE #a -o+v op half", ":voice!v@h PART #a")
+    assert client.get_channel_members("#a") == ["+half", "op", "user"]
+    assert client.get_channel_users("#a") == {"op", "half", "user"}
+
+
+def test_member_changes_are_versioned():
+    """Each member change bumps the channel version and reaches the listener"""
+    client = RecordingClient()
+    changes = []
+    client.members.listener = lambda *change: changes.append(change)
+    feed(client,
+         ":server 353 me = #a :@op bob",
+         ":server 366 me #a :End of /NAMES list.",
+         ":carol!u@h JOIN #a",
+         ":op!u@h MODE #a +v carol",
+         ":bob!u@h NICK robert",
+         ":robert!u@h QUIT :bye")
+    assert changes == [
+        ("#a", 1, 'reset', None, None),
+        ("#a", 2, 'add', "carol", ''),
+        ("#a", 3, 'mode', "carol", '+'),
+        ("#a", 4, 'rename', "bob", "robert"),
+        ("#a", 5, 'remove', "robert", None),
+    ]
+    assert client.members.versions == {"#a": 5}
+
+
+if __name__ == "__main__":
+    test_ping_is_answered()
+    test_registered_handlers_are_dispatched()
+    test_nick_in_use_retries()
+    test_quit_and_nick_update_only_member_channels()
+    test_leaving_forgets_channel()
+    test_names_refresh_is_swapped_in_at_end()
+    test_prefix_modes_and_sorted_members()
+    test_nick_change_onto_stale_member()
+    test_prefix_change_resorts_members()
+    test_member_changes_are_versioned()
+    print("All client state tests passed")
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Tests for the fake IRC server, driven by the real clients
+"""
+import contextlib
+import io
+import socket
+import time
+
+from irc_async import AsyncIRCClient
+from irc_client import IRCClient
+from irc_fake_server import FakeIRCServer
+
+
+def wait_for(condition, timeout=3.0):
+    """Poll condition until it is true; returns its final value"""
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def connect(port, nickname, client_class=IRCClient):
+    """A client connected to the fake server and registered"""
+    client = client_class("127.0.0.1", port, nickname, send_rate=1000, send_burst=1000)
+    welcomed = []
+    client.add_handler('001', welcomed.append)
+    assert client.connect()
+    assert wait_for(lambda: welcomed)
+    return client
+
+
+def test_channels_and_messages():
+    """Two clients join, talk, change nick and leave"""
+    server = FakeIRCServer()
+    port = server.start_in_thread()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            alice = connect(port, "alice")
+            bob = connect(port, "bob", AsyncIRCClient)
+            received = []
+            bob.add_handler('PRIVMSG', received.append)
+
+            alice.join_channel("#test")
+            assert wait_for(lambda: alice.members.prefixes_of("#test", "alice") == "@")
+            bob.join_channel("#test")
+            assert wait_for(lambda: alice.channel_users.get("#test") == {"alice", "bob"})
+            assert wait_for(lambda: bob.channel_users.get("#test") == {"alice", "bob"})
+
+            alice.send_message("#test", "hello")
+            alice.send_message("bob", "psst")
+            assert wait_for(lambda: len(received) == 2)
+            assert [(msg.params[0], msg.trailing) for msg in received] == [("#test", "hello"), ("bob", "psst")]
+
+            alice.set_channel_topic("#test", "Testing")
+            assert wait_for(lambda: bob.get_topic("#test") == "Testing")
+
+            bob.send("NICK robert")
+            assert wait_for(lambda: alice.channel_users["#test"] == {"alice", "robert"})
+
+            bob.leave_channel("#test")
+            assert wait_for(lambda: alice.channel_users["#test"] == {"alice"})
+            bob.disconnect()
+            alice.disconnect()
+    finally:
+        server.stop()
+
+
+def test_nick_collision():
+    """A taken nick is answered with 433 and the client retries"""
+    server = FakeIRCServer()
+    port = server.start_in_thread()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            first = connect(port, "same")
+            second = connect(port, "same")
+            assert second.nickname == "same_"
+            second.disconnect()
+            first.disconnect()
+    finally:
+        server.stop()
+
+
+def test_scripted_traffic():
+    """Populated channels, message floods and netsplits reach the client"""
+    server = FakeIRCServer()
+    port = server.start_in_thread()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            server.call(server.populate, "#big", 500)
+            server.call(server.set_topic, "#big", "Big channel")
+            client = connect(port, "tester")
+            received = []
+            client.add_handler('PRIVMSG', received.append)
+            client.join_channel("#big")
+            assert wait_for(lambda: len(client.channel_users.get("#big", ())) == 501)
+            assert client.get_topic("#big") == "Big channel"
+
+            seconds = server.call(server.flood, "#big", 1000, 200)
+            assert 0.15 < seconds < 1.0
+            assert wait_for(lambda: len(received) == 200)
+            assert received[-1].trailing == "load test message 199"
+
+            split = server.call(server.netsplit, 0.5)
+            assert len(split) == 250
+            assert wait_for(lambda: len(client.channel_users["#big"]) == 251)
+            server.call(server.netjoin, split)
+            assert wait_for(lambda: len(client.channel_users["#big"]) == 501)
+
+            listed = []
+            client.add_handler('322', listed.append)
+            client.send("LIST")
+            assert wait_for(lambda: listed)
+            assert listed[0].params[1:3] == ("#big", "501")
+            client.disconnect()
+    finally:
+        server.stop()
+
+
+def test_registration_is_required():
+    """Commands before registration get 451; QUIT closes the link"""
+    server = FakeIRCServer(record=True)
+    port = server.start_in_thread()
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=2) as sock:
+            sock.sendall(b"JOIN #test\r\nQUIT :bye\r\n")
+            data = b""
+            while b"ERROR" not in data:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                data += chunk
+        assert b" 451 * :You have not registered" in data
+        assert b"ERROR :Closing Link" in data
+        assert server.received == ["JOIN #test", "QUIT :bye"]
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    test_channels_and_messages()
+    test_nick_collision()
+    test_scripted_traffic()
+    test_registration_is_required()
+    print("All fake server tests passed")
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Tests for receive-side line framing
+"""
+from irc_framing import LineBuffer, MAX_RECV_SIZE, MIN_RECV_SIZE, next_recv_size
+
+
+def test_lines_split_across_chunks():
+    """Partial lines are kept until their terminator arrives"""
+    lines = LineBuffer()
+    assert lines.feed(b"PING :a\r\nPRIVMSG #c :he") == ["PING :a"]
+    assert lines.feed(b"llo\r") == []
+    assert lines.feed(b"\n:s 001 me :hi\n") == ["PRIVMSG #c :hello", ":s 001 me :hi"]
+
+
+def test_mixed_line_terminators():
+    """Bare LF terminators are accepted alongside CRLF"""
+    lines = LineBuffer()
+    assert lines.feed(b"PING :a\nPING :b\r\nPING :c\r\n") == ["PING :a", "PING :b", "PING :c"]
+
+
+def test_multibyte_character_straddling_chunks():
+    """A UTF-8 sequence cut by a chunk boundary is decoded intact"""
+    data = "PRIVMSG #c :café ☃\r\n".encode('utf-8')
+    cut = data.index(b"\xe2") + 1
+    lines = LineBuffer()
+    assert lines.feed(data[:cut]) == []
+    assert lines.feed(data[cut:]) == ["PRIVMSG #c :café ☃"]
+
+
+def test_non_utf8_line_falls_back():
+    """Lines in a legacy encoding are decoded instead of dropped"""
+    assert LineBuffer().feed(b"PRIVMSG #c :caf\xe9\r\n") == ["PRIVMSG #c :café"]
+
+
+def test_overlong_line_is_dropped():
+    """A line without terminator cannot grow the buffer forever"""
+    lines = LineBuffer(max_line_length=16)
+    assert lines.feed(b"x" * 32) == []
+    assert lines.feed(b"\r\nPING :a\r\n") == ["PING :a"]
+
+    # The rest of the line is dropped too, up to its terminator
+    lines = LineBuffer(max_line_length=10)
+    assert lines.feed(b"abcdefghijklmnop") == []
+    assert lines.feed(b"qrs") == []
+    assert lines.feed(b"tuv\r\nPING :x\r\nPI") == ["PING :x"]
+    assert lines.feed(b"NG :y\r\n") == ["PING :y"]
+
+    # Complete lines are held to the same limit, counted in bytes
+    lines = LineBuffer(max_line_length=10)
+    assert lines.feed(b"x" * 50 + b"\r\nPING :a\r\n") == ["PING :a"]
+    assert lines.feed("PING :ééé\r\nPING :éé\r\n".encode('utf-8')) == ["PING :éé"]
+
+
+def test_recv_size_adapts():
+    """Full reads grow the recv size and small reads shrink it"""
+    assert next_recv_size(MIN_RECV_SIZE, MIN_RECV_SIZE) == MIN_RECV_SIZE * 2
+    assert next_recv_size(MAX_RECV_SIZE, MAX_RECV_SIZE) == MAX_RECV_SIZE
+    assert next_recv_size(MIN_RECV_SIZE * 4, 10) == MIN_RECV_SIZE * 2
+    assert next_recv_size(MIN_RECV_SIZE, 10) == MIN_RECV_SIZE
+
+
+if __name__ == "__main__":
+    test_lines_split_across_chunks()
+    test_mixed_line_terminators()
+    test_multibyte_character_straddling_chunks()
+    test_non_utf8_line_falls_back()
+    test_overlong_line_is_dropped()
+    test_recv_size_adapts()
+    print("All framing tests passed")
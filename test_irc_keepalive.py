@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Tests for keepalive PINGs, round trip times and dead link detection
+"""
+import contextlib
+import io
+import socket
+
+from irc_async import AsyncIRCClient
+from irc_client import IRCClient
+from irc_fake_server import FakeIRCServer
+from irc_keepalive import KeepalivePolicy, LinkMonitor
+from irc_reconnect import ReconnectPolicy
+from test_irc_fake_server import wait_for
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_link_monitor():
+    """PINGs go out once idle; PONGs give the RTT; silence after a PING is death"""
+    clock = FakeClock()
+    link = LinkMonitor(KeepalivePolicy(interval=10, timeout=5, history=3), clock)
+    assert link.poll() == (None, 110.0)
+    clock.now = 108.0
+    link.received()
+    assert link.poll() == (None, 118.0)
+
+    clock.now = 118.0
+    assert link.poll() == ('ping', 123.0)
+    token = link.start_ping()
+    assert link.poll() == (None, 123.0)
+    clock.now = 118.25
+    assert link.pong("someone-else") is None
+    link.received()
+    assert link.pong(token) == 0.25
+    assert link.pong(token) is None
+
+    for rtt in (0.5, 1.0, 2.0):
+        clock.now += 20
+        assert link.poll()[0] == 'ping'
+        token = link.start_ping()
+        clock.now += rtt
+        link.received()
+        link.pong(token)
+    stats = link.stats()
+    assert stats['rtt_history'] == [0.5, 1.0, 2.0]
+    assert (stats['rtt'], stats['rtt_min'], stats['rtt_max']) == (2.0, 0.5, 2.0)
+    assert stats['pings_sent'] == stats['pongs_received'] == 4
+
+    # Any data after a PING shows the link is alive, even before the PONG
+    clock.now += 20
+    assert link.poll()[0] == 'ping'
+    link.start_ping()
+    clock.now += 4
+    link.received()
+    clock.now += 4
+    assert link.poll() == (None, clock.now + 6)
+
+    clock.now += 6
+    assert link.poll()[0] == 'ping'
+    link.start_ping()
+    clock.now += 5
+    assert link.poll() == ('dead', None)
+    assert link.stats()['dead_links'] == 1
+
+    link.reset()
+    assert link.poll() == (None, clock.now + 10)
+    assert len(link.rtts) == 3
+
+
+def test_round_trip_times():
+    """Both engines PING an idle server and record the round trip times"""
+    server = FakeIRCServer()
+    port = server.start_in_thread()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for client_class in (IRCClient, AsyncIRCClient):
+                client = client_class("127.0.0.1", port, "pinger", keepalive=KeepalivePolicy(0.02, 0.1))
+                assert client.connect()
+                assert wait_for(lambda: client.link.pongs_received >= 3)
+                stats = client.link_stats()
+                assert 0 < stats['rtt'] < 1.0 and len(stats['rtt_history']) >= 3
+                assert stats['dead_links'] == 0 and client.running
+                client.disconnect()
+        assert IRCClient("127.0.0.1", port, "me").link_stats() is None
+    finally:
+        server.stop()
+
+
+def test_dead_link():
+    """A server that stops answering is dropped, and reconnected if wanted"""
+    # Connections are queued by the kernel but never answered
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+    port = listener.getsockname()[1]
+    keepalive = KeepalivePolicy(interval=0.05, timeout=0.1)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            for client_class in (IRCClient, AsyncIRCClient):
+                client = client_class("127.0.0.1", port, "stuck", keepalive=keepalive)
+                assert client.connect()
+                assert wait_for(lambda: not client.running)
+                assert client.link.dead_links == 1 and not client.reconnecting
+
+                client = client_class("127.0.0.1", port, "stuck", keepalive=keepalive,
+                                      reconnect=ReconnectPolicy(0.01, 0.01, max_attempts=2))
+                assert client.connect()
+                assert wait_for(lambda: client.link.dead_links == 3 and not client.reconnecting)
+                assert not client.running
+        assert out.getvalue().count("dropping the connection") == 8
+        assert out.getvalue().count("gave up after 2 reconnect attempts") == 2
+    finally:
+        listener.close()
+
+
+if __name__ == "__main__":
+    test_link_monitor()
+    test_round_trip_times()
+    test_dead_link()
+    print("All keepalive tests passed")
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Tests for the IRC line parser
+"""
+from irc_parser import parse_message
+
+
+def test_privmsg():
+    """A PRIVMSG is split into prefix parts, params and trailing"""
+    msg = parse_message(":nick!user@host PRIVMSG #chan :hello there")
+    assert msg.prefix == "nick!user@host"
+    assert (msg.nick, msg.user, msg.host) == ("nick", "user", "host")
+    assert msg.command == "PRIVMSG"
+    assert msg.params == ("#chan", "hello there")
+    assert msg.trailing == "hello there"
+
+
+def test_numeric_without_trailing_colon():
+    """Middle params are kept when there is no trailing param"""
+    msg = parse_message(":server 366 me #chan End")
+    assert msg.nick == "server"
+    assert msg.user is None
+    assert msg.params == ("me", "#chan", "End")
+    assert msg.trailing is None
+
+
+def test_names_reply():
+    """The '=' channel type in 353 is a normal middle param"""
+    msg = parse_message(":server 353 me = #chan :@op +voice user")
+    assert msg.params == ("me", "=", "#chan", "@op +voice user")
+
+
+def test_ping_and_tags():
+    """Lines without a prefix and with IRCv3 tags are parsed"""
+    assert parse_message("PING :irc.example.com").params == ("irc.example.com",)
+    msg = parse_message("@time=2024-01-01T00:00:00Z :n!u@h JOIN #chan")
+    assert msg.tags == "time=2024-01-01T00:00:00Z"
+    assert msg.command == "JOIN"
+    assert msg.params == ("#chan",)
+
+
+def test_empty_trailing_and_invalid():
+    """An empty trailing param is kept and empty lines are rejected"""
+    assert parse_message("PRIVMSG #chan :").params == ("#chan", "")
+    assert parse_message("") is None
+    assert parse_message(":prefix-only") is None
+
+
+if __name__ == "__main__":
+    test_privmsg()
+    test_numeric_without_trailing_colon()
+    test_names_reply()
+    test_ping_and_tags()
+    test_empty_trailing_and_invalid()
+    print("All parser tests passed")
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Tests for reconnecting with backoff and rejoining channels, against the
+fake IRC server
+"""
+import contextlib
+import io
+import time
+
+from irc_async import AsyncIRCClient
+from irc_client import IRCClient
+from irc_fake_server import FakeIRCServer
+from irc_reconnect import ReconnectPolicy, join_lines
+from test_irc_fake_server import wait_for
+
+FAST = ReconnectPolicy(initial=0.05, maximum=0.1)
+
+
+def connect(port, nickname, client_class, policy=FAST):
+    """A registered client that reconnects; returns it and its list of 001 messages"""
+    client = client_class("127.0.0.1", port, nickname, send_rate=1000, send_burst=1000,
+                          reconnect=policy)
+    welcomed = []
+    client.add_handler('001', welcomed.append)
+    assert client.connect()
+    assert wait_for(lambda: welcomed)
+    return client, welcomed
+
+
+def channel_size(server, name):
+    """Members of a channel on the fake server, 0 if it does not exist"""
+    channel = server.call(server.find_channel, name)
+    return len(channel.members) if channel else 0
+
+
+def user_channels(server, nick):
+    """Channels a user is in on the fake server, None if not connected"""
+    user = server.call(server.find_user, nick)
+    return user.channels if user else None
+
+
+def test_backoff():
+    """The backoff ceiling doubles up to the maximum; delays are jittered below it"""
+    policy = ReconnectPolicy(initial=1.0, maximum=10.0)
+    assert [policy.delay(n, random=lambda: 1.0) for n in range(6)] == [1, 2, 4, 8, 10, 10]
+    assert policy.delay(3, random=lambda: 0.0) == 0.0
+    delays = [policy.delay(2) for _ in range(100)]
+    assert all(0 <= delay <= 4 for delay in delays)
+    assert len(set(delays)) > 1
+    assert policy.delay(10 ** 6, random=lambda: 1.0) == 10.0
+
+    limited = ReconnectPolicy(max_attempts=2)
+    assert limited.delay(1) is not None
+    assert limited.delay(2) is None
+
+
+def test_join_lines():
+    """Channels are packed into as few JOIN lines as fit"""
+    assert join_lines([]) == []
+    assert join_lines(["#a", "#b", "#c"]) == ["JOIN #a,#b,#c"]
+    channels = [f"#channel-{n:03}" for n in range(100)]
+    lines = join_lines(channels)
+    assert len(lines) == 3
+    assert all(len(line) <= 510 for line in lines)
+    assert [c for line in lines for c in line[5:].split(',')] == channels
+    assert join_lines(["#a", "#b", "#c"], limit=len("JOIN #a,#b")) == ["JOIN #a,#b", "JOIN #c"]
+
+    # The limit is in bytes: each of these names is 4 characters but 8 bytes
+    channels = [f"#{n % 10}☃☃" for n in range(100)]
+    lines = join_lines(channels)
+    assert all(len(line.encode('utf-8')) <= 510 for line in lines)
+    assert [c for line in lines for c in line[5:].split(',')] == channels
+    assert join_lines(["#☃", "#☃"], limit=len("JOIN #☃,#☃".encode('utf-8'))) == ["JOIN #☃,#☃"]
+
+
+def test_reconnect_and_rejoin():
+    """A dropped client registers again and rejoins its channels with one JOIN"""
+    server = FakeIRCServer(record=True)
+    port = server.start_in_thread()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            for client_class, nickname in ((IRCClient, "threaded"), (AsyncIRCClient, "async")):
+                client, welcomed = connect(port, nickname, client_class)
+                for channel in ("#a", "#b", "#c"):
+                    client.join_channel(channel)
+                assert wait_for(lambda: all(client.channel_users.get(c) for c in ("#a", "#b", "#c")))
+
+                server.call(server.received.clear)
+                server.call(server.kill, nickname)
+                assert wait_for(lambda: len(welcomed) == 2)
+                assert wait_for(lambda: user_channels(server, nickname) == {"#a", "#b", "#c"})
+                joins = [line for line in server.call(list, server.received) if line.startswith("JOIN")]
+                assert joins == ["JOIN #a,#b,#c"]
+                assert not client.reconnecting and client.reconnect_attempts == 0
+                assert client.channel_users["#b"] == {nickname}
+
+                client.disconnect()
+                assert wait_for(lambda: server.call(server.find_user, nickname) is None)
+                time.sleep(0.2)
+                assert server.call(server.find_user, nickname) is None
+        assert out.getvalue().count("Reconnected to 127.0.0.1") == 2
+    finally:
+        server.stop()
+
+
+def test_server_restart():
+    """Clients keep trying while the server is down and come back once it is up"""
+    server = FakeIRCServer()
+    port = server.start_in_thread()
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        clients = [connect(port, f"client{n}", client_class)
+                   for n, client_class in enumerate((IRCClient, AsyncIRCClient))]
+        for client, welcomed in clients:
+            client.join_channel("#restart")
+        assert wait_for(lambda: channel_size(server, "#restart") == 2)
+        server.stop()
+        time.sleep(0.3)
+
+        server = FakeIRCServer()
+        server.start_in_thread(port=port)
+        try:
+            assert wait_for(lambda: all(len(welcomed) == 2 for client, welcomed in clients))
+            assert wait_for(lambda: channel_size(server, "#restart") == 2)
+        finally:
+            for client, welcomed in clients:
+                client.disconnect()
+            server.stop()
+    assert "Connection error" in out.getvalue()
+
+
+def test_give_up_and_cancel():
+    """Reconnecting stops after max_attempts, or when disconnect() is called"""
+    server = FakeIRCServer()
+    port = server.start_in_thread()
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        gives_up, _ = connect(port, "quitter", IRCClient, ReconnectPolicy(0.01, 0.02, max_attempts=2))
+        waits, _ = connect(port, "waiter", AsyncIRCClient, ReconnectPolicy(initial=60))
+        server.stop()
+        assert wait_for(lambda: waits.reconnecting and waits.reconnect_timer)
+        waits.disconnect()
+        assert not waits.reconnecting
+        assert wait_for(lambda: gives_up.reconnect_attempts == 2 and not gives_up.reconnecting)
+        assert not gives_up.running
+    assert "gave up after 2 reconnect attempts" in out.getvalue()
+
+
+if __name__ == "__main__":
+    test_backoff()
+    test_join_lines()
+    test_reconnect_and_rejoin()
+    test_server_restart()
+    test_give_up_and_cancel()
+    print("All reconnect tests passed")
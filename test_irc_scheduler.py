@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared deadline scheduler
+"""
+import contextlib
+import io
+import threading
+import time
+
+from irc_scheduler import DeadlineScheduler, get_shared_scheduler
+
+
+def test_calls_in_deadline_order():
+    """Callbacks run once their deadlines pass, earliest first, except cancelled ones"""
+    scheduler = DeadlineScheduler()
+    calls = []
+    done = threading.Event()
+    now = time.monotonic()
+    scheduler.schedule(lambda: (calls.append('last'), done.set()), now + 0.06)
+    scheduler.schedule(lambda: calls.append('first'), now + 0.02)
+    cancelled = scheduler.schedule(lambda: calls.append('cancelled'), now + 0.04)
+    scheduler.schedule(lambda: calls.append('overdue'), now - 1)
+    scheduler.cancel(cancelled)
+    assert done.wait(2)
+    assert calls == ['overdue', 'first', 'last']
+
+
+def test_failing_callback_does_not_stop_the_thread():
+    """An exception is reported and later callbacks still run"""
+    scheduler = DeadlineScheduler()
+    done = threading.Event()
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        scheduler.schedule(lambda: 1 / 0, time.monotonic())
+        scheduler.schedule(done.set, time.monotonic() + 0.01)
+        assert done.wait(2)
+    assert "Scheduled call failed" in out.getvalue()
+    assert get_shared_scheduler() is get_shared_scheduler()
+
+
+if __name__ == "__main__":
+    test_calls_in_deadline_order()
+    test_failing_callback_does_not_stop_the_thread()
+    print("All scheduler tests passed")
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Tests for TLS connections, against the fake IRC server serving TLS with
+self-signed certificates made by the openssl command
+"""
+import contextlib
+import hashlib
+import io
+import os
+import shutil
+import ssl
+import subprocess
+import tempfile
+
+from irc_async import AsyncIRCClient
+from irc_client import IRCClient
+from irc_fake_server import FakeIRCServer
+from irc_tls import create_tls_context, get_shared_tls_context
+from test_irc_fake_server import wait_for
+
+
+def make_certificate(directory, name):
+    """Create a self-signed certificate for localhost; returns (certfile, keyfile)"""
+    certfile = os.path.join(directory, f"{name}.pem")
+    keyfile = os.path.join(directory, f"{name}.key")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+                    "-nodes", "-days", "2", "-subj", "/CN=localhost",
+                    "-addext", "subjectAltName=DNS:localhost",
+                    "-keyout", keyfile, "-out", certfile],
+                   check=True, capture_output=True)
+    return certfile, keyfile
+
+
+@contextlib.contextmanager
+def tls_server(client_ca=None):
+    """A fake IRC server serving TLS; yields (server, port, server certfile)
+
+    With client_ca, clients may present a certificate signed by it.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = make_certificate(directory, "server")
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(certfile, keyfile)
+        if client_ca:
+            context.verify_mode = ssl.CERT_OPTIONAL
+            context.load_verify_locations(client_ca)
+        server = FakeIRCServer()
+        port = server.start_in_thread(ssl=context)
+        try:
+            yield server, port, certfile
+        finally:
+            server.stop()
+
+
+def connect(client_class, port, context, nickname="secure"):
+    """A client connected over TLS and registered, or None if connect failed"""
+    client = client_class("localhost", port, nickname, tls_context=context)
+    welcomed = []
+    client.add_handler('001', welcomed.append)
+    if not client.connect():
+        return None
+    assert wait_for(lambda: welcomed)
+    return client
+
+
+def test_session_resumption():
+    """Reconnects resume the TLS session, whichever engine made it"""
+    if not shutil.which("openssl"):
+        return
+    with tls_server() as (server, port, certfile):
+        context = create_tls_context(cafile=certfile)
+        with contextlib.redirect_stdout(io.StringIO()):
+            resumed = []
+            for client_class in (IRCClient, IRCClient, AsyncIRCClient):
+                client = connect(client_class, port, context)
+                resumed.append(client.tls_resumed)
+                client.disconnect()
+            assert resumed == [False, True, True]
+
+            context.forget("localhost")
+            resumed = []
+            for client_class in (AsyncIRCClient, AsyncIRCClient, IRCClient):
+                client = connect(client_class, port, context)
+                resumed.append(client.tls_resumed)
+                client.disconnect()
+            assert resumed == [False, True, True]
+
+
+def test_certificate_verification():
+    """Self-signed servers are refused unless trusted or verification is off"""
+    if not shutil.which("openssl"):
+        return
+    with tls_server() as (server, port, certfile):
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            for client_class in (IRCClient, AsyncIRCClient):
+                assert connect(client_class, port, create_tls_context()) is None
+                connect(client_class, port, create_tls_context(verify=False)).disconnect()
+        assert out.getvalue().count("CERTIFICATE_VERIFY_FAILED") == 2
+
+
+def test_client_certificate():
+    """A client certificate is presented, for CertFP"""
+    if not shutil.which("openssl"):
+        return
+    with tempfile.TemporaryDirectory() as directory:
+        client_cert, client_key = make_certificate(directory, "client")
+        with open(client_cert) as f:
+            fingerprint = hashlib.sha256(ssl.PEM_cert_to_DER_cert(f.read())).hexdigest()
+        with tls_server(client_ca=client_cert) as (server, port, certfile):
+            context = create_tls_context(cafile=certfile, certfile=client_cert, keyfile=client_key)
+            with contextlib.redirect_stdout(io.StringIO()):
+                for client_class, nickname in ((IRCClient, "certfp"), (AsyncIRCClient, "certfp2")):
+                    client = connect(client_class, port, context, nickname)
+                    assert server.call(lambda: server.users[nickname].certfp) == fingerprint
+                    client.disconnect()
+
+
+def test_shared_context():
+    """Clients asking for TLS with default settings share one context"""
+    first = IRCClient("irc.example.com", 6697, "me", tls=True)
+    second = AsyncIRCClient("irc.example.net", 6697, "me", tls=True)
+    assert first.tls_context is second.tls_context is get_shared_tls_context()
+    assert get_shared_tls_context(verify=False) is get_shared_tls_context(verify=False)
+    assert get_shared_tls_context(verify=False) is not first.tls_context
+    assert IRCClient("irc.example.com", 6667, "me").tls_context is None
+
+
+if __name__ == "__main__":
+    test_session_resumption()
+    test_certificate_verification()
+    test_client_certificate()
+    test_shared_context()
+    print("All TLS tests passed")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Tests for per-stage latency tracing
+"""
+import contextlib
+import io
+
+from irc_client import IRCClient
+from irc_trace import LatencyHistogram, LatencyTracer
+from irc_web_session import SessionRegistry, message_targets
+
+
+def test_histogram():
+    """Durations land in buckets; percentiles are bucket bounds"""
+    histogram = LatencyHistogram(bounds=(0.001, 0.01, 0.1))
+    for seconds in [0.0005] * 90 + [0.005] * 9 + [0.5]:
+        histogram.add(seconds)
+    stats = histogram.snapshot()
+    assert stats['count'] == 100
+    assert stats['max'] == 0.5
+    assert stats['p50'] == 0.001
+    assert stats['p90'] == 0.001
+    assert stats['p99'] == 0.01
+    assert histogram.percentile(1.0) == 0.5
+    assert stats['buckets'] == [[0.001, 90], [0.01, 9], [None, 1]]
+    assert LatencyHistogram().snapshot()['p99'] == 0.0
+
+
+class TracedClient(IRCClient):
+    """IRCClient passing messages to a web session, like the web GUI's"""
+
+    def __init__(self, session, tracer):
+        super().__init__("irc.example.com", 6667, "me", tracer=tracer)
+        self.send = lambda message: None
+        self.session = session
+
+    def handle_message(self, msg):
+        targets = message_targets(msg, self)
+        super().handle_message(msg)
+        self.session.on_message('net', msg, targets)
+
+
+def test_stages_from_receive_to_ack():
+    """Every stage is recorded for lines that reach the browser"""
+    tracer = LatencyTracer()
+    acks = []
+    emitted = []
+
+    def emit(event, data, callback=None):
+        emitted.append(data)
+        acks.append(callback)
+
+    session = SessionRegistry(emit_window=0, tracer=tracer).attach('sid', None, emit)[0]
+    client = TracedClient(session, tracer)
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.received_at = tracer.now()
+        client.process_message(":alice!a@h PRIVMSG #test :one")
+        client.process_message(":alice!a@h PRIVMSG #test :two")
+        # Not shown anywhere, so never emitted
+        client.process_message("PING :server")
+    session.send_event('channel_topic', {'channel': '#test', 'topic': 'not traced'})
+    assert len(emitted) == 3
+
+    for callback in acks[:2]:
+        callback()
+    stats = tracer.snapshot()['stages']
+    assert stats['parse']['count'] == 3
+    assert stats['handler']['count'] == 3
+    assert stats['queue']['count'] == 2
+    assert stats['total']['count'] == 2
+    assert stats['emit']['count'] == 3
+    assert stats['ack']['count'] == 2
+    assert stats['total']['max'] >= stats['queue']['max']
+
+    tracer.reset()
+    assert tracer.snapshot()['stages']['parse']['count'] == 0
+
+
+def test_disabled_by_default():
+    """Without a tracer nothing is recorded and emits are unchanged"""
+    emitted = []
+    session = SessionRegistry(emit_window=0).attach(
+        'sid', None, lambda event, data, callback=None: emitted.append(data))[0]
+    client = TracedClient(session, None)
+    with contextlib.redirect_stdout(io.StringIO()):
+        client.process_message(":alice!a@h PRIVMSG #test :one")
+    assert client.received_at == 0.0
+    assert session.events.traced == []
+    assert len(emitted) == 1
+
+
+if __name__ == "__main__":
+    test_histogram()
+    test_stages_from_receive_to_ack()
+    test_disabled_by_default()
+    print("All tracing tests passed")
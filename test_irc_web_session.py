@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Tests for the web GUI's per-session state
+"""
+import contextlib
+import io
+import threading
+import time
+
+from irc_client import IRCClient
+from irc_parser import parse_message
+from irc_scheduler import DeadlineScheduler
+from irc_web_session import (SERVER_BUFFER, EmitBatcher, Scrollback, SessionRegistry,
+                             message_event, message_targets)
+
+
+class EmitRecorder:
+    """Collects the events emitted to one browser"""
+
+    def __init__(self):
+        self.events = []
+        self.callbacks = []
+
+    def __call__(self, event, data, callback=None):
+        self.events.append((event, data))
+        self.callbacks.append(callback)
+
+
+def test_sessions_are_independent():
+    """Messages of one session are recorded and emitted only for it"""
+    sessions = SessionRegistry(emit_window=0)
+    first, second = EmitRecorder(), EmitRecorder()
+    sessions.attach("a", None, first)[0].on_message("net", parse_message(":n!u@h PRIVMSG #a :hi"), ["#a"])
+    sessions.attach("b", None, second)
+    event = {'type': 'privmsg', 'nick': 'n', 'target': '#a', 'text': 'hi', 'network': 'net', 'id': 1}
+    assert first.events == [('messages', {'events': [['message', event]]})]
+    assert second.events == []
+    assert sessions.get("a").history("net", "#a") == [event]
+    assert sessions.get("a").history("other", "#a") == []
+    assert sessions.get("b").history("net", "#a") == []
+
+
+class FakeClient:
+    disconnected = False
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+def test_client_attach_and_remove():
+    """A session's client can be swapped and the session closed without a browser"""
+    sessions = SessionRegistry(grace=0)
+    session, reattached = sessions.attach("a", None, EmitRecorder())
+    assert not reattached
+    client = FakeClient()
+    assert session.attach_client("net", client) is None
+    assert sessions.get_client("a") is client
+    assert sessions.get_client("a", "net") is client
+    assert session.attach_client("net", client) is client
+
+    # With a second network, each is asked for by id
+    other = FakeClient()
+    session.attach_client("other", other)
+    assert sessions.get_client("a") is None
+    assert sessions.get_client("a", "other") is other
+    sessions.detach("a")
+    assert sessions.get_client("a") is None
+    assert not sessions.is_open(session)
+    assert client.disconnected and other.disconnected
+
+
+def test_session_survives_reload():
+    """A browser that comes back within the grace period gets its session back"""
+    sessions = SessionRegistry(grace=60, emit_window=0)
+    first = EmitRecorder()
+    session, _ = sessions.attach("sid1", None, first)
+    client = FakeClient()
+    session.attach_client("net", client)
+    sessions.detach("sid1")
+    assert sessions.get("sid1") is None
+
+    # Received while detached: kept for the replay, not sent anywhere
+    session.on_message("net", parse_message(":n!u@h PRIVMSG #a :hi"), ["#a"])
+    assert first.events == []
+    assert sessions.reap() == 0
+
+    second = EmitRecorder()
+    assert sessions.attach("sid2", session.session_id, second) == (session, True)
+    assert sessions.get_client("sid2") is client
+    session.send_history("net", "#a")
+    event = {'type': 'privmsg', 'nick': 'n', 'target': '#a', 'text': 'hi', 'network': 'net', 'id': 1}
+    assert second.events == [('messages', {'events': [
+        ['history', {'network': 'net', 'target': '#a', 'before': None, 'more': False, 'messages': [event]}]]})]
+
+    # A second tab takes the session over
+    third = EmitRecorder()
+    sessions.attach("sid3", session.session_id, third)
+    assert sessions.get("sid2") is None
+    sessions.detach("sid2")
+    assert session.sid == "sid3"
+
+    sessions.detach("sid3")
+    assert sessions.reap(time.monotonic() + 61) == 1
+    assert client.disconnected
+    assert sessions.attach("sid4", session.session_id, EmitRecorder())[1] is False
+
+
+def test_reap_is_scheduled_and_cancelled():
+    """Detached sessions are reaped by the shared scheduler, not a thread each"""
+    sessions = SessionRegistry(grace=0.05, emit_window=0)
+    kept, gone = sessions.attach("a", None, EmitRecorder())[0], sessions.attach("b", None, EmitRecorder())[0]
+    kept_client, gone_client = FakeClient(), FakeClient()
+    kept.attach_client("net", kept_client)
+    gone.attach_client("net", gone_client)
+    threads = threading.active_count()
+    for n in range(20):
+        sessions.detach(f"a{n - 1}" if n else "a")
+        sessions.attach(f"a{n}", kept.session_id, EmitRecorder())
+        assert kept.reap_handle is None
+    sessions.detach("b")
+    assert gone.reap_handle is not None
+    # At most the scheduler's own thread, if nothing had started it yet
+    assert threading.active_count() <= threads + 1
+
+    for _ in range(200):
+        if gone_client.disconnected:
+            break
+        time.sleep(0.01)
+    assert gone_client.disconnected and not sessions.is_open(gone)
+    time.sleep(0.1)
+    assert not kept_client.disconnected and sessions.is_open(kept)
+
+
+def test_reattach_during_detach():
+    """A browser attaching while the old one is being detached stays attached"""
+    sessions = SessionRegistry(grace=60, emit_window=0)
+    session = sessions.attach("old", None, EmitRecorder())[0]
+    detach_browser = session.detach_browser
+    attaching = threading.Thread(target=sessions.attach,
+                                 args=("new", session.session_id, EmitRecorder()))
+
+    def slow_detach_browser():
+        # The reattach gets every chance to run in the middle of detach()
+        attaching.start()
+        attaching.join(0.2)
+        detach_browser()
+
+    session.detach_browser = slow_detach_browser
+    sessions.detach("old")
+    attaching.join(2)
+    assert session.sid == "new" and sessions.get("new") is session
+    assert session.reap_handle is None
+    assert sessions.reap(time.monotonic() + 61) == 0 and sessions.is_open(session)
+
+
+def test_scrollback_limits():
+    """Each buffer keeps its newest lines within both the line and byte limits"""
+    scrollback = Scrollback(max_lines=3, max_bytes=60)
+    for i in range(5):
+        scrollback.add(["#a"], parse_message(f":n!u@h PRIVMSG #a :{i}"))
+    assert [msg.trailing for message_id, msg in scrollback.recent("#a")] == ['2', '3', '4']
+    assert [msg.trailing for message_id, msg in scrollback.recent("#a", 1)] == ['4']
+
+    scrollback.add(["#b"], parse_message(":n!u@h PRIVMSG #b :" + "x" * 40))
+    scrollback.add(["#b"], parse_message(":n!u@h PRIVMSG #b :" + "y" * 40))
+    assert [msg.trailing[0] for message_id, msg in scrollback.recent("#b")] == ['y']
+
+    memory = scrollback.memory()
+    assert memory['buffers']['#a'] == {'lines': 3, 'bytes': 3 * len(":n!u@h PRIVMSG #a :0")}
+    assert memory['lines'] == 4
+    assert memory['bytes'] == memory['buffers']['#a']['bytes'] + memory['buffers']['#b']['bytes']
+    assert memory['dropped'] == 3
+
+
+def test_history_pages():
+    """Older history is paged by message id, shared by all buffers"""
+    scrollback = Scrollback()
+    for i in range(6):
+        scrollback.add(["#a"] if i % 2 else ["#a", "#b"], parse_message(f":n!u@h PRIVMSG #a :{i}"))
+    assert [message_id for message_id, msg in scrollback.recent("#b")] == [1, 3, 5]
+    page = scrollback.recent("#a", 2, before=4)
+    assert [message_id for message_id, msg in page] == [2, 3]
+    assert scrollback.has_older("#a", 2)
+    assert not scrollback.has_older("#a", 1)
+
+
+def test_scrollback_drops_buffers():
+    """Query buffers are dropped least recently used first; channels when left"""
+    scrollback = Scrollback(max_queries=2, max_total_bytes=200)
+    for nick in ("a", "b", "a", "c"):
+        scrollback.add([nick], parse_message(f":{nick}!u@h PRIVMSG me :hi"))
+    assert set(scrollback.buffers) == {"a", "c"}
+
+    # Over the total, queries go before any channel does
+    scrollback.add(["#chan"], parse_message(":n!u@h PRIVMSG #chan :" + "x" * 170))
+    assert set(scrollback.buffers) == {"#chan"}
+    scrollback.add(["d"], parse_message(":d!u@h PRIVMSG me :" + "y" * 100))
+    assert set(scrollback.buffers) == {"#chan", "d"}
+    memory = scrollback.memory()
+    assert memory['dropped_buffers'] == 3
+    assert memory['bytes'] == sum(buffer['bytes'] for buffer in memory['buffers'].values())
+
+    sessions = SessionRegistry(emit_window=0)
+    session = sessions.attach("s", None, EmitRecorder())[0]
+    client = FakeClient()
+    client.nickname = "me"
+    session.attach_client("net", client)
+    for line in (":n!u@h PRIVMSG #a :hi", ":n!u@h PRIVMSG #b :hi", ":n!u@h PART #a"):
+        session.on_message("net", parse_message(line), [parse_message(line).params[0]])
+    assert session.history("net", "#a")
+    session.on_message("net", parse_message(":me!u@h PART #a"), ["#a"])
+    session.on_message("net", parse_message(":op!u@h KICK #b me :out"), ["#b"])
+    assert session.history("net", "#a") == [] and session.history("net", "#b") == []
+
+
+def test_left_channel_stays_gone():
+    """Members of a channel we left do not bring its buffer back"""
+    sessions = SessionRegistry(emit_window=0)
+    session = sessions.attach("s", None, EmitRecorder())[0]
+    client = IRCClient("irc.example.com", 6667, "me")
+    session.attach_client("net", client)
+    with contextlib.redirect_stdout(io.StringIO()):
+        for line in (":server 353 me = #a :me bob", ":server 366 me #a :End",
+                     ":bob!b@h PRIVMSG #a :hi", ":me!u@h PART #a",
+                     ":bob!b@h NICK robert", ":robert!b@h QUIT :bye"):
+            msg = parse_message(line)
+            targets = message_targets(msg, client)
+            client.handle_message(msg)
+            session.on_message("net", msg, targets)
+    assert session.history("net", "#a") == []
+    assert ("net", "#a") not in session.scrollback.buffers
+    assert client.members.nick_channels == {} and "#a" not in client.members.versions
+
+
+def test_message_targets():
+    """Messages are filed under their channel, query or the server buffer"""
+    client = IRCClient("irc.example.com", 6667, "me")
+    client.members.add("#a", "bob")
+    client.members.add("#b", "bob")
+
+    def targets(line):
+        return message_targets(parse_message(line), client)
+
+    assert targets(":bob!u@h PRIVMSG #a :hi") == ["#a"]
+    assert targets(":bob!u@h PRIVMSG me :hi") == ["bob"]
+    assert targets(":bob!u@h QUIT :bye") == ["#a", "#b"]
+    assert targets(":bob!u@h NICK robert") == ["#a", "#b"]
+    assert targets(":server 353 me = #a :@bob") == ["#a"]
+    assert targets(":server 001 me :Welcome") == [SERVER_BUFFER]
+    assert targets("PING :server") == []
+
+
+def test_message_events():
+    """Messages are turned into compact typed events"""
+    def event(line):
+        return message_event(parse_message(line))
+
+    assert event(":bob!u@h PRIVMSG #a :\x01ACTION waves\x01") == {
+        'type': 'action', 'nick': 'bob', 'target': '#a', 'text': 'waves'}
+    assert event(":bob!u@h PART #a") == {'type': 'part', 'nick': 'bob', 'channel': '#a', 'text': ''}
+    assert event(":bob!u@h NICK robert") == {'type': 'nick', 'nick': 'bob', 'new': 'robert'}
+    assert event(":op!u@h MODE #a +o bob") == {
+        'type': 'mode', 'nick': 'op', 'target': '#a', 'modes': '+o bob'}
+    assert event(":server 332 me #a :hello") == {'type': 'topic', 'channel': '#a', 'text': 'hello'}
+    assert event(":server 353 me = #a :@bob") == {
+        'type': 'numeric', 'code': '353', 'params': ['=', '#a', '@bob']}
+    assert event("ERROR :Closing link") == {'type': 'command', 'command': 'ERROR', 'params': ['Closing link']}
+
+
+class ManualScheduler:
+    """Records the callbacks scheduled instead of timing them"""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def schedule(self, callback, deadline):
+        self.scheduled.append(callback)
+        return callback
+
+
+def test_batcher_coalesces_events():
+    """Events wait for the window and go out as one batch, in order"""
+    emit, scheduler = EmitRecorder(), ManualScheduler()
+    batcher = EmitBatcher(emit, scheduler, window=10, max_events=3)
+    assert batcher.add('message', {'message': 'a'}) is False
+    assert batcher.add('user_list', {'users': []}) is False
+    assert scheduler.scheduled == [batcher.flush]
+    assert emit.events == []
+
+    batcher.flush()
+    assert emit.events == [('messages', {'events': [['message', {'message': 'a'}],
+                                                    ['user_list', {'users': []}]]})]
+    batcher.flush()
+    assert len(emit.events) == 1
+
+    # A full batch is due at once
+    for i in range(2):
+        batcher.add('message', {'message': i})
+    assert batcher.add('message', {'message': 2}) is True
+    assert batcher.stats()['max_batch'] == 2
+    batcher.flush()
+    assert batcher.stats()['sent_events'] == 5
+    assert batcher.stats()['sent_batches'] == 2
+
+
+def test_history_is_ordered_with_batches():
+    """Replayed history follows the queued lines it contains"""
+    emit = EmitRecorder()
+    session = SessionRegistry(emit_window=10).attach("a", None, emit)[0]
+    session.on_message("net", parse_message(":n!u@h PRIVMSG #a :hi"), ["#a"])
+    session.send_history("net", "#a")
+    event = {'type': 'privmsg', 'nick': 'n', 'target': '#a', 'text': 'hi', 'network': 'net', 'id': 1}
+    assert emit.events == [('messages', {'events': [
+        ['message', event],
+        ['history', {'network': 'net', 'target': "#a", 'before': None, 'more': False, 'messages': [event]}],
+    ]})]
+
+
+def test_scheduler_flushes_after_window():
+    """The shared scheduler thread flushes a batch once its window ends"""
+    emit = EmitRecorder()
+    batcher = EmitBatcher(emit, DeadlineScheduler(), window=0.01)
+    batcher.add('message', {'message': 'a'})
+    for _ in range(200):
+        if emit.events:
+            break
+        time.sleep(0.01)
+    assert emit.events == [('messages', {'events': [['message', {'message': 'a'}]]})]
+
+
+def queued_events(batcher):
+    return [data.get('type', event) for event, data in batcher.events]
+
+
+def test_slow_browser_is_paused():
+    """Batches wait while the browser has too many unacknowledged"""
+    emit, scheduler = EmitRecorder(), ManualScheduler()
+    batcher = EmitBatcher(emit, scheduler, window=0, max_inflight=1)
+    assert batcher.add('message', {'type': 'privmsg'}) is True
+    batcher.flush()
+    assert batcher.add('message', {'type': 'notice'}) is False
+    batcher.flush()
+    assert len(emit.events) == 1
+    assert batcher.stats()['inflight'] == 1
+
+    emit.callbacks[0]()
+    assert emit.events[1] == ('messages', {'events': [['message', {'type': 'notice'}]]})
+
+
+def test_shed_policies():
+    """A browser that falls behind has its queue shed by the policy"""
+    def fill(policy):
+        batcher = EmitBatcher(EmitRecorder(), ManualScheduler(), window=10,
+                              max_queue=8, max_inflight=1, policy=policy)
+        batcher.inflight = 1
+        batcher.add('user_list', {'users': []})
+        for kind in ('join', 'privmsg', 'quit', 'part', 'privmsg', 'nick', 'privmsg', 'join'):
+            batcher.add('message', {'type': kind, 'channel': '#a', 'network': 'net'}, 10)
+        return batcher
+
+    # The oldest messages go first, other events are kept
+    batcher = fill('drop')
+    assert queued_events(batcher) == ['user_list', 'part', 'privmsg', 'nick', 'privmsg', 'join']
+    assert batcher.stats()['dropped'] == 3
+    assert batcher.stats()['queue_bytes'] == batcher.size == 50
+
+    # Membership noise is folded into one summary in place of the first join
+    batcher = fill('collapse')
+    assert queued_events(batcher) == ['user_list', 'summary', 'privmsg', 'privmsg', 'privmsg']
+    assert batcher.events[1][1] == {'type': 'summary', 'network': 'net',
+                                    'join': 2, 'part': 1, 'quit': 1, 'nick': 1, 'targets': ['#a']}
+    assert batcher.stats()['collapsed'] == 5
+    assert batcher.size == 40
+
+    # Messages are discarded and the browser is told to resync
+    batcher = fill('replay')
+    assert queued_events(batcher) == ['user_list']
+    assert batcher.size == 0
+    batcher.inflight = 0
+    batcher.flush()
+    assert batcher.emit.events[0][1]['events'][-1] == ['resync', {'dropped': 8}]
+    assert batcher.stats()['resyncs'] == 1
+
+
+if __name__ == "__main__":
+    test_sessions_are_independent()
+    test_client_attach_and_remove()
+    test_session_survives_reload()
+    test_reap_is_scheduled_and_cancelled()
+    test_reattach_during_detach()
+    test_scrollback_limits()
+    test_history_pages()
+    test_scrollback_drops_buffers()
+    test_left_channel_stays_gone()
+    test_message_targets()
+    test_message_events()
+    test_batcher_coalesces_events()
+    test_history_is_ordered_with_batches()
+    test_scheduler_flushes_after_window()
+    test_slow_browser_is_paused()
+    test_shed_policies()
+    print("All web session tests passed")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Tests for the outbound write queue and flood control
+"""
+import socket
+import time
+
+from irc_writer import IRCWriter, TokenBucket
+
+
+class FakeClock:
+    """Manually advanced clock for TokenBucket"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def read_lines(sock, count):
+    """Read count CRLF-terminated lines from sock"""
+    data = b""
+    while data.count(b"\r\n") < count:
+        data += sock.recv(4096)
+    return data.decode().split("\r\n")[:count]
+
+
+def test_token_bucket_paces_after_burst():
+    """The burst is free, then tokens arrive at the configured rate"""
+    clock = FakeClock()
+    bucket = TokenBucket(rate=0.5, burst=2, clock=clock)
+    for _ in range(2):
+        assert bucket.delay() == 0
+        bucket.consume()
+    assert bucket.delay() == 2.0
+    clock.now = 1.0
+    assert bucket.delay() == 1.0
+    clock.now = 100.0
+    bucket.refill()
+    assert bucket.tokens == 2
+
+
+def test_priority_lines_skip_queued_messages():
+    """PONG is written before messages still waiting for tokens"""
+    reader, writer_sock = socket.socketpair()
+    writer = IRCWriter(writer_sock, rate=5, burst=1)
+    try:
+        with writer.condition:
+            for i in range(3):
+                writer.put(f"PRIVMSG #c :{i}")
+            writer.put("PONG :server")
+        lines = read_lines(reader, 4)
+        assert lines == ["PONG :server", "PRIVMSG #c :0", "PRIVMSG #c :1", "PRIVMSG #c :2"]
+    finally:
+        writer.close()
+        reader.close()
+        writer_sock.close()
+
+
+def test_burst_is_coalesced_and_queue_is_bounded():
+    """Lines within the burst share one sendall and overflow is dropped"""
+    reader, writer_sock = socket.socketpair()
+    writer = IRCWriter(writer_sock, rate=0.001, burst=3, max_queue=4)
+    try:
+        with writer.condition:
+            results = [writer.put(f"PRIVMSG #c :{i}") for i in range(5)]
+        assert results == [True, True, True, True, False]
+        assert len(read_lines(reader, 3)) == 3
+        deadline = time.monotonic() + 2
+        while writer.stats()['sent_lines'] < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        stats = writer.stats()
+        assert stats['sent_lines'] == 3
+        assert stats['sent_batches'] == 1
+        assert stats['dropped'] == 1
+        assert stats['queue_depth'] == 1
+    finally:
+        writer.close()
+        reader.close()
+        writer_sock.close()
+
+
+if __name__ == "__main__":
+    test_token_bucket_paces_after_burst()
+    test_priority_lines_skip_queued_messages()
+    test_burst_is_coalesced_and_queue_is_bounded()
+    print("All writer tests passed")